@@ -1,5 +1,7 @@
 """SQL aggregation tool"""
 from .base import (  # noqa: F401
+    CUBE,
+    ROLLUP,
     AggregateColumn,
     AliasColumn,
     BaseColumn,
@@ -13,6 +15,7 @@ from .base import (  # noqa: F401
     SqlColumn,
 )
 from .columns import (  # noqa: F401
+    ApproxCountUniqueColumn,
     CountColumn,
     CountUniqueColumn,
     MaxColumn,
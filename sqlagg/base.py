@@ -1,11 +1,43 @@
-from collections import Counter, OrderedDict
+from collections import Counter, OrderedDict, namedtuple
+from collections.abc import Mapping
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from decimal import Decimal
+
+import asyncio
+import base64
+import datetime
+import heapq
+import itertools
+import json
+from contextlib import asynccontextmanager
 
 import sqlalchemy
 from sqlalchemy import column, table
+from sqlalchemy.sql.elements import BindParameter
+from sqlalchemy.sql.visitors import replacement_traverse
 
+from sqlagg.cache import StatementCache, Unkeyable, freeze
 from sqlagg.exceptions import ColumnNotFoundException, SqlAggException, \
     DuplicateColumnsException
-from sqlagg.filters import SqlFilter
+from sqlagg.fingerprints import Unfingerprintable, fingerprint
+from sqlagg.memo import current_memo
+from sqlagg.filters import ANDFilter, GTEFilter, GTFilter, ISNULLFilter, LTEFilter, LTFilter, ORFilter, \
+    SqlFilter
+from sqlagg.rows import Row, RowSchema
+from sqlagg.sorting import OrderBy
+
+ROLLUP = 'rollup'
+CUBE = 'cube'
+
+GROUPING_LABEL = '_sqlagg_grouping'
+
+SET_LABEL = '_sqlagg_set'
+
+# the PostgreSQL types that are sorted by their collation
+TEXT_TYPES = ('text', 'character varying', 'character', 'name')
+
+PARTITION_LOWER = '_sqlagg_partition_lower'
+PARTITION_UPPER = '_sqlagg_partition_upper'
 
 
 class SqlColumn(object):
@@ -16,15 +48,117 @@ class SqlColumn(object):
     def build_column(self):
         raise NotImplementedError()
 
+    @property
+    def supports_filtering(self):
+        """Whether ``build_filtered_column`` is supported"""
+        return False
+
+    def build_filtered_column(self, whereclause):
+        """Build the column so that its aggregate only includes rows matching ``whereclause``"""
+        raise NotImplementedError()
+
+    @property
+    def cache_key(self):
+        """Hashable key identifying the SQL generated by this column or None if it can't be cached"""
+        return None
+
+    @property
+    def fingerprint(self):
+        """Digest of ``cache_key`` that is the same in every process or None (see ``sqlagg.fingerprints``)"""
+        return _fingerprint(self.cache_key)
+
+    @property
+    def partial(self):
+        """``PartialAggregate`` computing the column from aggregates of subsets of the rows or None"""
+        return None
+
+
+def partial_aggregate(aggregate_fn, label, with_aggregate):
+    """
+    Return the ``PartialAggregate`` of a column aggregated by ``aggregate_fn`` if it is one of
+    sum, count, min, max or avg (which is computed from a sum and a count), otherwise None.
+
+    :param with_aggregate: Function returning the column aggregated by another function with another label.
+    """
+    try:
+        aggregate = freeze(aggregate_fn)
+    except Unkeyable:
+        return None
+    if aggregate in (('func', 'sum'), ('func', 'count')):
+        return PartialAggregate([with_aggregate(aggregate_fn, label)], merge_sum)
+    if aggregate == ('func', 'min'):
+        return PartialAggregate([with_aggregate(aggregate_fn, label)], merge_min)
+    if aggregate == ('func', 'max'):
+        return PartialAggregate([with_aggregate(aggregate_fn, label)], merge_max)
+    if aggregate == ('func', 'avg'):
+        return PartialAggregate([
+            with_aggregate(sqlalchemy.func.sum, label + '__sum'),
+            with_aggregate(sqlalchemy.func.count, label + '__count'),
+        ], merge_sum, finalize_mean)
+    return None
+
+
+class PartialAggregate(object):
+    """
+    How an aggregate is computed from partial aggregates of subsets of the rows.
+
+    :param columns: ``SqlColumn``s selecting the partial state of a subset of the rows.
+    :param merge: Function combining two states (tuples with a value per column) into one.
+    :param finalize: Function returning the value of the aggregate for a state. Defaults to the first value.
+    """
+    def __init__(self, columns, merge, finalize=None):
+        self.columns = columns
+        self.merge = merge
+        self.finalize = finalize or _first
+
+    def __repr__(self):
+        return "PartialAggregate(%s)" % self.columns
+
+
+def _first(state):
+    return state[0]
+
+
+def _add(a, b):
+    # NULL is the sum of no rows
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return a + b
+
+
+def merge_sum(state, other):
+    return tuple(_add(a, b) for a, b in zip(state, other))
+
+
+def merge_min(state, other):
+    return tuple(a if b is None else b if a is None else min(a, b) for a, b in zip(state, other))
+
+
+def merge_max(state, other):
+    return tuple(a if b is None else b if a is None else max(a, b) for a, b in zip(state, other))
+
+
+def finalize_mean(state):
+    total, count = state
+    if not count:
+        return None
+    if not isinstance(total, (float, Decimal)):
+        total = Decimal(total)
+    return total / count
+
 
 class SimpleSqlColumn(SqlColumn):
     """
     Simple representation of a column with a name and an aggregation function which can be None.
     """
-    def __init__(self, column_name, aggregate_fn=None, alias=None):
+    def __init__(self, column_name, aggregate_fn=None, alias=None, partial_fn=None):
         self.column_name = column_name
         self.alias = alias
         self.aggregate_fn = aggregate_fn
+        # optional function returning the ``PartialAggregate`` for the column instead of the default one
+        self.partial_fn = partial_fn
 
     @property
     def label(self):
@@ -35,10 +169,100 @@ class SimpleSqlColumn(SqlColumn):
         sql_col = self.aggregate_fn(table_column) if self.aggregate_fn else table_column
         return sql_col.label(self.label)
 
+    @property
+    def supports_filtering(self):
+        return self.aggregate_fn is not None
+
+    def build_filtered_column(self, whereclause):
+        table_column = sqlalchemy.case([(whereclause, column(self.column_name))])
+        return self.aggregate_fn(table_column).label(self.label)
+
+    @property
+    def cache_key(self):
+        try:
+            return (type(self), self.column_name, self.label, freeze(self.aggregate_fn))
+        except Unkeyable:
+            return None
+
+    @property
+    def partial(self):
+        if self.partial_fn is not None:
+            return self.partial_fn(self)
+        return partial_aggregate(
+            self.aggregate_fn, self.label,
+            lambda aggregate_fn, label: SimpleSqlColumn(self.column_name, aggregate_fn, label)
+        )
+
     def __repr__(self):
         return "SqlColumn(column_name=%s, aggregate_fn=%s)" % (self.column_name, self.aggregate_fn)
 
 
+class FilteredSqlColumn(SqlColumn):
+    """
+    Wraps a column so that its aggregate only includes rows matching ``filter``.
+    """
+    def __init__(self, sql_column, filter):
+        self.sql_column = sql_column
+        self.filter = filter
+
+    @property
+    def label(self):
+        return self.sql_column.label
+
+    @property
+    def column_name(self):
+        return self.sql_column.column_name
+
+    @property
+    def alias(self):
+        return self.sql_column.alias
+
+    @property
+    def aggregate_fn(self):
+        return self.sql_column.aggregate_fn
+
+    def build_column(self):
+        return self.sql_column.build_filtered_column(self.filter.build_expression())
+
+    @property
+    def cache_key(self):
+        key = self.sql_column.cache_key
+        if key is not None:
+            return (type(self), key, self.filter)
+
+    def __repr__(self):
+        return "FilteredSqlColumn(column=%s, filter=%s)" % (self.sql_column, self.filter)
+
+
+class QueryMarkerColumn(SqlColumn):
+    """
+    Counts the rows matching ``filter`` in each group. Used to tell which of the queries
+    in a ``CombinedQueryMeta`` would have returned the group.
+    """
+    column_name = None
+    alias = None
+    aggregate_fn = sqlalchemy.func.count
+
+    def __init__(self, label, filter=None):
+        self._label = label
+        self.filter = filter
+
+    @property
+    def label(self):
+        return self._label
+
+    def build_column(self):
+        if self.filter is None:
+            return sqlalchemy.func.count().label(self.label)
+        return sqlalchemy.func.count(
+            sqlalchemy.case([(self.filter.build_expression(), sqlalchemy.literal_column("1"))])
+        ).label(self.label)
+
+    @property
+    def cache_key(self):
+        return (type(self), self.label, self.filter)
+
+
 class QueryMeta(object):
     def __init__(self, table_name, filters, group_by, distinct_on, order_by):
         self.filters = filters
@@ -53,24 +277,66 @@ class QueryMeta(object):
     def execute(self, connection, filter_values):
         raise NotImplementedError()
 
+    def execute_many(self, connection, filter_values_list):
+        """Return the rows of ``execute`` for each of the ``filter_values_list``"""
+        return [self.execute(connection, filter_values) for filter_values in filter_values_list]
+
     def get_query_string(self, connection):
         raise NotImplementedError
 
+    def get_query_parameters(self, connection, filter_values):
+        """The values of the parameters of the query string, which together with it identify the result"""
+        return filter_values
+
 
 class SimpleQueryMeta(QueryMeta):
     """
     Metadata about a query including the table being queried, list of columns, filters and group by columns.
+
+    Built and compiled statements are kept in ``statement_cache`` keyed on ``cache_key`` so executing the
+    same query structure again only binds the new filter values.
+
+    Set ``rollups`` to a ``sqlagg.rollups.RollupRegistry`` to run queries on the smallest pre-aggregated
+    rollup table that can answer them instead of ``table_name`` (see ``route``).
+
+    Set ``prepared_statements`` to a ``sqlagg.prepared.PreparedStatements`` to have ``execute`` run the
+    queries as server-side prepared statements that are planned once per connection.
+
+    :param grouping_sets: ``ROLLUP``, ``CUBE`` or a list of grouping sets (lists of group by columns).
+        The query then returns a row per group of each level and a ``GROUPING_LABEL`` column
+        identifying the level of the row (see ``grouping_level``).
     """
-    def __init__(self, table_name, filters, group_by, distinct_on, order_by, start=None, limit=None):
+    statement_cache = StatementCache()
+    rollups = None
+    prepared_statements = None
+
+    def __init__(self, table_name, filters, group_by, distinct_on, order_by, start=None, limit=None,
+                 grouping_sets=None):
         super(SimpleQueryMeta, self).__init__(table_name, filters, group_by, distinct_on, order_by)
         self.start = start
         self.limit = limit
+        self.grouping_sets = grouping_sets
         self.columns = []
 
     def append_column(self, column):
         self.columns.append(column.sql_column)
 
     def _check(self):
+        if self.grouping_sets:
+            if not self.group_by:
+                raise SqlAggException("Grouping sets require group by columns")
+            if self.grouping_sets not in (ROLLUP, CUBE):
+                for grouping_set in self.grouping_sets:
+                    if isinstance(grouping_set, str) or not set(grouping_set) <= set(self.group_by):
+                        raise SqlAggException(
+                            "Grouping set {!r} is not a list of group by columns".format(grouping_set)
+                        )
+                ungrouped = set(self.group_by) - set().union(*self.grouping_sets)
+                if ungrouped:
+                    raise SqlAggException(
+                        "Group by columns missing from all grouping sets: {}".format(', '.join(sorted(ungrouped)))
+                    )
+
         if self.group_by:
             groups = list(self.group_by)
             for c in self.columns:
@@ -90,53 +356,391 @@ class SimpleQueryMeta(QueryMeta):
                 'Use aliases to disambiguate them.'.format(', '.join(duplicates))
             )
 
+    @property
+    def cache_key(self):
+        """
+        Hashable key identifying the structure of this query (everything except the filter values)
+        or None if the query can't be cached.
+        """
+        try:
+            return (type(self),) + freeze((
+                self.table_name, self.columns, self.filters, self.group_by, self.distinct_on,
+                self.order_by, self.start, self.limit, self.grouping_sets
+            ))
+        except Unkeyable:
+            return None
+
+    @property
+    def fingerprint(self):
+        """Digest of ``cache_key`` that is the same in every process or None (see ``sqlagg.fingerprints``)"""
+        return _fingerprint(self.cache_key)
+
     def execute(self, connection, filter_values):
-        query = self._build_query()
-        return connection.execute(query, **filter_values).fetchall()
+        memo = current_memo()
+        if memo is None:
+            return self._fetch_rows(connection, filter_values)
+        query = self._compile(connection, 'select', lambda qm: qm._build_query())
+        return memo.execute(self, query, filter_values, lambda qm: qm._fetch_rows(connection, filter_values))
+
+    def _fetch_rows(self, connection, filter_values):
+        query = self._compile(connection, 'select', lambda qm: qm._build_query())
+        if self.prepared_statements is not None:
+            result = self.prepared_statements.execute(connection, self, query, filter_values)
+        else:
+            result = connection.execute(query, **filter_values)
+        return self._process_rows(result.fetchall())
 
-    def get_query_string(self, connection):
-        query = self._build_query()
-        return str(query.compile(connection))
+    def execute_many(self, connection, filter_values_list):
+        """
+        Same as ``execute`` for each of the ``filter_values_list`` but in a single statement: the query
+        for each set of values is a branch of a ``UNION ALL`` with its own bind parameters and a
+        ``SET_LABEL`` column telling the rows of the branches apart.
+        """
+        if not filter_values_list:
+            return []
+        size = len(filter_values_list)
+        query = self._compile(connection, ('many', size), lambda qm: qm._build_many_query(size))
+        params = {}
+        for index, filter_values in enumerate(filter_values_list):
+            params.update((_set_bind_name(index, key), value) for key, value in filter_values.items())
+
+        rows = [[] for _ in range(size)]
+        for sql_row in connection.execute(query, **params):
+            row = dict(sql_row.items())
+            rows[row.pop(SET_LABEL)].append(row)
+        return [self._process_rows(set_rows) for set_rows in rows]
+
+    def iter_execute(self, connection, filter_values, batch_size=1000, order_by_groups=False):
+        """
+        Generator version of ``execute`` that reads the rows from a server side cursor
+        ``batch_size`` rows at a time.
 
-    def count(self, connection, filter_values):
-        assert self.start is None
-        assert self.limit is None
-        self._check()
-        query = self._build_query_generic(self.columns, group_by=self.group_by, filters=self.filters,
-                                          distinct_on=self.distinct_on)
+        :param order_by_groups: Order the rows by the group by columns instead of ``order_by``.
+        """
+        for rows in self.iter_batches(connection, filter_values, batch_size, order_by_groups):
+            yield from rows
 
-        if self.group_by or any(col.aggregate_fn for col in self.columns):
-            query = sqlalchemy.select([sqlalchemy.func.count()]).select_from(query.alias())
+    def iter_batches(self, connection, filter_values, batch_size=1000, order_by_groups=False):
+        """Same as ``iter_execute`` but yields lists of up to ``batch_size`` rows"""
+        if order_by_groups:
+            query = self._compile(connection, 'select_by_groups', lambda qm: qm._build_query_ordered_by_groups())
         else:
-            query = query.with_only_columns([sqlalchemy.func.count()]).order_by(None)
-        return connection.execute(query, **filter_values).scalar()
+            query = self._compile(connection, 'select', lambda qm: qm._build_query())
+        result = connection.execution_options(stream_results=True).execute(query, **filter_values)
+        try:
+            while True:
+                rows = result.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield self._process_rows(rows)
+        finally:
+            result.close()
 
-    def totals(self, connection, filter_values, total_columns):
-        assert self.start is None
-        assert self.limit is None
-        self._check()
+    def get_query_string(self, connection):
+        return str(self._compile(connection, 'select', lambda qm: qm._build_query()))
 
-        subquery = self._build_query_generic(self.columns, self.group_by, self.filters, self.distinct_on).alias()
-        query = sqlalchemy.select().select_from(subquery)
+    def get_query_parameters(self, connection, filter_values):
+        # includes the values bound when the statement is built (e.g. of ``SumWhen``), which aren't in the SQL
+        return self._compile(connection, 'select', lambda qm: qm._build_query()).construct_params(filter_values)
 
-        for total_column in total_columns:
-            column = SimpleSqlColumn(total_column, sqlalchemy.func.sum)
-            query.append_column(column.build_column())
+    def count(self, connection, filter_values):
+        query = self._count_statement(connection)
+        return _memoized(
+            self, 'count', query, filter_values, lambda: connection.execute(query, **filter_values).scalar()
+        )
 
-        return dict(zip(
+    def totals(self, connection, filter_values, total_columns):
+        query = self._totals_statement(connection, total_columns)
+        return _memoized(self, 'totals', query, filter_values, lambda: dict(zip(
             total_columns,
             connection.execute(query, **filter_values).fetchall()[0]
-        ))
+        )))
+
+    @property
+    def grouping_levels(self):
+        """
+        The levels returned by the query as tuples of the grouped columns, e.g. for ``ROLLUP``
+        with ``group_by=['region', 'sub_region']``: ``[('region', 'sub_region'), ('region',), ()]``
+        """
+        return _grouping_levels(self.group_by, self.grouping_sets)
+
+    def grouping_level(self, sql_row):
+        """The level of a row as a tuple of the columns it is grouped by"""
+        grouping = sql_row[GROUPING_LABEL] if self.grouping_sets else 0
+        return _grouping_level(self.group_by, grouping)
+
+    def execute_keyset(self, connection, filter_values, after=None):
+        """
+        Execute the query for one page of keyset (seek) pagination: rows are ordered by ``keyset``
+        and only the rows after ``after`` (the ``keyset_values`` of the last row of the previous page)
+        are returned, so each page costs the same regardless of how deep it is.
+        """
+        keyset = self.keyset
+        params = dict(filter_values)
+        if after is not None:
+            if len(after) != len(keyset):
+                raise SqlAggException("Page token doesn't match the query's ordering")
+            params.update(('_sqlagg_seek_%s' % index, value) for index, value in enumerate(after))
+        query = self._compile(
+            connection, ('keyset', after is not None), lambda qm: qm._build_keyset_query(after is not None)
+        )
+        return self._process_rows(connection.execute(query, **params).fetchall())
+
+    @property
+    def keyset(self):
+        """
+        The ``order_by`` columns followed by any group by columns that aren't already in it
+        so that the ordering of grouped queries is unique.
+        """
+        self._check()
+        ordered = {order_by.column_name for order_by in self.order_by}
+        return list(self.order_by) + [OrderBy(group) for group in self.group_by if group not in ordered]
+
+    def keyset_values(self, row):
+        return [row[order_by.column_name] for order_by in self.keyset]
+
+    def execute_page(self, connection, filter_values, total_columns=()):
+        """
+        Returns ``(rows, count, totals)`` from a single statement: the page of rows (``start`` / ``limit``),
+        the number of rows the query returns without paging and the sums of ``total_columns``
+        (the same values as ``count`` and ``totals``).
+
+        The aggregation runs once in a subquery; the count and totals are window aggregates over it.
+        """
+        total_columns = list(total_columns)
+        query = self._compile(
+            connection, ('page', tuple(total_columns)), lambda qm: qm._build_page_query(total_columns)
+        )
+        result = connection.execute(query, **filter_values)
+        keys = result.keys()
+        labels = [label for label in keys if not label.startswith('_sqlagg_total')]
+        sql_rows = result.fetchall()
+        if not sql_rows:
+            if self.start:
+                # the page is past the end so the window aggregates weren't computed
+                count = connection.execute(self._count_statement(connection, paged=True), **filter_values)
+                totals = {}
+                if total_columns:
+                    result = connection.execute(
+                        self._totals_statement(connection, total_columns, paged=True), **filter_values
+                    )
+                    totals = dict(zip(total_columns, result.fetchall()[0]))
+                return [], count.scalar(), totals
+            return [], 0, {total_column: None for total_column in total_columns}
+
+        first_row = sql_rows[0]
+        totals = {
+            total_column: first_row['_sqlagg_total_%s' % index]
+            for index, total_column in enumerate(total_columns)
+        }
+        rows = [{label: sql_row[label] for label in labels} for sql_row in sql_rows]
+        return self._process_rows(rows), first_row['_sqlagg_total_count'], totals
+
+    async def aexecute(self, connection, filter_values):
+        """
+        Coroutine version of ``execute``. ``connection`` must provide a ``dialect`` and an
+        ``execute(statement, parameters)`` coroutine that runs the compiled statement and returns
+        a buffered result with ``fetchall()`` and ``scalar()`` methods, whose rows iterate over their
+        values and have a ``keys()`` method (like SQLAlchemy's rows and asyncpg's records).
+
+        ``statement`` is compiled for the connection's ``dialect`` and ``parameters`` is the dict of the
+        values of all of its bind parameters keyed on their names (``statement.construct_params``),
+        including those bound when the statement is built (e.g. by ``SumWhen``, LIMIT and OFFSET). For
+        drivers with positional placeholders the values are in the order of ``statement.positiontup``.
+        """
+        query = self._compile(connection, 'select', lambda qm: qm._build_query())
+        result = await connection.execute(query, query.construct_params(filter_values))
+        return self._process_rows(result.fetchall())
+
+    async def acount(self, connection, filter_values):
+        query = self._count_statement(connection)
+        result = await connection.execute(query, query.construct_params(filter_values))
+        return result.scalar()
+
+    async def atotals(self, connection, filter_values, total_columns):
+        query = self._totals_statement(connection, total_columns)
+        result = await connection.execute(query, query.construct_params(filter_values))
+        return dict(zip(total_columns, result.fetchall()[0]))
+
+    def partial_query_meta(self, filters=None):
+        """
+        Return a query for mergeable partial results of this query (see ``PartialQueryMeta``) or None
+        if its results can't be merged.
+
+        :param filters: Filters to use instead of the query's filters.
+        """
+        if not PartialQueryMeta.can_merge(self):
+            return None
+        return PartialQueryMeta(self, filters)
+
+    def _count_statement(self, connection, paged=False):
+        if not paged:
+            assert self.start is None
+            assert self.limit is None
+        return self._compile(connection, 'count', lambda qm: qm._build_count_query())
+
+    def _totals_statement(self, connection, total_columns, paged=False):
+        if not paged:
+            assert self.start is None
+            assert self.limit is None
+        return self._compile(
+            connection, ('totals', tuple(total_columns)), lambda qm: qm._build_totals_query(total_columns)
+        )
+
+    def _compile(self, connection, kind, build_query):
+        """
+        Return the compiled statement for ``connection``, building it with ``build_query(query_meta)``
+        unless an identical statement is already in the cache. The query is built from ``route()``.
+        """
+        self._check()
+        query_meta = self.route()
+        key = query_meta.cache_key
+        if key is not None:
+            key = (kind, key, connection.dialect)
+        return self.statement_cache.get(key, lambda: build_query(query_meta).compile(dialect=connection.dialect))
+
+    def route(self):
+        """
+        Return the query meta to run: this one or, if one of the ``rollups`` can answer it,
+        the equivalent query on that rollup table.
+        """
+        if self.rollups is None:
+            return self
+        return self.rollups.route(self)
 
     def _build_query(self):
         self._check()
         return self._build_query_generic(
             self.columns, self.group_by,
-            self.filters, self.distinct_on, self.order_by, self.start, self.limit
+            self.filters, self.distinct_on, self.order_by, self.start, self.limit, self.grouping_sets
         )
 
+    def _build_many_query(self, size):
+        query = self._build_query()
+        branches = []
+        for index in range(size):
+            branch = _with_set_binds(query, index)
+            branches.append(branch.column(sqlalchemy.literal_column(str(index)).label(SET_LABEL)))
+        many_query = sqlalchemy.union_all(*branches)
+        if self.order_by:
+            # the rows of a branch are only ordered within the branch so they are sorted again, as far as
+            # the order by columns are selected
+            labels = {c.label for c in self.columns}
+            order_by = list(itertools.takewhile(lambda o: o.column_name in labels, self.order_by))
+            many_query = many_query.order_by(column(SET_LABEL), *[o.build_expression() for o in order_by])
+        return many_query
+
+    def _build_query_ordered_by_groups(self):
+        """
+        The query ordered by the group by columns the same way as Python sorts their values (with NULLs
+        last) so that the rows of different queries can be merged on their groups while they are read
+        """
+        self._check()
+        query = self._build_query_generic(
+            self.columns, self.group_by, self.filters, self.distinct_on, None, self.start, self.limit
+        )
+        column_names = [c.column_name for c in self.columns]
+        for group in self.group_by:
+            if group in column_names:
+                expression = column(group)
+            else:
+                expression = next(c for c in self.columns if c.alias == group).build_column().element
+            # text is sorted by the code points of the characters like Python does, whatever its collation.
+            # The type isn't known when building the query so the first key is NULL for other types.
+            is_text = sqlalchemy.func.pg_typeof(expression).in_(
+                [sqlalchemy.literal_column("'%s'::regtype" % name) for name in TEXT_TYPES]
+            )
+            as_text = sqlalchemy.collate(sqlalchemy.cast(expression, sqlalchemy.Text), 'C')
+            query = query.order_by(sqlalchemy.case([(is_text, as_text)]), expression)
+        return query
+
+    def _build_keyset_query(self, seek):
+        self._check()
+        keyset = self.keyset
+        query = self._build_query_generic(
+            self.columns, self.group_by, self.filters, self.distinct_on, keyset, self.start, self.limit
+        )
+        if not seek:
+            return query
+
+        expressions = []
+        aggregated = False
+        for order_by in keyset:
+            matching = [c for c in self.columns if c.label == order_by.column_name]
+            if matching:
+                expressions.append(matching[0].build_column().element)
+                aggregated = aggregated or (
+                    matching[0].aggregate_fn is not None and order_by.column_name not in self.group_by
+                )
+            else:
+                expressions.append(column(order_by.column_name))
+        values = [sqlalchemy.bindparam('_sqlagg_seek_%s' % index) for index in range(len(keyset))]
+
+        # (k1 after a) OR (k1 IS NOT DISTINCT FROM a AND k2 after b) OR ... where NULLs are sorted like the
+        # database does: last when ascending and first when descending (a row value comparison would skip them)
+        clauses = []
+        for index, order_by in enumerate(keyset):
+            expression, value = expressions[index], values[index]
+            if order_by.is_ascending:
+                after = sqlalchemy.or_(
+                    expression > value, sqlalchemy.and_(expression.is_(None), value.isnot(None))
+                )
+            else:
+                after = sqlalchemy.or_(
+                    expression < value, sqlalchemy.and_(expression.isnot(None), value.is_(None))
+                )
+            clauses.append(sqlalchemy.and_(*(
+                [expressions[i].isnot_distinct_from(values[i]) for i in range(index)] + [after]
+            )))
+        predicate = sqlalchemy.or_(*clauses)
+
+        if aggregated:
+            return query.having(predicate)
+        return query.where(predicate)
+
+    def _process_rows(self, rows):
+        """Hook for subclasses to post-process the rows returned by the database"""
+        return rows
+
+    def _build_page_query(self, total_columns):
+        # DISTINCT ON depends on the ordering so it has to stay in the subquery
+        subquery = self._build_query_generic(
+            self.columns, self.group_by, self.filters, self.distinct_on,
+            self.order_by if self.distinct_on else None
+        ).alias('page')
+        query = sqlalchemy.select([subquery, sqlalchemy.func.count().over().label('_sqlagg_total_count')])
+        for index, total_column in enumerate(total_columns):
+            query.append_column(
+                sqlalchemy.func.sum(subquery.c[total_column]).over().label('_sqlagg_total_%s' % index)
+            )
+
+        for order_by in self.order_by:
+            query = query.order_by(order_by.build_expression())
+        if self.start is not None:
+            query = query.offset(self.start)
+        if self.limit is not None:
+            query = query.limit(self.limit)
+        return query
+
+    def _build_count_query(self):
+        query = self._build_query_generic(self.columns, group_by=self.group_by, filters=self.filters,
+                                          distinct_on=self.distinct_on)
+
+        if self.group_by or any(col.aggregate_fn for col in self.columns):
+            return sqlalchemy.select([sqlalchemy.func.count()]).select_from(query.alias())
+        return query.with_only_columns([sqlalchemy.func.count()]).order_by(None)
+
+    def _build_totals_query(self, total_columns):
+        subquery = self._build_query_generic(self.columns, self.group_by, self.filters, self.distinct_on).alias()
+        query = sqlalchemy.select().select_from(subquery)
+
+        for total_column in total_columns:
+            column = SimpleSqlColumn(total_column, sqlalchemy.func.sum)
+            query.append_column(column.build_column())
+        return query
+
     def _build_query_generic(self, columns, group_by=None, filters=None, distinct_on=None,
-                             order_by=None, start=None, limit=None):
+                             order_by=None, start=None, limit=None, grouping_sets=None):
         try:
             query = sqlalchemy.select()
             if group_by or distinct_on:
@@ -152,19 +756,28 @@ class SimpleQueryMeta(QueryMeta):
                             query = query.distinct(aliased_columns[0])
                         else:
                             raise SqlAggException("Distinct on column not present in query columns or aliases")
+                group_columns = []
                 if group_by:
                     for group_key in group_by:
                         if group_key in cols:
-                            query.append_group_by(column(group_key))
+                            group_columns.append(column(group_key))
                         elif group_key in alias:
                             aliased_columns = [col.build_column() for col in columns if col.alias == group_key]
                             assert len(aliased_columns) == 1, "Only one column should have this alias"
-                            query.append_group_by(aliased_columns[0])
+                            group_columns.append(aliased_columns[0])
                         else:
                             raise SqlAggException("Group by column not present in query columns or aliases")
 
+                if grouping_sets:
+                    query.append_group_by(_grouping_sets_clause(group_by, group_columns, grouping_sets))
+                else:
+                    for group_column in group_columns:
+                        query.append_group_by(group_column)
+
             for c in columns:
                 query.append_column(c.build_column())
+            if group_by and grouping_sets:
+                query.append_column(sqlalchemy.func.grouping(*group_columns).label(GROUPING_LABEL))
         except KeyError as e:
             raise ColumnNotFoundException("Missing column in table (%s): %s" % (self.table_name, e))
 
@@ -173,7 +786,7 @@ class SimpleQueryMeta(QueryMeta):
                 query.append_whereclause(filter.build_expression())
 
         if not query.froms:
-            query = query.select_from(table(self.table_name))
+            query = query.select_from(self._from_clause())
 
         if order_by:
             for order_by_column in order_by:
@@ -187,14 +800,278 @@ class SimpleQueryMeta(QueryMeta):
 
         return query
 
+    def _from_clause(self):
+        """The table the query selects from"""
+        return table(self.table_name)
+
     def __repr__(self):
         return "Querymeta(columns=%s, filters=%s, group_by=%s, distinct_on=%s, order_by=%s, table=%s)" % \
                (self.columns, self.filters, self.group_by, self.distinct_on, self.order_by, self.table_name)
 
 
+class CombinedQueryMeta(SimpleQueryMeta):
+    """
+    Runs several grouped SimpleQueryMetas that only differ in their filters as a single query.
+
+    Each query's filters are moved into its aggregates (``sum(CASE WHEN <filters> THEN col END)``)
+    and the WHERE clause becomes the OR of all the queries' filters so the table is only scanned once.
+    A marker column per query records whether that query would have returned the group at all
+    so that the rows match what the separate queries would have returned.
+    """
+    def __init__(self, query_metas):
+        first = query_metas[0]
+        super(CombinedQueryMeta, self).__init__(
+            first.table_name, None, first.group_by, first.distinct_on, first.order_by
+        )
+        self.query_metas = query_metas
+        self.query_labels = []
+        group_columns = [c for c in first.columns if c.label in first.group_by]
+        self.columns.extend(group_columns)
+
+        filters = []
+        for index, query_meta in enumerate(query_metas):
+            filter = _combine_filters(query_meta.filters)
+            marker = QueryMarkerColumn('_sqlagg_query_%s' % index, filter)
+            labels = []
+            for sql_column in query_meta.columns:
+                if sql_column.label not in first.group_by:
+                    self.columns.append(FilteredSqlColumn(sql_column, filter) if filter else sql_column)
+                    labels.append(sql_column.label)
+            self.columns.append(marker)
+            self.query_labels.append((marker.label, labels))
+            filters.append(filter)
+
+        if all(filters):
+            self.filters = [_combine_filters(filters, ORFilter)]
+
+    @staticmethod
+    def can_combine(query_meta):
+        query_meta._check()
+        return (
+            type(query_meta) is SimpleQueryMeta
+            and query_meta.group_by
+            and not query_meta.grouping_sets
+            and not query_meta.distinct_on
+            and query_meta.start is None
+            and query_meta.limit is None
+            and all(
+                c.cache_key is not None if c.label in query_meta.group_by else c.supports_filtering
+                for c in query_meta.columns
+            )
+        )
+
+    def _process_rows(self, rows):
+        combined_rows = []
+        for sql_row in rows:
+            row = {group: sql_row[group] for group in self.group_by}
+            for marker, labels in self.query_labels:
+                if sql_row[marker]:
+                    row.update((label, sql_row[label]) for label in labels)
+            combined_rows.append(row)
+        return combined_rows
+
+    def __repr__(self):
+        return "CombinedQueryMeta(%s)" % self.query_metas
+
+
+class PartialQueryMeta(SimpleQueryMeta):
+    """
+    Selects the partial aggregates (see ``SqlColumn.partial``) of a grouped or aggregate-only
+    SimpleQueryMeta so that the results for different subsets of the rows can be merged
+    with ``merge`` and turned into the rows of the query with ``finalize``.
+
+    :param filters: Filters to use instead of the query's filters.
+    """
+    def __init__(self, query_meta, filters=None):
+        group_by = query_meta.group_by or []
+        super(PartialQueryMeta, self).__init__(
+            query_meta.table_name, query_meta.filters if filters is None else filters, group_by, None,
+            [order_by for order_by in query_meta.order_by or [] if order_by.column_name in group_by]
+        )
+        query_meta._check()
+        self.query_meta = query_meta
+        self.partials = []
+        for sql_column in query_meta.columns:
+            if sql_column.label in group_by:
+                self.columns.append(sql_column)
+            else:
+                partial = sql_column.partial
+                self.partials.append((sql_column.label, partial))
+                self.columns.extend(partial.columns)
+
+    @staticmethod
+    def can_merge(query_meta):
+        """Whether the results of the query for subsets of the rows can be merged"""
+        if type(query_meta) is not SimpleQueryMeta:
+            return False
+        query_meta._check()
+        group_by = query_meta.group_by or []
+        aggregates = [c for c in query_meta.columns if c.label not in group_by]
+        return (
+            query_meta.start is None
+            and query_meta.limit is None
+            and not query_meta.distinct_on
+            and not query_meta.grouping_sets
+            and bool(aggregates)
+            and all(c.partial is not None for c in aggregates)
+        )
+
+    def merge(self, states, rows):
+        """
+        Merge ``rows`` returned by this query into ``states``, an OrderedDict mapping row keys
+        to ``(group values, partial states)``. Returns the keys of the rows that changed.
+        """
+        group_by = self.group_by
+        changed = []
+        for sql_row in rows:
+            row_key = QueryContext._get_row_key(group_by, sql_row, 0)
+            row_states = [
+                tuple(sql_row[c.label] for c in partial.columns) for _, partial in self.partials
+            ]
+            if row_key in states:
+                groups, previous = states[row_key]
+                row_states = [
+                    partial.merge(state, row_state)
+                    for (_, partial), state, row_state in zip(self.partials, previous, row_states)
+                ]
+            else:
+                groups = {group: sql_row[group] for group in group_by}
+            states[row_key] = (groups, row_states)
+            changed.append(row_key)
+        return changed
+
+    def finalize(self, states, sort=False):
+        """
+        Return the rows of the query for the merged ``states``
+
+        :param sort: Sort the rows by the query's ``order_by``.
+        """
+        rows = []
+        for groups, row_states in states.values():
+            row = dict(groups)
+            for (label, partial), state in zip(self.partials, row_states):
+                row[label] = partial.finalize(state)
+            rows.append(row)
+
+        if sort:
+            _sort_rows(rows, self.query_meta.order_by)
+        return rows
+
+    def __repr__(self):
+        return "PartialQueryMeta(%r)" % self.query_meta
+
+
+def _fingerprint(key):
+    if key is None:
+        return None
+    try:
+        return fingerprint(key)
+    except Unfingerprintable:
+        return None
+
+
+def _memoized(query_meta, kind, compiled, filter_values, compute):
+    memo = current_memo()
+    if memo is None:
+        return compute()
+    return memo.fetch(query_meta, kind, compiled, filter_values, compute)
+
+
+def _set_bind_name(index, key):
+    return '_sqlagg_set%d_%s' % (index, key)
+
+
+def _with_set_binds(query, index):
+    """Copy of ``query`` with its bind parameters renamed with ``_set_bind_name``"""
+    def rename(element):
+        # anonymous parameters (``unique``) are given new names by the compiler already
+        if isinstance(element, BindParameter) and not element.unique:
+            renamed = element._clone()
+            renamed.key = _set_bind_name(index, element.key)
+            return renamed
+        return None
+
+    return replacement_traverse(query, {}, rename)
+
+
+def _sort_rows(rows, order_by):
+    # sort by the last column first so that the sort on the first column is the main one; NULLs are
+    # sorted like the database does: last when ascending and first when descending
+    for order in reversed(order_by or []):
+        rows.sort(
+            key=lambda row: (row.get(order.column_name) is None, row.get(order.column_name)),
+            reverse=not order.is_ascending
+        )
+
+
+def _grouping_sets_clause(group_by, group_columns, grouping_sets):
+    if grouping_sets == ROLLUP:
+        return sqlalchemy.func.rollup(*group_columns)
+    if grouping_sets == CUBE:
+        return sqlalchemy.func.cube(*group_columns)
+    return sqlalchemy.func.grouping_sets(*[
+        sqlalchemy.tuple_(*[
+            group_column for group, group_column in zip(group_by, group_columns) if group in grouping_set
+        ])
+        for grouping_set in grouping_sets
+    ])
+
+
+def _grouping_levels(group_by, grouping_sets):
+    group_by = tuple(group_by or ())
+    if not grouping_sets:
+        return [group_by]
+    if grouping_sets == ROLLUP:
+        return [group_by[:size] for size in range(len(group_by), -1, -1)]
+    if grouping_sets == CUBE:
+        return [
+            level for size in range(len(group_by), -1, -1)
+            for level in itertools.combinations(group_by, size)
+        ]
+    return [tuple(group for group in group_by if group in grouping_set) for grouping_set in grouping_sets]
+
+
+def _grouping_level(group_by, grouping):
+    # GROUPING() sets the bit of each rolled up column, the last column being the lowest bit
+    last = len(group_by) - 1
+    return tuple(group for index, group in enumerate(group_by) if not grouping >> (last - index) & 1)
+
+
+def _range_filters(filters, range_filter):
+    if range_filter is None:
+        return filters
+    return list(filters or []) + [range_filter]
+
+
+def _combine_filters(filters, filter_cls=ANDFilter):
+    if not filters:
+        return None
+    if len(filters) == 1:
+        return filters[0]
+    return filter_cls(list(filters))
+
+
+Page = namedtuple('Page', 'data count totals')
+Delta = namedtuple('Delta', 'data changed')
+
+
 class QueryContext(object):
+    """
+    :param combine_queries: Run queries on the same table with the same grouping that only differ in
+        their filters as a single query (see ``CombinedQueryMeta``).
+    :param grouping_sets: ``ROLLUP``, ``CUBE`` or a list of grouping sets to get the rows of several
+        grouping levels from a single query. ``resolve`` then returns the rows of each level separately.
+    :param result_cache: ``sqlagg.cache.ResultCache`` used by ``resolve``, ``resolve_concurrent`` and
+        ``aresolve`` to cache the rows of each query.
+    :param sample: ``sqlagg.sampling.Sample`` to run the queries on a sample of the rows. Sums and counts
+        are then estimates scaled up to all the rows. Queries aren't combined when sampling.
+    :param compact_rows: Return the rows of ``resolve``, ``resolve_concurrent`` and ``aresolve`` as
+        ``sqlagg.rows.Row`` objects, which use less memory than dicts for large results but aren't dicts
+        (e.g. they can't be passed to ``json.dumps`` as is).
+    """
     def __init__(self, table, filters=None, group_by=None, distinct_on=None, order_by=None,
-                 start=None, limit=None):
+                 start=None, limit=None, combine_queries=False, grouping_sets=None, result_cache=None,
+                 sample=None, compact_rows=False):
         self.table_name = table
         self.filters = filters or []
         self.group_by = group_by or []
@@ -202,7 +1079,17 @@ class QueryContext(object):
         self.order_by = order_by or []
         self.start = start
         self.limit = limit
+        self.combine_queries = combine_queries
+        self.grouping_sets = grouping_sets
+        self.result_cache = result_cache
+        self.sample = sample
+        self.compact_rows = compact_rows
+        # ``sqlagg.summary.SummaryTable`` that resolve reads from when it has the requested results
+        self.summary = None
         self.query_meta = {}
+        # columns defining aliased group by columns, which the queries of ``QueryColumn``s also need
+        self._group_columns = []
+        self._query_column_metas = []
 
         if self.filters:
             assert all(isinstance(f, SqlFilter) for f in self.filters)
@@ -216,13 +1103,37 @@ class QueryContext(object):
             return
 
         query_key = column.column_key
-        query = self.query_meta.setdefault(query_key, self._new_query_meta(column))
+        query = self.query_meta.get(query_key)
+        if query is None:
+            query = self.query_meta[query_key] = self._new_query_meta(column)
+            if isinstance(column, QueryColumn):
+                self._query_column_metas.append(query)
+                for group_column in self._group_columns:
+                    self._append_group_column(query, group_column)
         query.append_column(column)
 
+        if not isinstance(column, QueryColumn) and column.alias in (column.group_by or self.group_by):
+            self._group_columns.append(column)
+            for query_column_meta in self._query_column_metas:
+                self._append_group_column(query_column_meta, column)
+
+    def _append_group_column(self, query_meta, column):
+        if (
+            isinstance(query_meta, SimpleQueryMeta)
+            and column.alias in (query_meta.group_by or [])
+            and (column.table_name or self.table_name) == query_meta.table_name
+            and column.alias not in [c.label for c in query_meta.columns]
+        ):
+            query_meta.append_column(column)
+
     def _new_query_meta(self, column):
         if isinstance(column, QueryColumn):
-            return column.get_query_meta(self.table_name, self.filters, self.group_by, self.distinct_on,
-                                         self.order_by)
+            query_meta = column.get_query_meta(self.table_name, self.filters, self.group_by, self.distinct_on,
+                                               self.order_by)
+            if isinstance(query_meta, SimpleQueryMeta) and query_meta.start is None and query_meta.limit is None:
+                query_meta.start = self.start
+                query_meta.limit = self.limit
+            return query_meta
         else:
             table_name = column.table_name or self.table_name
             filters = column.filters or self.filters
@@ -230,22 +1141,12 @@ class QueryContext(object):
             order_by = column.order_by or self.order_by
             return SimpleQueryMeta(
                 table_name, filters, group_by, self.distinct_on, order_by,
-                start=self.start, limit=self.limit
+                start=self.start, limit=self.limit, grouping_sets=self.grouping_sets
             )
 
     def count(self, connection, filter_values=None):
         self.connection = connection
-        query_meta_values = list(self.query_meta.values())
-        if query_meta_values:
-            return query_meta_values[0].count(
-                connection, filter_values or {}
-            )
-        else:
-            query_meta = SimpleQueryMeta(
-                self.table_name, self.filters, self.group_by, self.distinct_on, self.order_by,
-                start=self.start, limit=self.limit
-            )
-            return query_meta.count(connection, filter_values or {})
+        return self._count_query_meta().count(connection, filter_values or {})
 
     def totals(self, connection, total_columns, filter_values=None):
         self.connection = connection
@@ -256,6 +1157,15 @@ class QueryContext(object):
             )
         return {column: None for column in total_columns}
 
+    def _count_query_meta(self):
+        query_meta_values = list(self.query_meta.values())
+        if query_meta_values:
+            return query_meta_values[0]
+        return SimpleQueryMeta(
+            self.table_name, self.filters, self.group_by, self.distinct_on, self.order_by,
+            start=self.start, limit=self.limit
+        )
+
     def resolve(self, connection, filter_values=None):
         """
         Returns a dict containing the data of the following format:
@@ -277,41 +1187,655 @@ class QueryContext(object):
                     ('region1', 'subregion1'): {'region': 'region1', 'sub_region': 'subregion1', 'col_a': 1}
                     ('region1', 'subregion2'): {...}
                  }
+
+        The rows are dicts, or ``sqlagg.rows.Row`` objects with ``compact_rows``.
+
+        With ``grouping_sets`` the dict maps each level (the tuple of columns the level is grouped by)
+        to the rows of that level in the format above, e.g. with ``ROLLUP``:
+            {
+                ('region', 'sub_region'): {('region1', 'subregion1'): {...}, ...},
+                ('region',): {'region1': {'region': 'region1', 'sub_region': None, 'col_a': 3}, ...},
+                (): {0: {'region': None, 'sub_region': None, 'col_a': 10}},
+            }
         """
         self.connection = connection
 
         data = OrderedDict()
-        for qm in self.query_meta.values():
-            result = qm.execute(self.connection, filter_values or {})
-
-            for index, sql_row in enumerate(result):
-                if not qm.group_by:
-                    row_key = index
-                elif len(qm.group_by) == 1:
-                    row_key = sql_row[qm.group_by[0]]
-                elif len(qm.group_by) > 1:
-                    row_key = tuple([sql_row[group] for group in qm.group_by])
-
-                if row_key is None:
-                    # null values coming out of the database wreak havoc elsewhere in the code
-                    row_key = ''
-                row = data.setdefault(row_key, {})
-                row.update(kvp for kvp in sql_row.items())
+        schema = RowSchema()
+        if self.summary is not None and self.summary.answers(filter_values):
+            self._add_rows(data, schema, self.summary.query_meta, self.summary.execute(connection))
+            return data
+
+        for qm in self._get_query_metas():
+            result = self._execute(qm, self.connection, filter_values or {})
+            self._add_rows(data, schema, qm, result)
 
         return data
 
+    def resolve_many(self, connection, filter_values_list):
+        """
+        Same as calling ``resolve`` with each of the ``filter_values_list``, returning the list of results,
+        but each query is run once for all of them (see ``SimpleQueryMeta.execute_many``) instead of once
+        per set of values. The ``result_cache`` and ``summary`` aren't used.
+        """
+        self.connection = connection
+        filter_values_list = [filter_values or {} for filter_values in filter_values_list]
+        results = [OrderedDict() for _ in filter_values_list]
+        schema = RowSchema()
+        for qm in self._get_query_metas():
+            for data, rows in zip(results, qm.execute_many(connection, filter_values_list)):
+                self._add_rows(data, schema, qm, rows)
+        return results
+
+    def _execute(self, qm, connection, filter_values):
+        if self.result_cache is None:
+            return qm.execute(connection, filter_values)
+
+        engine = self.result_cache.engine
+
+        def refresh():
+            with engine.connect() as refresh_connection:
+                return qm.execute(refresh_connection, filter_values)
+
+        return self.result_cache.fetch(
+            qm.table_name, qm.get_query_string(connection), qm.get_query_parameters(connection, filter_values),
+            lambda: qm.execute(connection, filter_values), refresh
+        )
+
+    def resolve_concurrent(self, engine, filter_values=None, max_workers=None):
+        """
+        Same as ``resolve`` but each query is run on its own connection from ``engine`` (or anything
+        else with a ``connect()`` method) using a pool of up to ``max_workers`` threads.
+
+        The results are merged in the same order as ``resolve``. When a query fails the queries that
+        haven't started yet are cancelled and, once the running ones have finished, the error of the
+        first failed query (in query order) is raised.
+        """
+        query_metas = self._get_query_metas()
+        filter_values = filter_values or {}
+
+        def execute(qm):
+            with engine.connect() as connection:
+                return self._execute(qm, connection, filter_values)
+
+        data = OrderedDict()
+        schema = RowSchema()
+        if not query_metas:
+            return data
+
+        with ThreadPoolExecutor(max_workers=max_workers or len(query_metas)) as executor:
+            futures = [executor.submit(execute, qm) for qm in query_metas]
+            wait(futures, return_when=FIRST_EXCEPTION)
+            if any(future.done() and future.exception() for future in futures):
+                for future in futures:
+                    future.cancel()
+
+        for future in futures:
+            if not future.cancelled() and future.exception():
+                raise future.exception()
+
+        for qm, future in zip(query_metas, futures):
+            self._add_rows(data, schema, qm, future.result())
+        return data
+
+    async def aresolve(self, bind, filter_values=None):
+        """
+        Coroutine version of ``resolve`` for use with an async driver (see ``SimpleQueryMeta.aexecute``).
+
+        If ``bind`` has a ``connect()`` method (e.g. an async engine) each query is run concurrently on
+        its own connection with the same error handling as ``resolve_concurrent``. Otherwise ``bind`` is
+        used as the connection and the queries are run one after the other.
+        """
+        query_metas = self._get_query_metas()
+        filter_values = filter_values or {}
+        data = OrderedDict()
+        schema = RowSchema()
+        if not hasattr(bind, 'connect'):
+            for qm in query_metas:
+                self._add_rows(data, schema, qm, await self._aexecute(qm, bind, filter_values))
+            return data
+
+        async def execute(qm):
+            async with bind.connect() as connection:
+                return await self._aexecute(qm, connection, filter_values)
+
+        tasks = [asyncio.ensure_future(execute(qm)) for qm in query_metas]
+        if not tasks:
+            return data
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        if any(task.done() and not task.cancelled() and task.exception() for task in tasks):
+            for task in tasks:
+                task.cancel()
+            await asyncio.wait(tasks)
+            for task in tasks:
+                if not task.cancelled() and task.exception():
+                    raise task.exception()
+
+        for qm, rows in zip(query_metas, await asyncio.gather(*tasks)):
+            self._add_rows(data, schema, qm, rows)
+        return data
+
+    async def _aexecute(self, qm, connection, filter_values):
+        if self.result_cache is None:
+            return await qm.aexecute(connection, filter_values)
+        key = self.result_cache.key(
+            qm.table_name, qm.get_query_string(connection), qm.get_query_parameters(connection, filter_values)
+        )
+        rows = self.result_cache.get(key)
+        if rows is None:
+            rows = await qm.aexecute(connection, filter_values)
+            self.result_cache.set(key, qm.table_name, rows)
+        return rows
+
+    async def acount(self, bind, filter_values=None):
+        """Coroutine version of ``count``"""
+        async with _async_connection(bind) as connection:
+            return await self._count_query_meta().acount(connection, filter_values or {})
+
+    async def atotals(self, bind, total_columns, filter_values=None):
+        """Coroutine version of ``totals``"""
+        query_meta_values = list(self.query_meta.values())
+        if not query_meta_values:
+            return {column: None for column in total_columns}
+        async with _async_connection(bind) as connection:
+            return await query_meta_values[0].atotals(connection, filter_values or {}, total_columns)
+
+    def resolve_page(self, connection, total_columns=(), filter_values=None):
+        """
+        Returns a ``Page(data, count, totals)`` where ``data`` is the same as ``resolve`` and ``count``
+        and ``totals`` are the same as ``count`` and ``totals`` but they are all computed by a single
+        execution of the (first) query.
+        """
+        self._check_no_grouping_sets()
+        self.connection = connection
+        filter_values = filter_values or {}
+        data = OrderedDict()
+        schema = RowSchema()
+        query_metas = self._get_query_metas()
+        if not query_metas:
+            return Page(data, self.count(connection, filter_values), {column: None for column in total_columns})
+
+        rows, count, totals = query_metas[0].execute_page(connection, filter_values, total_columns)
+        self._add_rows(data, schema, query_metas[0], rows)
+        for qm in query_metas[1:]:
+            self._add_rows(data, schema, qm, qm.execute(connection, filter_values))
+        return Page(data, count, totals)
+
+    def resolve_incremental(self, connection, watermark_column, filter_values=None):
+        """
+        Incremental version of ``resolve`` for tables where rows are only added (e.g. event tables)
+        with a ``watermark_column`` that increases as they are.
+
+        The partial aggregates of each group (see ``SqlColumn.partial``) and the highest watermark are
+        kept on the context and each call only aggregates the rows past the watermark and merges them
+        into the kept groups. Changing the filter values starts over. If any of the queries has aggregates
+        that can't be merged (``SqlColumn.partial`` is None) or the filter values can't be compared with
+        the previous ones (see ``sqlagg.cache.freeze``), nothing is kept: every call is a full ``resolve``
+        and all the rows are reported as changed.
+
+        Returns a ``Delta(data, changed)`` where ``data`` is the same as ``resolve``, with the rows of each
+        query sorted by ``order_by`` in Python, and ``changed`` is the set of row keys that are new or
+        changed since the previous call.
+        """
+        self.connection = connection
+        filter_values = filter_values or {}
+        query_metas = self._get_query_metas()
+        keys = None
+        # the group by columns are added to the queries by ``partial_query_meta`` so their keys come after
+        if all(qm.partial_query_meta() is not None for qm in query_metas):
+            try:
+                keys = (watermark_column, freeze(filter_values), tuple(qm.cache_key for qm in query_metas))
+            except Unkeyable:
+                pass
+        if keys is None:
+            self._incremental_state = None
+            data = self.resolve(connection, filter_values)
+            return Delta(data, set(data))
+
+        state = getattr(self, '_incremental_state', None)
+        if state is None or state[0] != keys or None in keys[2]:
+            state = (keys, [(None, OrderedDict()) for qm in query_metas])
+
+        changed = set()
+        data = OrderedDict()
+        schema = RowSchema()
+        watermarks = []
+        max_watermark = sqlalchemy.select([sqlalchemy.func.max(column(watermark_column))])
+        for qm, (since, states) in zip(query_metas, state[1]):
+            until = connection.execute(max_watermark.select_from(table(qm.table_name))).scalar()
+            if until is not None and (since is None or until > since):
+                filters = list(qm.filters or []) + [LTEFilter(watermark_column, '_sqlagg_until')]
+                if since is not None:
+                    filters.append(GTFilter(watermark_column, '_sqlagg_since'))
+                partial_qm = qm.partial_query_meta(filters)
+                params = dict(filter_values, _sqlagg_since=since, _sqlagg_until=until)
+                changed.update(partial_qm.merge(states, partial_qm.execute(connection, params)))
+                since = until
+            else:
+                partial_qm = qm.partial_query_meta()
+            watermarks.append((since, states))
+            # groups that are new since the previous call are merged at the end of the states
+            self._add_rows(data, schema, qm, partial_qm.finalize(states, sort=True))
+
+        self._incremental_state = (keys, watermarks)
+        return Delta(data, changed)
+
+    def resolve_shards(self, connections, filter_values=None, max_workers=None):
+        """
+        Same as ``resolve`` for data split across several databases (e.g. shards or partitions that
+        are queried separately) with the same tables: the partial aggregates of each query (see
+        ``SqlColumn.partial``) are computed on each of the ``connections``, using a thread per connection,
+        and merged. The rows are sorted by ``order_by`` after merging.
+
+        All the queries must support merging; ``start`` and ``limit`` aren't supported.
+        """
+        self.connection = connections[0] if connections else None
+        filter_values = filter_values or {}
+        query_metas = self._get_query_metas()
+        partial_query_metas = [qm.partial_query_meta() for qm in query_metas]
+        if None in partial_query_metas:
+            raise SqlAggException("The results of some of the queries can't be merged")
+
+        def execute(connection):
+            return [pqm.execute(connection, filter_values) for pqm in partial_query_metas]
+
+        with ThreadPoolExecutor(max_workers=max_workers or len(connections) or 1) as executor:
+            results = list(executor.map(execute, connections))
+        return self._merge_partial_results(query_metas, partial_query_metas, results)
+
+    def resolve_partitioned(self, engine, partition_column, bounds, filter_values=None, max_workers=None):
+        """
+        Same as ``resolve`` but each query is split into ranges of ``partition_column`` that are run in
+        parallel, each on its own connection from ``engine``, and the partial aggregates of the ranges
+        (see ``SqlColumn.partial``) are merged. The rows are sorted by ``order_by`` after merging.
+
+        The ``bounds`` (e.g. from ``partition_bounds``) split the rows into ``len(bounds) + 1`` ranges:
+        ``partition_column < bounds[0]`` (including NULLs), ``bounds[0] <= partition_column < bounds[1]``,
+        ..., ``partition_column >= bounds[-1]``.
+
+        All the queries must support merging; ``start`` and ``limit`` aren't supported.
+        """
+        filter_values = filter_values or {}
+        query_metas = self._get_query_metas()
+        if any(qm.partial_query_meta() is None for qm in query_metas):
+            raise SqlAggException("The results of some of the queries can't be merged")
+        bounds = list(bounds)
+        if bounds != sorted(bounds):
+            raise SqlAggException("Partition bounds must be sorted")
+
+        lower = GTEFilter(partition_column, PARTITION_LOWER)
+        upper = LTFilter(partition_column, PARTITION_UPPER)
+        ranges = []
+        for index in range(len(bounds) + 1):
+            if index == 0:
+                range_filter = ORFilter([upper, ISNULLFilter(partition_column)]) if bounds else None
+            elif index == len(bounds):
+                range_filter = lower
+            else:
+                range_filter = ANDFilter([lower, upper])
+            range_values = dict(filter_values)
+            if index > 0:
+                range_values[PARTITION_LOWER] = bounds[index - 1]
+            if index < len(bounds):
+                range_values[PARTITION_UPPER] = bounds[index]
+            ranges.append((
+                [qm.partial_query_meta(_range_filters(qm.filters, range_filter)) for qm in query_metas],
+                range_values
+            ))
+
+        def execute(partition):
+            partial_query_metas, range_values = partition
+            with engine.connect() as connection:
+                return [pqm.execute(connection, range_values) for pqm in partial_query_metas]
+
+        with ThreadPoolExecutor(max_workers=max_workers or len(ranges)) as executor:
+            results = list(executor.map(execute, ranges))
+        return self._merge_partial_results(query_metas, ranges[0][0], results)
+
+    def partition_bounds(self, connection, partition_column, partitions, filter_values=None):
+        """
+        Returns the bounds that split the rows of the context's table matching its filters into
+        ``partitions`` ranges of ``partition_column`` with about the same number of rows, for
+        ``resolve_partitioned``. Values that occur more than once can make some of the ranges empty.
+        """
+        fractions = [index / partitions for index in range(1, partitions)]
+        if not fractions:
+            return []
+        partition_expression = column(partition_column)
+        query = sqlalchemy.select([
+            sqlalchemy.func.percentile_disc(sqlalchemy.literal(fractions)).within_group(partition_expression)
+        ]).select_from(table(self.table_name))
+        for filter in self.filters or []:
+            query = query.where(filter.build_expression())
+        bounds = connection.execute(query, **(filter_values or {})).scalar()
+        return sorted({bound for bound in bounds or [] if bound is not None})
+
+    def _merge_partial_results(self, query_metas, partial_query_metas, results):
+        data = OrderedDict()
+        schema = RowSchema()
+        for index, (qm, pqm) in enumerate(zip(query_metas, partial_query_metas)):
+            states = OrderedDict()
+            for result in results:
+                pqm.merge(states, result[index])
+            self._add_rows(data, schema, qm, pqm.finalize(states, sort=True))
+        return data
+
+    def resolve_keyset(self, connection, filter_values=None, page_token=None):
+        """
+        Returns ``(data, next_page_token)`` for a page of ``limit`` rows using keyset (seek) pagination
+        instead of OFFSET. ``data`` is the same as ``resolve``; pass ``next_page_token`` back in to get the
+        next page. It is None after the last page.
+
+        The rows are ordered by ``order_by`` followed by the group by columns. For ungrouped queries
+        ``order_by`` must identify the rows uniquely. The ordering columns must be selected in the query;
+        NULLs are ordered last when ascending and first when descending, as the database orders them.
+        """
+        self._check_no_grouping_sets()
+        if not self.order_by or self.limit is None or self.start:
+            raise SqlAggException("Keyset pagination requires order_by and limit and doesn't support start")
+
+        self.connection = connection
+        after = _decode_page_token(page_token) if page_token else None
+        data = OrderedDict()
+        schema = RowSchema()
+        next_page_token = None
+        for index, qm in enumerate(self._get_query_metas()):
+            rows = qm.execute_keyset(connection, filter_values or {}, after)
+            self._add_rows(data, schema, qm, rows)
+            if index == 0 and rows and len(rows) == qm.limit:
+                next_page_token = _encode_page_token(qm.keyset_values(rows[-1]))
+        return data, next_page_token
+
+    def iter_resolve(self, connection, filter_values=None, batch_size=1000):
+        """
+        Generator version of ``resolve`` that yields ``(row_key, row)`` pairs as the rows are read
+        from the database instead of holding all of them in memory.
+
+        Rows are fetched from server side cursors ``batch_size`` rows at a time. When the context
+        needs more than one query they must all have the same grouping and no ``start`` or ``limit``:
+        each query is then ordered by the group by columns the way Python sorts them (text by code
+        point, whatever the collation of the column) and the rows are merged on their group keys as
+        they are read. Values that the database can't sort like Python (e.g. of case-insensitive
+        ``citext`` columns) raise a ``SqlAggException`` when the rows are out of order.
+        """
+        self._check_no_grouping_sets()
+        self.connection = connection
+        filter_values = filter_values or {}
+        query_metas = self._get_query_metas()
+        if len(query_metas) == 1:
+            qm = query_metas[0]
+            for index, sql_row in enumerate(qm.iter_execute(connection, filter_values, batch_size)):
+                yield self._get_row_key(qm.group_by, sql_row, index), dict(sql_row.items())
+            return
+
+        group_by = query_metas[0].group_by if query_metas else None
+        if any(not qm.group_by or list(qm.group_by) != list(group_by) for qm in query_metas):
+            raise SqlAggException("Streaming multiple queries requires them all to have the same group by")
+        if any(getattr(qm, 'start', None) is not None or getattr(qm, 'limit', None) is not None
+               for qm in query_metas):
+            # the queries are ordered by their groups instead of ``order_by`` so the pages would differ
+            raise SqlAggException("Streaming multiple queries doesn't support start and limit")
+
+        streams = [
+            self._iter_sorted(
+                qm.iter_execute(connection, filter_values, batch_size, order_by_groups=True),
+                group_by, index
+            )
+            for index, qm in enumerate(query_metas)
+        ]
+        for sort_key, rows in itertools.groupby(heapq.merge(*streams), key=lambda item: item[0]):
+            row = {}
+            for _, _, sql_row in rows:
+                row.update(sql_row.items())
+            yield self._get_row_key(group_by, sql_row, None), row
+
+    def resolve_columnar(self, connection, filter_values=None, batch_size=1000):
+        """
+        Returns an OrderedDict mapping each column label (including the group by columns) to a NumPy
+        array with one value per row, in the same row order as ``resolve``.
+
+        The arrays are filled directly from the cursor batches without building a dict per row.
+        Missing values are NaN in numeric arrays and None in object arrays; numeric (Decimal) values
+        are converted to floats. Requires NumPy (``pip install sqlagg[numpy]``).
+        """
+        self._check_no_grouping_sets()
+        numpy = _import_numpy()
+        self.connection = connection
+        filter_values = filter_values or {}
+
+        positions = {}
+        values = OrderedDict()
+        for qm in self._get_query_metas():
+            index = 0
+            for rows in qm.iter_batches(connection, filter_values, batch_size):
+                for sql_row in rows:
+                    row_key = self._get_row_key(qm.group_by, sql_row, index)
+                    position = positions.setdefault(row_key, len(positions))
+                    for label, value in sql_row.items():
+                        column_values = values.get(label)
+                        if column_values is None:
+                            column_values = values[label] = []
+                        if position >= len(column_values):
+                            column_values.extend([None] * (position + 1 - len(column_values)))
+                        column_values[position] = value
+                    index += 1
+
+        for column_values in values.values():
+            column_values.extend([None] * (len(positions) - len(column_values)))
+        return OrderedDict(
+            (label, _to_array(numpy, column_values)) for label, column_values in values.items()
+        )
+
+    @staticmethod
+    def _iter_sorted(rows, group_by, stream_index):
+        """
+        Yield ``(sort_key, stream_index, row)`` for rows ordered by the group by columns
+        with NULLs last, as the database orders them.
+        """
+        previous = None
+        for sql_row in rows:
+            sort_key = tuple((sql_row[group] is None, sql_row[group]) for group in group_by)
+            if previous is not None and sort_key <= previous:
+                raise SqlAggException(
+                    "Rows are not in the expected order. Group by columns must use a collation that "
+                    "sorts values the same way as Python (e.g. COLLATE \"C\") to be streamed."
+                )
+            previous = sort_key
+            yield sort_key, stream_index, sql_row
+
+    @staticmethod
+    def _get_row_key(group_by, sql_row, index):
+        if not group_by:
+            row_key = index
+        elif len(group_by) == 1:
+            row_key = sql_row[group_by[0]]
+        elif len(group_by) > 1:
+            row_key = tuple([sql_row[group] for group in group_by])
+
+        if row_key is None:
+            # null values coming out of the database wreak havoc elsewhere in the code
+            row_key = ''
+        return row_key
+
+    def _check_no_grouping_sets(self):
+        if self.grouping_sets:
+            raise SqlAggException("Grouping sets are only supported by resolve, resolve_concurrent and aresolve")
+
+    def _add_rows(self, data, schema, qm, result):
+        if self.grouping_sets:
+            return self._add_grouping_rows(data, schema, qm, result)
+
+        keys = positions = None
+        for index, sql_row in enumerate(result):
+            row_key = self._get_row_key(qm.group_by, sql_row, index)
+            row = data.get(row_key)
+            if row is None:
+                row = data[row_key] = Row(schema) if self.compact_rows else {}
+
+            # the rows of a database result share their keys so the positions are only looked up once
+            if sql_row.keys() is not keys:
+                keys = sql_row.keys()
+                positions = [schema.position(label) for label in keys]
+            values = sql_row.values() if isinstance(sql_row, Mapping) else sql_row
+            if self.compact_rows:
+                row.set_values(positions, values)
+            else:
+                row.update(zip(keys, values))
+
+    def _add_grouping_rows(self, data, schema, qm, result):
+        grouping_sets = getattr(qm, 'grouping_sets', None)
+        for level in _grouping_levels(qm.group_by, grouping_sets):
+            data.setdefault(level, OrderedDict())
+
+        keys = indexes = positions = grouping_index = None
+        levels = {}
+        counts = Counter()
+        for sql_row in result:
+            if sql_row.keys() is not keys:
+                keys = sql_row.keys()
+                labels = list(keys)
+                indexes = [index for index, label in enumerate(labels) if label != GROUPING_LABEL]
+                row_labels = [labels[index] for index in indexes]
+                positions = [schema.position(label) for label in row_labels]
+                grouping_index = labels.index(GROUPING_LABEL) if GROUPING_LABEL in labels else None
+            values = list(sql_row.values()) if isinstance(sql_row, Mapping) else sql_row
+
+            grouping = values[grouping_index] if grouping_index is not None else 0
+            level = levels.get(grouping)
+            if level is None:
+                level = levels[grouping] = _grouping_level(qm.group_by, grouping)
+            level_data = data.setdefault(level, OrderedDict())
+
+            row_key = self._get_row_key(level, sql_row, counts[level])
+            counts[level] += 1
+            row = level_data.get(row_key)
+            if row is None:
+                row = level_data[row_key] = Row(schema) if self.compact_rows else {}
+            if self.compact_rows:
+                row.set_values(positions, [values[index] for index in indexes])
+            else:
+                row.update(zip(row_labels, [values[index] for index in indexes]))
+
     def get_query_strings(self, connection):
         """Useful for debugging large queryies"""
         self.connection = connection
         return [
             qm.get_query_string(connection)
-            for qm in self.query_meta.values()
+            for qm in self._get_query_metas()
+        ]
+
+    def _get_query_metas(self):
+        query_metas = list(self.query_meta.values())
+        if self.sample is not None:
+            return [self.sample.apply(qm) for qm in query_metas]
+        if not self.combine_queries:
+            return query_metas
+
+        # each entry is either a query meta that can't be combined or a list of combinable ones
+        # that have no labels in common
+        plan = []
+        combinable = {}
+        for qm in query_metas:
+            if not CombinedQueryMeta.can_combine(qm):
+                plan.append(qm)
+                continue
+            key = (
+                qm.table_name,
+                tuple(qm.group_by),
+                tuple(c.cache_key for c in qm.columns if c.label in qm.group_by),
+                tuple(o.cache_key for o in qm.order_by),
+            )
+            labels = {c.label for c in qm.columns if c.label not in qm.group_by}
+            for group, group_labels in combinable.get(key, []):
+                if not labels & group_labels:
+                    group.append(qm)
+                    group_labels.update(labels)
+                    break
+            else:
+                group = [qm]
+                combinable.setdefault(key, []).append((group, labels))
+                plan.append(group)
+
+        return [
+            (CombinedQueryMeta(entry) if len(entry) > 1 else entry[0])
+            if isinstance(entry, list) else entry
+            for entry in plan
         ]
 
     def __str__(self):
         return str(self.query_meta)
 
 
+def _encode_page_token(values):
+    def encode(value):
+        if isinstance(value, datetime.datetime):
+            return {'datetime': value.isoformat()}
+        if isinstance(value, datetime.date):
+            return {'date': value.isoformat()}
+        if isinstance(value, Decimal):
+            return {'decimal': str(value)}
+        return value
+
+    token = json.dumps([encode(value) for value in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(token.encode('utf-8')).decode('ascii')
+
+
+def _decode_page_token(token):
+    def decode(value):
+        if isinstance(value, dict):
+            (value_type, value), = value.items()
+            if value_type == 'datetime':
+                return datetime.datetime.fromisoformat(value)
+            if value_type == 'date':
+                return datetime.date.fromisoformat(value)
+            if value_type == 'decimal':
+                return Decimal(value)
+            raise ValueError(value_type)
+        return value
+
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+        return [decode(value) for value in values]
+    except (TypeError, ValueError) as e:
+        raise SqlAggException("Invalid page token: %s" % e)
+
+
+def _import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise SqlAggException("NumPy is required for columnar results: pip install sqlagg[numpy]")
+    return numpy
+
+
+def _to_array(numpy, values):
+    """Convert a list of values from a single column into the most specific NumPy array"""
+    types = {type(value) for value in values if value is not None}
+    has_nulls = len(types) == 0 or any(value is None for value in values)
+    if types <= {bool} and not has_nulls:
+        return numpy.array(values, dtype=bool)
+    if types <= {int} and not has_nulls:
+        return numpy.array(values, dtype=numpy.int64)
+    if types <= {int, float, Decimal}:
+        return numpy.array([numpy.nan if value is None else float(value) for value in values])
+    if types == {datetime.date}:
+        return numpy.array(values, dtype='datetime64[D]')
+    if types == {datetime.datetime}:
+        return numpy.array(values, dtype='datetime64[us]')
+    if types == {str} and not has_nulls:
+        return numpy.array(values, dtype=str)
+    return numpy.array(values, dtype=object)
+
+
+@asynccontextmanager
+async def _async_connection(bind):
+    if hasattr(bind, 'connect'):
+        async with bind.connect() as connection:
+            yield connection
+    else:
+        yield bind
+
+
 class SqlAggColumn(object):
     @property
     def name(self):
@@ -324,6 +1848,18 @@ class SqlAggColumn(object):
     def get_value(self, row):
         raise NotImplementedError()
 
+    def get_values(self, columns):
+        """Vectorized ``get_value`` for the arrays returned by ``QueryContext.resolve_columnar``"""
+        raise NotImplementedError()
+
+    def fingerprint_key(self):
+        """The structure that ``fingerprint`` is computed from or None if the column can't be fingerprinted"""
+
+    @property
+    def fingerprint(self):
+        """Digest identifying the column that is the same in every process or None"""
+        return _fingerprint(self.fingerprint_key())
+
 
 class QueryColumn(SqlAggColumn):
     def get_query_meta(self, table_name, filters, group_by, distinct_on, order_by):
@@ -332,6 +1868,9 @@ class QueryColumn(SqlAggColumn):
 
 class BaseColumn(SqlAggColumn):
     aggregate_fn = None
+    # Subclasses with an aggregate that ``partial_aggregate`` doesn't know how to merge can define a
+    # ``partial_aggregate(sql_column)`` method returning its ``PartialAggregate`` (see ``SqlColumn.partial``)
+    partial_aggregate = None
 
     def __init__(self, key, alias=None, table_name=None, filters=None, group_by=None, distinct_on=None,
                  order_by=None):
@@ -362,12 +1901,20 @@ class BaseColumn(SqlAggColumn):
 
     @property
     def sql_column(self):
-        return SimpleSqlColumn(self.key, self.aggregate_fn, self.alias)
+        return SimpleSqlColumn(self.key, self.aggregate_fn, self.alias, partial_fn=self.partial_aggregate)
+
+    def fingerprint_key(self):
+        # the query the column is in and the SQL of the column
+        sql_key = self.sql_column.cache_key
+        return (type(self), self.column_key, sql_key) if sql_key is not None else None
 
     def get_value(self, row):
         row_key = self.alias or self.key
         return row.get(row_key, None) if row else None
 
+    def get_values(self, columns):
+        return columns.get(self.alias or self.key)
+
 
 class CustomQueryColumn(BaseColumn, QueryColumn):
     query_cls = None
@@ -408,6 +1955,12 @@ class AliasColumn(SqlAggColumn):
     def get_value(self, row):
         return row.get(self.key, None) if row else None
 
+    def get_values(self, columns):
+        return columns.get(self.key)
+
+    def fingerprint_key(self):
+        return type(self), self.key
+
 
 class AggregateColumn(SqlAggColumn):
     def __init__(self, aggregate_fn, *columns):
@@ -421,3 +1974,12 @@ class AggregateColumn(SqlAggColumn):
     def get_value(self, row):
         values = [v.get_value(row) for v in self.columns]
         return self.aggregate_fn(*values)
+
+    def get_values(self, columns):
+        """Apply ``aggregate_fn`` to whole arrays so it must work element-wise (e.g. ``lambda x, y: x / y``)"""
+        values = [v.get_values(columns) for v in self.columns]
+        return self.aggregate_fn(*values)
+
+    def fingerprint_key(self):
+        keys = [c.fingerprint_key() for c in self.columns]
+        return (type(self), self.aggregate_fn, keys) if None not in keys else None
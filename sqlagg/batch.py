@@ -0,0 +1,181 @@
+from collections import ChainMap, OrderedDict
+
+import sqlalchemy
+from sqlalchemy import Text, asc, cast, column, desc, func, literal_column
+from sqlalchemy.dialects.postgresql import OID, array
+
+from sqlagg.base import SimpleQueryMeta, _set_bind_name, _with_set_binds
+from sqlagg.fingerprints import Unfingerprintable, fingerprint
+from sqlagg.rows import RowSchema
+
+QUERY_LABEL = '_sqlagg_query'
+ROW_LABEL = '_sqlagg_row'
+VALUES_LABEL = '_sqlagg_values'
+TYPES_LABEL = '_sqlagg_types'
+
+
+class QueryBatch(object):
+    """
+    Resolves several ``QueryContext``s (e.g. the reports of a dashboard) in a single round trip to the
+    database instead of a round trip per query.
+
+    The queries of all the contexts are run as one ``UNION ALL`` statement with a branch per query. Each
+    branch packs the rows of its query into an array of their values as text along with the types of
+    the values, which the driver's typecasters convert back so the rows are the same as ``resolve``
+    returns. Identical queries (same ``fingerprint`` and parameter values) are only run once.
+
+    The driver must be psycopg2; with other drivers the queries are run one after another, as are the
+    queries ordered by columns that they don't select (the order of their rows couldn't be kept).
+    """
+    def __init__(self):
+        self.entries = []
+
+    def add(self, query_context, filter_values=None):
+        """Add ``query_context`` to be resolved with ``filter_values``. Returns its index in the results."""
+        self.entries.append((query_context, filter_values or {}))
+        return len(self.entries) - 1
+
+    def resolve(self, connection):
+        """
+        Returns the result of ``resolve`` for each of the contexts in the order they were added.
+        The ``result_cache`` and ``summary`` of the contexts aren't used.
+        """
+        queries = []
+        indexes = {}
+        plan = []
+        for query_context, filter_values in self.entries:
+            query_context.connection = connection
+            query_indexes = []
+            for qm in query_context._get_query_metas():
+                key = _query_key(connection, qm, filter_values)
+                index = indexes.get(key) if key is not None else None
+                if index is None:
+                    index = len(queries)
+                    queries.append((qm, filter_values))
+                    if key is not None:
+                        indexes[key] = index
+                query_indexes.append((qm, index))
+            plan.append(query_indexes)
+
+        rows = self._execute(connection, queries)
+        results = []
+        for (query_context, _), query_indexes in zip(self.entries, plan):
+            data = OrderedDict()
+            schema = RowSchema()
+            for qm, index in query_indexes:
+                query_context._add_rows(data, schema, qm, rows[index])
+            results.append(data)
+        return results
+
+    def _execute(self, connection, queries):
+        typecasters = _typecasters(connection)
+        batched = [
+            index for index, (qm, _) in enumerate(queries)
+            if typecasters is not None and isinstance(qm, SimpleQueryMeta) and _keeps_order(qm)
+        ]
+        rows = [None] * len(queries)
+        for index in sorted(set(range(len(queries))) - set(batched)):
+            qm, filter_values = queries[index]
+            rows[index] = qm.execute(connection, filter_values)
+        if not batched:
+            return rows
+
+        query_metas = [queries[index][0] for index in batched]
+        statement, columns = _compile(connection, query_metas)
+        params = {}
+        for branch, index in enumerate(batched):
+            params.update((_set_bind_name(branch, key), value) for key, value in queries[index][1].items())
+
+        result = connection.execute(statement, **params)
+        cursor = result.cursor
+        branch_rows = [[] for _ in batched]
+        processors = {}
+        for branch, _, values, types in result.fetchall():
+            row = {}
+            for position, ((label, type_), value, oid) in enumerate(zip(columns[branch], values, types)):
+                if value is not None:
+                    key = (branch, position, oid)
+                    if key not in processors:
+                        processors[key] = _processor(connection, typecasters, type_, oid)
+                    value = processors[key](value, cursor)
+                row[label] = value
+            branch_rows[branch].append(row)
+
+        for branch, index in enumerate(batched):
+            rows[index] = query_metas[branch]._process_rows(branch_rows[branch])
+        return rows
+
+    def __repr__(self):
+        return "QueryBatch(%r)" % [query_context for query_context, _ in self.entries]
+
+
+def _query_key(connection, query_meta, filter_values):
+    query_fingerprint = getattr(query_meta, 'fingerprint', None)
+    if query_fingerprint is None:
+        return None
+    compiled = query_meta._compile(connection, 'select', lambda qm: qm._build_query())
+    try:
+        return fingerprint((query_fingerprint, compiled.construct_params(filter_values)))
+    except Unfingerprintable:
+        return None
+
+
+def _keeps_order(query_meta):
+    """Whether the rows of the branch of ``query_meta`` can be numbered in the order of the query"""
+    labels = {c.label for c in query_meta.columns}
+    return all(order.column_name in labels for order in query_meta.order_by or [])
+
+
+def _compile(connection, query_metas):
+    """The compiled batch statement of ``query_metas`` and the ``(label, type)`` of each query's columns"""
+    routed = []
+    for query_meta in query_metas:
+        query_meta._check()
+        routed.append(query_meta.route())
+    key = tuple(qm.cache_key for qm in routed)
+    key = ('batch', key, connection.dialect) if None not in key else None
+
+    def build():
+        branches = []
+        columns = []
+        for index, query_meta in enumerate(routed):
+            query = _with_set_binds(query_meta._build_query(), index).alias('_sqlagg_batch_%d' % index)
+            # numbers the rows in the order of the query so that the order is kept (the order of the
+            # rows of a subquery isn't). Rows the query doesn't order are in no particular order anyway.
+            row_order = [
+                asc(query.c[order.column_name]) if order.is_ascending else desc(query.c[order.column_name])
+                for order in query_meta.order_by or []
+            ]
+            branches.append(sqlalchemy.select([
+                literal_column(str(index)).label(QUERY_LABEL),
+                func.row_number().over(order_by=row_order or None).label(ROW_LABEL),
+                array([cast(c, Text) for c in query.c]).label(VALUES_LABEL),
+                array([cast(func.pg_typeof(c), OID) for c in query.c]).label(TYPES_LABEL),
+            ]).select_from(query))
+            columns.append([(c.key, c.type) for c in query.c])
+        statement = sqlalchemy.union_all(*branches).order_by(column(QUERY_LABEL), column(ROW_LABEL))
+        return statement.compile(dialect=connection.dialect), columns
+
+    return SimpleQueryMeta.statement_cache.get(key, build)
+
+
+def _typecasters(connection):
+    extensions = getattr(connection.dialect.dbapi, 'extensions', None)
+    string_types = getattr(extensions, 'string_types', None)
+    if string_types is None:
+        return None
+    # types registered on the connection (e.g. ``register_uuid(conn_or_curs=...)``) come first
+    return ChainMap(getattr(connection.connection, 'string_types', None) or {}, string_types)
+
+
+def _processor(connection, typecasters, type_, oid):
+    """Function converting the text of a value of type ``oid`` as the driver and SQLAlchemy would"""
+    typecaster = typecasters.get(oid)
+    result_processor = type_.dialect_impl(connection.dialect).result_processor(connection.dialect, oid)
+
+    def process(value, cursor):
+        if typecaster is not None:
+            value = typecaster(value, cursor)
+        return result_processor(value) if result_processor is not None else value
+
+    return process
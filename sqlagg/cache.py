@@ -0,0 +1,384 @@
+import datetime
+import hashlib
+import logging
+import os
+import pickle
+import random
+import tempfile
+import threading
+import time
+import types
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from decimal import Decimal
+
+from sqlalchemy.sql.functions import _FunctionGenerator
+
+from sqlagg.filters import SqlFilter
+from sqlagg.fingerprints import Unfingerprintable, fingerprint
+
+logger = logging.getLogger(__name__)
+
+
+class StatementCache(object):
+    """
+    Bounded LRU cache of built and compiled statements.
+
+    Entries are keyed on the structure of a query (see ``SimpleQueryMeta.cache_key``) so that
+    running the same report definition again only has to bind new filter values.
+    A key of ``None`` means the query can't be fingerprinted and is never cached.
+    """
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, factory):
+        """Return the entry for ``key``, calling ``factory()`` to build it if it isn't cached"""
+        if key is None or not self.maxsize:
+            self.misses += 1
+            return factory()
+
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+
+        value = factory()
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return "StatementCache(hits=%s, misses=%s, maxsize=%s, currsize=%s)" % (
+            self.hits, self.misses, self.maxsize, len(self)
+        )
+
+
+class Unkeyable(Exception):
+    """Raised when part of a query can't be turned into a cache key"""
+
+
+_SCALAR_TYPES = (str, bytes, int, float, Decimal, datetime.date, datetime.time, datetime.timedelta, type(None))
+
+
+def freeze(value):
+    """
+    Convert ``value`` into a hashable structure that identifies it for caching purposes.
+
+    Raises ``Unkeyable`` for values whose effect on the generated SQL can't be determined.
+    """
+    if value is None or isinstance(value, (str, SqlFilter)):
+        return value
+    if isinstance(value, _SCALAR_TYPES):
+        # values that are equal but of different types (e.g. ``True``, ``1``, ``1.0``) give different SQL
+        return (type(value), value)
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, freeze(item)) for key, item in value.items()))
+    if isinstance(value, _FunctionGenerator):
+        return ('func',) + tuple(value._FunctionGenerator__names)
+    if isinstance(value, types.MethodType):
+        # aggregate functions are commonly methods on the column so the instance state is part of the key
+        return (value.__func__, freeze(vars(value.__self__)))
+    if isinstance(value, (types.FunctionType, types.BuiltinFunctionType)):
+        return value
+    cache_key = getattr(value, 'cache_key', None)
+    if cache_key is not None:
+        return cache_key
+    raise Unkeyable(value)
+
+
+class ResultCache(object):
+    """
+    Cache of query results keyed on the SQL of a query and the values of its parameters (see
+    ``QueryMeta.get_query_parameters``), including those bound when the query is built.
+
+    Results are cached per query (see ``QueryContext(result_cache=...)``) so different contexts
+    that run the same query share the cached rows.
+
+    With ``stale_ttl`` results that are older than their ttl are still served for up to ``stale_ttl``
+    more seconds while they are refreshed in the background on a connection from ``engine``.
+    Only one refresh per query runs at a time.
+
+    :param backend: Where the results are stored, a ``MemoryBackend`` by default.
+    :param ttl: Default number of seconds that results are cached for.
+    :param table_ttls: Dict of table name to the ttl of the results of queries on that table.
+    :param jitter: Fraction of the ttl by which each entry's ttl is randomly shortened so that
+        entries cached together don't all expire at the same time.
+    :param stale_ttl: Number of seconds that expired results are served for while being refreshed.
+    :param engine: Engine (or anything else with a ``connect()`` method) used for the refreshes.
+    :param refresh_workers: Number of threads running the refreshes.
+    """
+    clock = staticmethod(time.time)
+
+    def __init__(self, backend=None, ttl=300, table_ttls=None, jitter=0.0, stale_ttl=None, engine=None,
+                 refresh_workers=4):
+        assert not stale_ttl or engine is not None, "Serving stale results requires an engine to refresh them"
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.ttl = ttl
+        self.table_ttls = table_ttls or {}
+        self.jitter = jitter
+        self.stale_ttl = stale_ttl
+        self.engine = engine
+        self.refresh_workers = refresh_workers
+        self._executor = None
+        self._refreshing = {}
+        self._lock = threading.Lock()
+        self.clear_stats()
+
+    def clear_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.refresh_seconds = 0.0
+
+    @property
+    def mean_refresh_seconds(self):
+        return self.refresh_seconds / self.refreshes if self.refreshes else None
+
+    def get_ttl(self, table_name):
+        return self.table_ttls.get(table_name, self.ttl)
+
+    def key(self, table_name, query_string, parameters):
+        """Return the key of a query's result or None if its parameter values can't be keyed"""
+        generation = self.backend.get(self._generation_key(table_name))
+        try:
+            # the same in every process so that processes sharing a backend share the results
+            return fingerprint((table_name, generation, query_string, parameters or {}))
+        except Unfingerprintable:
+            return None
+
+    def get(self, key, refresh=None):
+        """
+        Return the cached rows for ``key`` or None.
+
+        Stale rows are only returned when a ``refresh`` function is given to get the fresh rows
+        in the background (see ``refresh``).
+        """
+        data = self.backend.get(key) if key is not None else None
+        if data is not None:
+            fresh_until, table_name, rows = pickle.loads(data)
+            if fresh_until > self.clock():
+                self.hits += 1
+                return rows
+            if refresh is not None:
+                self.stale_hits += 1
+                self.refresh(key, table_name, refresh)
+                return rows
+        self.misses += 1
+        return None
+
+    def set(self, key, table_name, rows):
+        ttl = self.get_ttl(table_name)
+        if key is None or not ttl:
+            return
+        if self.jitter:
+            ttl *= 1 - random.random() * self.jitter
+        rows = [dict(row.items()) for row in rows]
+        data = pickle.dumps((self.clock() + ttl, table_name, rows), pickle.HIGHEST_PROTOCOL)
+        self.backend.set(key, data, ttl + (self.stale_ttl or 0))
+
+    def fetch(self, table_name, query_string, parameters, execute, refresh=None):
+        """
+        Return the cached rows of a query, calling ``execute()`` to get them if they aren't cached.
+        ``refresh()`` is called in the background to get the rows on a new connection when
+        serving stale rows.
+        """
+        key = self.key(table_name, query_string, parameters)
+        rows = self.get(key, refresh if self.stale_ttl else None)
+        if rows is None:
+            rows = execute()
+            self.set(key, table_name, rows)
+        return rows
+
+    def refresh(self, key, table_name, refresh):
+        """Cache the result of ``refresh()`` in the background unless ``key`` is already being refreshed"""
+        with self._lock:
+            if key in self._refreshing:
+                return
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.refresh_workers, thread_name_prefix='sqlagg-refresh')
+            self._refreshing[key] = self._executor.submit(self._refresh, key, table_name, refresh)
+
+    def _refresh(self, key, table_name, refresh):
+        start = time.monotonic()
+        failed = False
+        try:
+            self.set(key, table_name, refresh())
+        except Exception:
+            failed = True
+            logger.exception("Error refreshing cached result of query on %s", table_name)
+        finally:
+            with self._lock:
+                if failed:
+                    self.refresh_failures += 1
+                else:
+                    self.refreshes += 1
+                    self.refresh_seconds += time.monotonic() - start
+                self._refreshing.pop(key, None)
+
+    def wait(self, timeout=None):
+        """Wait for the running refreshes to finish"""
+        with self._lock:
+            futures = list(self._refreshing.values())
+        wait(futures, timeout)
+
+    def invalidate(self, table_name):
+        """Drop the cached results of all the queries on ``table_name``"""
+        self.backend.set(self._generation_key(table_name), uuid.uuid4().hex, None)
+
+    def clear(self):
+        self.backend.clear()
+        self.clear_stats()
+
+    @staticmethod
+    def _generation_key(table_name):
+        return 'generation-' + hashlib.sha256(table_name.encode('utf-8')).hexdigest()
+
+    def __repr__(self):
+        return "ResultCache(hits=%s, misses=%s, stale_hits=%s, refreshes=%s, backend=%r)" % (
+            self.hits, self.misses, self.stale_hits, self.refreshes, self.backend
+        )
+
+
+class MemoryBackend(object):
+    """
+    In-process LRU ``ResultCache`` backend that holds up to ``max_bytes`` of results.
+    Entries set without a ttl aren't counted and are never evicted.
+    """
+    clock = staticmethod(time.time)
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._pinned = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._pinned:
+                return self._pinned[key]
+            try:
+                expires, value = self._entries[key]
+            except KeyError:
+                return None
+            if expires <= self.clock():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            if ttl is None:
+                self._pinned[key] = value
+                return
+            if key in self._entries:
+                self._remove(key)
+            if len(value) > self.max_bytes:
+                return
+            self._entries[key] = (self.clock() + ttl, value)
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            self._pinned.pop(key, None)
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._pinned.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        _, value = self._entries.pop(key)
+        self.size -= len(value)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return "MemoryBackend(size=%s, max_bytes=%s, entries=%s)" % (self.size, self.max_bytes, len(self))
+
+
+class FileBackend(object):
+    """
+    ``ResultCache`` backend storing each result in a file in ``directory`` so that it can be
+    shared by processes on the same machine (use a directory in ``/dev/shm`` to keep it in memory).
+    """
+    clock = staticmethod(time.time)
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                expires, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if expires is not None and expires <= self.clock():
+            self._unlink(path)
+            return None
+        return value
+
+    def set(self, key, value, ttl):
+        expires = self.clock() + ttl if ttl is not None else None
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((expires, value), f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            self._unlink(tmp_path)
+            raise
+
+    def delete(self, key):
+        self._unlink(self._path(key))
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.cache'):
+                self._unlink(os.path.join(self.directory, name))
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.cache')
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def __repr__(self):
+        return "FileBackend(%r)" % self.directory
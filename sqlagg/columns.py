@@ -1,7 +1,11 @@
 from sqlalchemy import func, distinct, case, text, cast, Integer, column
 from sqlalchemy.dialects.postgresql import aggregate_order_by
-from .base import BaseColumn, SqlColumn
-import uuid
+from .base import BaseColumn, PartialAggregate, QueryColumn, SimpleSqlColumn, SqlColumn, _import_numpy, \
+    merge_sum, partial_aggregate
+from .cache import Unkeyable, freeze
+from .sketches import HyperLogLog, HyperLogLogQueryMeta, HyperLogLogSqlColumn
+import heapq
+import re
 
 
 class SimpleColumn(BaseColumn):
@@ -67,16 +71,100 @@ class MeanColumn(BaseColumn):
         if value is not None:
             return float(value)
 
+    def get_values(self, columns):
+        values = super(MeanColumn, self).get_values(columns)
+        if values is not None:
+            return values.astype(float)
+
 
 class NonzeroSumColumn(BaseColumn):
     def aggregate_fn(self, column):
         return cast(func.sum(column) > 0, Integer)
 
+    def partial_aggregate(self, sql_column):
+        return PartialAggregate(
+            [SimpleSqlColumn(sql_column.column_name, func.sum, sql_column.label)], merge_sum, _finalize_nonzero
+        )
+
+
+def _finalize_nonzero(state):
+    total, = state
+    return int(total > 0) if total is not None else None
+
 
 class CountUniqueColumn(BaseColumn):
+    """Its partial aggregate is the array of the distinct values"""
     def aggregate_fn(self, column):
         return func.count(distinct(column))
 
+    def partial_aggregate(self, sql_column):
+        return PartialAggregate(
+            [SimpleSqlColumn(sql_column.column_name, _array_agg_distinct, sql_column.label)],
+            _merge_union, _finalize_count_unique
+        )
+
+
+def _array_agg_distinct(column):
+    return func.array_agg(distinct(column))
+
+
+def _merge_union(state, other):
+    return tuple(sorted(set(a or ()) | set(b or ()), key=_nulls_last) for a, b in zip(state, other))
+
+
+def _finalize_count_unique(state):
+    values, = state
+    return sum(1 for value in values or () if value is not None)
+
+
+def _nulls_last(value):
+    return (value is None, value)
+
+
+class ApproxCountUniqueColumn(BaseColumn, QueryColumn):
+    """
+    Approximate ``CountUniqueColumn`` for high cardinality columns, estimated from a ``HyperLogLog``
+    sketch of the values of each group that is computed in its own query (see ``HyperLogLogQueryMeta``).
+
+    The rows returned by ``resolve`` hold the sketches, which report the error bounds of the estimate
+    (``sketch.bounds()``) and can be merged with the sketches of other queries. ``get_value`` returns
+    the estimate.
+
+    :param error: The relative standard error of the estimate. Smaller errors need larger sketches.
+    :param hash_fn: See ``HyperLogLogSqlColumn``.
+    """
+    def __init__(self, key, error=0.02, hash_fn=None, *args, **kwargs):
+        super(ApproxCountUniqueColumn, self).__init__(key, *args, **kwargs)
+        self.precision = HyperLogLog.precision_for(error)
+        self.hash_fn = hash_fn
+
+    def get_query_meta(self, default_table_name, default_filters, default_group_by, default_distinct_on,
+                       default_order_by):
+        return HyperLogLogQueryMeta(
+            self.table_name or default_table_name, self.filters or default_filters,
+            self.group_by or default_group_by, self.distinct_on or default_distinct_on,
+            self.order_by or default_order_by
+        )
+
+    @property
+    def column_key(self):
+        return (type(self), self.key, self.alias) + super(ApproxCountUniqueColumn, self).column_key
+
+    @property
+    def sql_column(self):
+        return HyperLogLogSqlColumn(self.key, self.precision, self.alias, self.hash_fn)
+
+    def get_value(self, row):
+        sketch = super(ApproxCountUniqueColumn, self).get_value(row)
+        if sketch is not None:
+            return sketch.count
+
+    def get_values(self, columns):
+        sketches = super(ApproxCountUniqueColumn, self).get_values(columns)
+        if sketches is not None:
+            numpy = _import_numpy()
+            return numpy.array([sketch.count if sketch is not None else numpy.nan for sketch in sketches])
+
 
 class ConditionalAggregation(BaseColumn):
     def __init__(self, key=None, whens=None, else_=None, *args, **kwargs):
@@ -158,18 +246,47 @@ class ConditionalColumn(SqlColumn):
         return self.alias or self.column_name
 
     def build_column(self):
-        if self.column_name:
-            expr = case(value=column(self.column_name), whens=self.whens, else_=self.else_)
-        else:
-            expr = case(whens=self._build_whens(), else_=self.else_)
-
+        expr = self._build_case()
         if self.aggregate_fn:
             expr = self.aggregate_fn(expr)
         return expr.label(self.label)
 
+    @property
+    def supports_filtering(self):
+        return self.aggregate_fn is not None
+
+    def build_filtered_column(self, whereclause):
+        expr = case(whens=[(whereclause, self._build_case())])
+        return self.aggregate_fn(expr).label(self.label)
+
+    def _build_case(self):
+        if self.column_name:
+            return case(value=column(self.column_name), whens=self.whens, else_=self.else_)
+        return case(whens=self._build_whens(), else_=self.else_)
+
+    @property
+    def cache_key(self):
+        try:
+            return (
+                type(self), self.column_name, freeze(self.whens), freeze(self.else_),
+                freeze(self.aggregate_fn), self.alias
+            )
+        except Unkeyable:
+            return None
+
+    @property
+    def partial(self):
+        def with_aggregate(aggregate_fn, label):
+            return ConditionalColumn(self.column_name, self.whens, self.else_, aggregate_fn, label)
+        return partial_aggregate(self.aggregate_fn, self.label, with_aggregate)
+
     def _build_whens(self):
+        # bind names are derived from the label (unique in a query) and the position of the bind so that
+        # building the same column again generates the same SQL. Every character of the label but ASCII
+        # letters and digits is escaped (including ``_``) so that different labels give different names.
+        bind_prefix = '_sqlagg_%s_' % re.sub(r'[^A-Za-z0-9]', lambda m: '_%x_' % ord(m.group()), self.label)
         whens = []
-        for item in self.whens:
+        for when_index, item in enumerate(self.whens):
             when, *binds, then = item
             if binds:
                 binds = list(reversed(binds))
@@ -179,7 +296,7 @@ class ConditionalColumn(SqlColumn):
                     if letter != '?':
                         when_with_named_binds += letter
                     else:
-                        bind_name = 'p' + uuid.uuid4().hex
+                        bind_name = '%s%d_%d' % (bind_prefix, when_index, len(named_binds))
                         when_with_named_binds += ':' + bind_name
                         named_binds[bind_name] = binds.pop()
                 when = text(when_with_named_binds).bindparams(**named_binds)
@@ -201,8 +318,43 @@ class ArrayAggSQLColumn(SqlColumn):
         return self.alias or self.column_name
 
     def build_column(self):
+        return self._build_array_agg().label(self.label)
+
+    supports_filtering = True
+
+    def build_filtered_column(self, whereclause):
+        # a CASE expression would add NULLs to the array so use FILTER (WHERE ...) instead
+        return self._build_array_agg().filter(whereclause).label(self.label)
+
+    def _build_array_agg(self):
         table_column = column(self.column_name)
         if self.order_by_col:
             order_by_column = column(self.order_by_col)
-            return func.array_agg(aggregate_order_by(table_column, order_by_column.asc())).label(self.label)
-        return func.array_agg(table_column).label(self.label)
+            return func.array_agg(aggregate_order_by(table_column, order_by_column.asc()))
+        return func.array_agg(table_column)
+
+    @property
+    def cache_key(self):
+        return (type(self), self.column_name, self.order_by_col, self.alias)
+
+    @property
+    def partial(self):
+        """
+        The arrays of the subsets are concatenated. When ordered the values they are ordered by are
+        also selected so that the arrays can be merged in order.
+        """
+        if not self.order_by_col:
+            # adding lists concatenates them
+            return PartialAggregate([self], merge_sum)
+        return PartialAggregate([
+            self, ArrayAggSQLColumn(self.order_by_col, self.order_by_col, self.label + '__order')
+        ], _merge_ordered)
+
+
+def _merge_ordered(state, other):
+    values = heapq.merge(
+        zip(state[1] or (), state[0] or ()), zip(other[1] or (), other[0] or ()),
+        key=lambda item: _nulls_last(item[0])
+    )
+    orders, values = zip(*values) if state[0] or other[0] else ((), ())
+    return (list(values) or None, list(orders) or None)
@@ -5,6 +5,7 @@ from sqlalchemy import bindparam, text, column
 from sqlalchemy.sql import operators, and_, or_, not_
 
 from sqlagg.exceptions import SqlAggException
+from sqlagg.fingerprints import Unfingerprintable, fingerprint
 
 
 class NotEqMixin(object):
@@ -17,9 +18,26 @@ class SqlFilter(NotEqMixin):
     def build_expression(self):
         raise NotImplementedError()
 
+    def column_names(self):
+        """The set of columns the filter uses or None if they aren't known"""
+        column_name = getattr(self, 'column_name', None)
+        return {column_name} if column_name is not None else None
+
+    def fingerprint_key(self):
+        """The structure that the fingerprint of the filter is computed from"""
+        return type(self), vars(self)
+
+    @property
+    def fingerprint(self):
+        """Digest identifying the filter that is the same in every process or None if it can't be computed"""
+        try:
+            return fingerprint(self)
+        except Unfingerprintable:
+            return None
+
     def __lt__(self, other):
         """Ordering is required for consistent sorting when creating column keys"""
-        return hash(self) < hash(other)
+        return (self.fingerprint or '', hash(self)) < (other.fingerprint or '', hash(other))
 
 
 class RawFilter(SqlFilter):
@@ -145,6 +163,9 @@ class INFilter(BasicFilter):
     def __hash__(self):
         return hash((type(self), self.column_name, self.operator, tuple(sorted(self.parameter))))
 
+    def fingerprint_key(self):
+        return type(self), self.column_name, self.operator, frozenset(self.parameter)
+
 
 class ISNULLFilter(SqlFilter):
     def __init__(self, column_name):
@@ -187,6 +208,9 @@ class NOTFilter(SqlFilter):
     def build_expression(self):
         return not_(self.filter.build_expression())
 
+    def column_names(self):
+        return self.filter.column_names()
+
     def __eq__(self, other):
         return isinstance(other, NOTFilter) and self.filter == other.filter
 
@@ -205,9 +229,15 @@ class ANDFilter(SqlFilter):
     def build_expression(self):
         return and_(*[f.build_expression() for f in self.filters])
 
+    def column_names(self):
+        return _column_names(self.filters)
+
     def __eq__(self, other):
         return isinstance(other, ANDFilter) and set(self.filters) == set(other.filters)
 
+    def fingerprint_key(self):
+        return type(self), frozenset(self.filters)
+
     def __hash__(self):
         return hash((NOTFilter,) + tuple(sorted(self.filters)))
 
@@ -226,9 +256,15 @@ class ORFilter(SqlFilter):
     def build_expression(self):
         return or_(*[f.build_expression() for f in self.filters])
 
+    def column_names(self):
+        return _column_names(self.filters)
+
     def __eq__(self, other):
         return isinstance(other, ORFilter) and set(self.filters) == set(other.filters)
 
+    def fingerprint_key(self):
+        return type(self), frozenset(self.filters)
+
     def __hash__(self):
         return hash((ORFilter,) + tuple(sorted(self.filters)))
 
@@ -236,6 +272,16 @@ class ORFilter(SqlFilter):
         return "SQL({})".format(' OR '.join(self.filters))
 
 
+def _column_names(filters):
+    column_names = set()
+    for filter in filters:
+        names = filter.column_names()
+        if names is None:
+            return None
+        column_names |= names
+    return column_names
+
+
 RAW = RawFilter
 BETWEEN = BetweenFilter
 GT = GTFilter
@@ -0,0 +1,81 @@
+"""
+Stable fingerprints of filters, columns and queries.
+
+Unlike ``hash()``, which is randomized per process for strings, a fingerprint is the same in every
+process and Python version so it can be used to share caches between processes or as a metrics label.
+"""
+import datetime
+import hashlib
+import json
+import types
+from decimal import Decimal
+
+from sqlalchemy.sql.functions import _FunctionGenerator
+
+DIGEST_SIZE = 16
+
+
+class Unfingerprintable(Exception):
+    """Raised for values that don't have a stable serialization, e.g. lambdas"""
+
+
+def fingerprint(value):
+    """Hex digest of the canonical serialization of ``value`` (see ``canonical``)"""
+    serialized = json.dumps(canonical(value), separators=(',', ':'))
+    return hashlib.blake2b(serialized.encode('utf-8'), digest_size=DIGEST_SIZE).hexdigest()
+
+
+def canonical(value):
+    """
+    Convert ``value`` into a structure of lists and strings that only depends on what ``value`` is,
+    not on the process it is in (no ids, hashes or set ordering).
+
+    Objects with a ``fingerprint_key()`` method (filters) or a ``cache_key`` (columns, queries) are
+    converted through those.
+    """
+    if value is None or isinstance(value, (bool, str)):
+        return value
+    if isinstance(value, (int, float, Decimal)):
+        return [type(value).__name__, repr(value)]
+    if isinstance(value, (datetime.date, datetime.time)):
+        return [type(value).__name__, value.isoformat()]
+    if isinstance(value, datetime.timedelta):
+        return ['timedelta', repr(value.total_seconds())]
+    if isinstance(value, bytes):
+        return ['bytes', value.hex()]
+    if isinstance(value, (list, tuple)):
+        return ['list'] + [canonical(item) for item in value]
+    if isinstance(value, (set, frozenset)):
+        return ['set'] + sorted((canonical(item) for item in value), key=_sort_key)
+    if isinstance(value, dict):
+        return ['dict'] + sorted(([canonical(key), canonical(item)] for key, item in value.items()), key=_sort_key)
+    if isinstance(value, type):
+        return ['type', _qualified_name(value)]
+    if isinstance(value, _FunctionGenerator):
+        return ['func'] + list(value._FunctionGenerator__names)
+    if isinstance(value, types.MethodType):
+        return ['method', _qualified_name(value.__func__), canonical(vars(value.__self__))]
+    if isinstance(value, (types.FunctionType, types.BuiltinFunctionType)):
+        return ['function', _qualified_name(value)]
+    fingerprint_key = getattr(value, 'fingerprint_key', None)
+    if fingerprint_key is not None:
+        key = fingerprint_key()
+        if key is None:
+            raise Unfingerprintable(value)
+        return canonical(key)
+    cache_key = getattr(value, 'cache_key', None)
+    if cache_key is not None:
+        return canonical(cache_key)
+    raise Unfingerprintable(value)
+
+
+def _qualified_name(value):
+    name = value.__qualname__
+    if '<lambda>' in name or '<locals>' in name:
+        # there can be several of them with the same name
+        raise Unfingerprintable(value)
+    return '%s.%s' % (value.__module__, name)
+
+
+def _sort_key(value):
+    return json.dumps(value)
@@ -0,0 +1,165 @@
+import copy
+from collections import OrderedDict
+from contextvars import ContextVar
+
+from sqlagg.fingerprints import Unfingerprintable, fingerprint
+
+_active = ContextVar('sqlagg_query_memo', default=None)
+
+
+def current_memo():
+    """The ``QueryMemo`` that is active in the current context or None"""
+    return _active.get()
+
+
+class QueryMemo(object):
+    """
+    Request-scoped memo of the rows fetched by ``SimpleQueryMeta.execute``, ``count`` and ``totals``
+    (and so by ``QueryContext.resolve``, ``count`` and ``totals``) while it is active:
+
+        with QueryMemo() as memo:
+            memo.add(widget1_context, widget2_context)
+            data1 = widget1_context.resolve(connection, filter_values)
+            data2 = widget2_context.resolve(connection, filter_values)
+
+    Each distinct statement is run once per set of parameter values. The rows of a grouped query also
+    answer later queries that only differ from it by selecting fewer of its columns. Grouped queries of
+    the contexts passed to ``add`` that only differ by their columns are merged: the first one run selects
+    the columns of all of them.
+
+    The results are shared regardless of the connection they are fetched with, so a memo should only be
+    used for a single database and for as long as its data can be considered unchanged (e.g. a request).
+    The memo isn't active in threads started by ``resolve_concurrent`` and the like.
+    """
+    def __init__(self):
+        self.results = {}
+        self.supersets = {}
+        self.planned = {}
+        self.executes = 0
+        self.hits = 0
+        self._tokens = []
+
+    def __enter__(self):
+        self._tokens.append(_active.set(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        _active.reset(self._tokens.pop())
+
+    def add(self, *query_contexts):
+        """Merge the queries of ``query_contexts`` that only differ by their columns when they are run"""
+        for query_context in query_contexts:
+            for query_meta in query_context._get_query_metas():
+                shape = _shape(query_meta)
+                if shape is not None:
+                    columns = self.planned.setdefault(shape, OrderedDict())
+                    for sql_column in query_meta.columns:
+                        columns.setdefault((sql_column.label, sql_column.cache_key), sql_column)
+
+    def fetch(self, query_meta, kind, compiled, filter_values, compute):
+        """The result of ``compute()`` for the ``compiled`` statement, computing it once per set of values"""
+        return self._fetch(_key(query_meta, kind, compiled, filter_values), lambda: self._run(compute))
+
+    def execute(self, query_meta, compiled, filter_values, execute):
+        """
+        The rows of ``query_meta`` for ``filter_values`` from ``execute(query_meta)``, from ``execute`` with
+        a query selecting more columns or from the rows of such a query that has already been run
+        """
+        def compute():
+            shape = _shape(query_meta)
+            if shape is None:
+                return self._run(lambda: execute(query_meta))
+            shape_key = (shape, _values_key(filter_values))
+            for labels, rows in self.supersets.get(shape_key, []):
+                if all(labels.get(c.label) == c.cache_key for c in query_meta.columns):
+                    self.hits += 1
+                    return _project(query_meta, labels, rows)
+
+            superset = self._superset(query_meta, shape)
+            rows = self._run(lambda: execute(superset))
+            labels = {c.label: c.cache_key for c in superset.columns}
+            if shape_key[1] is not None:
+                self.supersets.setdefault(shape_key, []).append((labels, rows))
+            return _project(query_meta, labels, rows) if superset is not query_meta else rows
+
+        return self._fetch(_key(query_meta, 'select', compiled, filter_values), compute)
+
+    def _fetch(self, key, compute):
+        if key is not None and key in self.results:
+            self.hits += 1
+            return self.results[key]
+        result = compute()
+        if key is not None:
+            self.results[key] = result
+        return result
+
+    def _run(self, compute):
+        self.executes += 1
+        return compute()
+
+    def _superset(self, query_meta, shape):
+        columns = list(query_meta.columns)
+        labels = {c.label for c in columns}
+        for planned in self.planned.get(shape, {}).values():
+            # a column with the label of another one can't be added
+            if planned.label not in labels:
+                columns.append(planned)
+                labels.add(planned.label)
+        if len(columns) == len(query_meta.columns):
+            return query_meta
+        superset = copy.copy(query_meta)
+        superset.columns = columns
+        return superset
+
+    def __repr__(self):
+        return "QueryMemo(executes=%s, hits=%s)" % (self.executes, self.hits)
+
+
+def _key(query_meta, kind, compiled, filter_values):
+    try:
+        return fingerprint((type(query_meta), kind, str(compiled), compiled.construct_params(filter_values)))
+    except Unfingerprintable:
+        return None
+
+
+def _values_key(filter_values):
+    try:
+        return fingerprint(filter_values)
+    except Unfingerprintable:
+        return None
+
+
+def _shape(query_meta):
+    """
+    Fingerprint of everything but the columns of queries whose rows don't depend on their columns: grouped
+    queries, which return a row per group. The rows of ungrouped queries depend on whether their columns
+    aggregate, which can't be told from the columns (e.g. an ``aggregate_fn`` can be ``extract``).
+    """
+    from sqlagg.base import SimpleQueryMeta
+
+    if type(query_meta) is not SimpleQueryMeta or not query_meta.group_by:
+        return None
+    if any(c.cache_key is None for c in query_meta.columns):
+        return None
+    try:
+        return fingerprint((
+            query_meta.table_name, query_meta.filters, query_meta.group_by, query_meta.distinct_on,
+            query_meta.order_by, query_meta.start, query_meta.limit, query_meta.grouping_sets
+        ))
+    except Unfingerprintable:
+        return None
+
+
+def _project(query_meta, labels, rows):
+    """The rows of a query selecting the columns ``labels`` reduced to the columns of ``query_meta``"""
+    selected = None
+    projected = []
+    for row in rows:
+        if selected is None:
+            # labels that aren't columns (``GROUPING_LABEL``) are kept
+            selected = [c.label for c in query_meta.columns]
+            # rows of the database iterate over their values
+            row_labels = row.keys()
+            selected.extend(label for label in row_labels if label not in labels)
+        projected.append({label: row[label] for label in selected})
+    return projected
@@ -0,0 +1,142 @@
+import datetime
+import logging
+import re
+from collections import OrderedDict
+from decimal import Decimal
+
+from sqlagg.fingerprints import Unfingerprintable, fingerprint
+
+logger = logging.getLogger(__name__)
+
+# key of the prepared statements of a connection in ``connection.info``, which lives as long as the
+# database connection, also across checkouts from the pool
+INFO_KEY = 'sqlagg_prepared_statements'
+
+_PLACEHOLDER = re.compile(r'%\(([^)]+)\)s|%%')
+
+# PostgreSQL types of the parameters for each type of value. Strings are ``unknown`` so that their type
+# is inferred from where they are used, as for the literals that psycopg2 sends when statements aren't prepared.
+_INT4_RANGE = range(-2 ** 31, 2 ** 31)
+
+
+def _parameter_type(value):
+    if value is None or isinstance(value, str):
+        return 'unknown'
+    if isinstance(value, bool):
+        return 'boolean'
+    if isinstance(value, int):
+        return 'integer' if value in _INT4_RANGE else 'bigint'
+    if isinstance(value, (float, Decimal)):
+        return 'numeric'
+    if isinstance(value, datetime.datetime):
+        return 'timestamp with time zone' if value.tzinfo is not None else 'timestamp'
+    if isinstance(value, datetime.date):
+        return 'date'
+    if isinstance(value, datetime.time):
+        return 'time'
+    return None
+
+
+class PreparedStatements(object):
+    """
+    Runs the queries of ``SimpleQueryMeta``s as server-side prepared statements (``PREPARE`` and
+    ``EXECUTE``) so that PostgreSQL only plans each statement once per connection.
+
+    Statements are named after the fingerprint of the query (see ``SimpleQueryMeta.fingerprint``) and
+    the types of its parameters. Each connection keeps up to ``maxsize`` of them, the least recently
+    used being deallocated when another one is prepared. Queries without a fingerprint or with parameter
+    values of other types (e.g. lists) are executed without preparing them.
+
+    Set ``SimpleQueryMeta.prepared_statements`` to an instance to use it.
+    """
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self.prepares = 0
+        self.executes = 0
+        self.deallocations = 0
+
+    def execute(self, connection, query_meta, compiled, filter_values):
+        """Execute the ``compiled`` statement of ``query_meta`` with ``filter_values``, preparing it if needed"""
+        params = compiled.construct_params(filter_values)
+        names = []
+        for match in _PLACEHOLDER.finditer(str(compiled)):
+            name = match.group(1)
+            if name is not None and name not in names:
+                names.append(name)
+        types = [_parameter_type(params.get(name)) for name in names]
+        statement_name = self._statement_name(query_meta, types)
+        if statement_name is None:
+            return connection.execute(compiled, **filter_values)
+
+        statements = self._statements(connection)
+        if statement_name in statements:
+            statements.move_to_end(statement_name)
+        else:
+            self._prepare(connection, statement_name, str(compiled), names, types)
+            statements[statement_name] = True
+            while len(statements) > self.maxsize:
+                evicted, _ = statements.popitem(last=False)
+                self._deallocate(connection, evicted)
+
+        self.executes += 1
+        arguments = ', '.join('%%(p%d)s' % index for index in range(len(names)))
+        return connection.execute(
+            'EXECUTE %s(%s)' % (statement_name, arguments) if names else 'EXECUTE %s' % statement_name,
+            {'p%d' % index: params.get(name) for index, name in enumerate(names)}
+        )
+
+    def prepared(self, connection):
+        """Names of the statements prepared on ``connection``, least recently used first"""
+        return list(self._statements(connection))
+
+    def clear(self, connection):
+        """Deallocate the statements prepared on ``connection``"""
+        statements = self._statements(connection)
+        while statements:
+            self._deallocate(connection, statements.popitem(last=False)[0])
+
+    def _statements(self, connection):
+        return connection.info.setdefault(INFO_KEY, OrderedDict())
+
+    def _statement_name(self, query_meta, types):
+        query_fingerprint = query_meta.route().fingerprint
+        if query_fingerprint is None or None in types:
+            return None
+        try:
+            return 'sqlagg_' + fingerprint((query_fingerprint, types))
+        except Unfingerprintable:
+            return None
+
+    def _prepare(self, connection, statement_name, sql, names, types):
+        def placeholder(match):
+            if match.group(1) is None:
+                return '%'
+            return '$%d' % (names.index(match.group(1)) + 1)
+
+        sql = _PLACEHOLDER.sub(placeholder, sql)
+        types = ' (%s)' % ', '.join(types) if types else ''
+        self._run(connection, 'PREPARE %s%s AS %s' % (statement_name, types, sql))
+        self.prepares += 1
+
+    def _deallocate(self, connection, statement_name):
+        try:
+            self._run(connection, 'DEALLOCATE %s' % statement_name)
+        except Exception:
+            # e.g. the transaction is aborted; the statement is deallocated when the connection is closed
+            logger.warning("Failed to deallocate %s", statement_name, exc_info=True)
+        else:
+            self.deallocations += 1
+
+    @staticmethod
+    def _run(connection, sql):
+        # run on the DBAPI cursor so that the SQL isn't interpolated
+        cursor = connection.connection.cursor()
+        try:
+            cursor.execute(sql)
+        finally:
+            cursor.close()
+
+    def __repr__(self):
+        return "PreparedStatements(maxsize=%s, prepares=%s, executes=%s)" % (
+            self.maxsize, self.prepares, self.executes
+        )
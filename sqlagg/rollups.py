@@ -0,0 +1,159 @@
+from sqlalchemy import BigInteger, Numeric, cast, column, func
+
+from sqlagg.base import SimpleQueryMeta, SimpleSqlColumn, SqlColumn
+from sqlagg.cache import Unkeyable, freeze
+
+SUM = 'sum'
+COUNT = 'count'
+MIN = 'min'
+MAX = 'max'
+
+_AGGREGATES = {
+    ('func', 'sum'): SUM,
+    ('func', 'count'): COUNT,
+    ('func', 'min'): MIN,
+    ('func', 'max'): MAX,
+    ('func', 'avg'): 'avg',
+}
+
+
+class RollupTable(object):
+    """
+    A table pre-aggregated from ``base_table`` with a row per group of the ``group_by`` columns.
+
+    :param aggregates: Dict mapping ``(aggregate, column)`` of the base table, where aggregate is
+        one of ``SUM``, ``COUNT``, ``MIN`` or ``MAX``, to the column of the rollup table storing it,
+        e.g. ``{(SUM, 'indicator_a'): 'indicator_a_sum', (COUNT, 'indicator_a'): 'indicator_a_count'}``.
+    :param row_count: Approximate number of rows used to pick the smallest rollup that can answer a query.
+        Rollups without one are ordered by the number of group by columns.
+    """
+    def __init__(self, table_name, base_table, group_by, aggregates, row_count=None):
+        self.table_name = table_name
+        self.base_table = base_table
+        self.group_by = list(group_by)
+        self.aggregates = dict(aggregates)
+        self.row_count = row_count
+
+    @property
+    def size(self):
+        return (self.row_count if self.row_count is not None else float('inf'), len(self.group_by))
+
+    def rewrite_column(self, sql_column, group_by):
+        """Return the equivalent of ``sql_column`` on this rollup or None if it can't be answered from it"""
+        if type(sql_column) is not SimpleSqlColumn:
+            return None
+        if sql_column.label in group_by:
+            # group columns (including expressions on them like YearColumn) are unchanged
+            return sql_column if sql_column.column_name in self.group_by else None
+
+        try:
+            aggregate = _AGGREGATES.get(freeze(sql_column.aggregate_fn))
+        except (Unkeyable, TypeError):
+            return None
+        name = sql_column.column_name
+        if aggregate == 'avg':
+            sum_column = self.aggregates.get((SUM, name))
+            count_column = self.aggregates.get((COUNT, name))
+            if sum_column and count_column:
+                return MeanOfSumsColumn(sum_column, count_column, sql_column.label)
+            return None
+
+        rollup_column = self.aggregates.get((aggregate, name))
+        if rollup_column is None:
+            return None
+        aggregate_fn = sum_counts if aggregate == COUNT else sql_column.aggregate_fn
+        return SimpleSqlColumn(rollup_column, aggregate_fn, alias=sql_column.label)
+
+    def rewrite(self, query_meta):
+        """Return ``query_meta`` rewritten to run on this rollup or None if it can't be answered from it"""
+        if query_meta.table_name != self.base_table or query_meta.distinct_on:
+            return None
+        for filter in query_meta.filters or []:
+            filter_columns = filter.column_names()
+            if filter_columns is None or not filter_columns <= set(self.group_by):
+                return None
+
+        columns = []
+        for sql_column in query_meta.columns:
+            rollup_column = self.rewrite_column(sql_column, query_meta.group_by or [])
+            if rollup_column is None:
+                return None
+            columns.append(rollup_column)
+
+        rewritten = SimpleQueryMeta(
+            self.table_name, query_meta.filters, query_meta.group_by, query_meta.distinct_on,
+            query_meta.order_by, start=query_meta.start, limit=query_meta.limit,
+            grouping_sets=query_meta.grouping_sets
+        )
+        rewritten.rollups = None
+        rewritten.columns = columns
+        return rewritten
+
+    def __repr__(self):
+        return "RollupTable(%s, base_table=%s, group_by=%s)" % (self.table_name, self.base_table, self.group_by)
+
+
+class RollupRegistry(object):
+    """
+    Rollup tables that queries can be routed to (see ``SimpleQueryMeta.rollups``).
+
+    Only queries that group by and filter on columns of a rollup's ``group_by`` and only aggregate
+    with sum, count, min, max and avg (``MeanColumn``, computed from the sum and the count) are routed.
+    """
+    def __init__(self, rollups=()):
+        self.rollups = []
+        self._routes = {}
+        for rollup in rollups:
+            self.register(rollup)
+
+    def register(self, rollup):
+        self.rollups.append(rollup)
+        self.rollups.sort(key=lambda r: r.size)
+        self._routes.clear()
+
+    def route(self, query_meta):
+        """Return ``query_meta`` rewritten to run on the smallest rollup that can answer it or ``query_meta``"""
+        if type(query_meta) is not SimpleQueryMeta:
+            return query_meta
+        key = query_meta.cache_key
+        if key is not None and key in self._routes:
+            return self._routes[key] or query_meta
+
+        rewritten = None
+        for rollup in self.rollups:
+            rewritten = rollup.rewrite(query_meta)
+            if rewritten is not None:
+                break
+        if key is not None:
+            self._routes[key] = rewritten
+        return rewritten or query_meta
+
+
+class MeanOfSumsColumn(SqlColumn):
+    """The mean of a column computed from the sums and counts of the column stored in a rollup"""
+    def __init__(self, sum_column, count_column, alias):
+        self.column_name = sum_column
+        self.count_column = count_column
+        self.alias = alias
+
+    @property
+    def label(self):
+        return self.alias
+
+    def aggregate_fn(self, sum_column):
+        return cast(func.sum(sum_column), Numeric) / func.nullif(func.sum(column(self.count_column)), 0)
+
+    def build_column(self):
+        return self.aggregate_fn(column(self.column_name)).label(self.label)
+
+    @property
+    def cache_key(self):
+        return (type(self), self.column_name, self.count_column, self.alias)
+
+    def __repr__(self):
+        return "MeanOfSumsColumn(sum=%s, count=%s, alias=%s)" % (self.column_name, self.count_column, self.alias)
+
+
+def sum_counts(column):
+    """Aggregate the counts stored in a rollup into the count of the rows of the base table"""
+    return cast(func.coalesce(func.sum(column), 0), BigInteger)
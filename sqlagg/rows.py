@@ -0,0 +1,87 @@
+from collections.abc import MutableMapping
+
+_MISSING = object()
+
+
+class RowSchema(object):
+    """
+    Positions of the labels in the rows of a result. Shared by all the rows so each row
+    only has to store its values.
+    """
+    __slots__ = ('labels', 'positions')
+
+    def __init__(self):
+        self.labels = []
+        self.positions = {}
+
+    def position(self, label):
+        try:
+            return self.positions[label]
+        except KeyError:
+            position = self.positions[label] = len(self.labels)
+            self.labels.append(label)
+            return position
+
+    def __len__(self):
+        return len(self.labels)
+
+
+class Row(MutableMapping):
+    """
+    Compact dict-like row of a result. The values are stored in a list ordered by the
+    shared ``RowSchema``; labels that the row has no value for are missing from the row.
+    """
+    __slots__ = ('_schema', '_values')
+
+    def __init__(self, schema):
+        self._schema = schema
+        self._values = []
+
+    def set_values(self, positions, values):
+        """Set ``values`` at the schema ``positions`` (as returned by ``RowSchema.position``)"""
+        row_values = self._values
+        if len(row_values) < len(self._schema):
+            row_values.extend([_MISSING] * (len(self._schema) - len(row_values)))
+        for position, value in zip(positions, values):
+            row_values[position] = value
+
+    def __getitem__(self, label):
+        position = self._schema.positions.get(label)
+        if position is not None and position < len(self._values):
+            value = self._values[position]
+            if value is not _MISSING:
+                return value
+        raise KeyError(label)
+
+    def get(self, label, default=None):
+        position = self._schema.positions.get(label)
+        if position is not None and position < len(self._values):
+            value = self._values[position]
+            if value is not _MISSING:
+                return value
+        return default
+
+    def __contains__(self, label):
+        return self.get(label, _MISSING) is not _MISSING
+
+    def __setitem__(self, label, value):
+        self.set_values((self._schema.position(label),), (value,))
+
+    def __delitem__(self, label):
+        if label not in self:
+            raise KeyError(label)
+        self._values[self._schema.positions[label]] = _MISSING
+
+    def __iter__(self):
+        for label, value in zip(self._schema.labels, self._values):
+            if value is not _MISSING:
+                yield label
+
+    def __len__(self):
+        return sum(1 for value in self._values if value is not _MISSING)
+
+    def copy(self):
+        return dict(self.items())
+
+    def __repr__(self):
+        return repr(dict(self.items()))
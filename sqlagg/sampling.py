@@ -0,0 +1,169 @@
+import math
+from statistics import NormalDist
+
+import sqlalchemy
+from sqlalchemy import Text, cast, column, func, literal_column, table
+
+from sqlagg.base import SimpleQueryMeta, SimpleSqlColumn
+from sqlagg.cache import Unkeyable, freeze
+from sqlagg.columns import ConditionalColumn
+from sqlagg.exceptions import SqlAggException
+
+BERNOULLI = 'bernoulli'
+SYSTEM = 'system'
+HASH = 'hash'
+
+SQUARES_SUFFIX = '__squares'
+
+# the bits of the row hashes compared with the sampled fraction
+HASH_BITS = 32
+
+
+class Sample(object):
+    """
+    A sample of ``percent`` percent of the rows of the queried tables.
+
+    :param method: ``BERNOULLI`` (``TABLESAMPLE BERNOULLI``) picks each row with the same probability.
+        ``SYSTEM`` (``TABLESAMPLE SYSTEM``) picks whole pages, which is faster but gives intervals that are too
+        narrow when similar rows are stored together. ``HASH`` picks the rows whose hash of ``column`` (e.g. the
+        primary key) is in the sample, so the same rows are picked from every query, also on views.
+    :param seed: Seed of the sample: the same seed picks the same rows while the table doesn't change.
+        Without one ``TABLESAMPLE`` picks different rows every time.
+    """
+    def __init__(self, percent, method=BERNOULLI, seed=None, column=None):
+        if not 0 < percent <= 100:
+            raise SqlAggException("The sample percent must be more than 0 and at most 100")
+        if method not in (BERNOULLI, SYSTEM, HASH):
+            raise SqlAggException("Unknown sampling method: {}".format(method))
+        if (method == HASH) != (column is not None):
+            raise SqlAggException("A column is required to sample by hash and only used then")
+        self.percent = percent
+        self.method = method
+        self.seed = seed
+        self.column = column
+
+    @property
+    def fraction(self):
+        return self.percent / 100.0
+
+    @property
+    def cache_key(self):
+        return (type(self), self.percent, self.method, self.seed, self.column)
+
+    def apply(self, query_meta):
+        """Return ``query_meta`` run on the sample if it is a ``SimpleQueryMeta``, otherwise ``query_meta``"""
+        if type(query_meta) is not SimpleQueryMeta:
+            return query_meta
+        return SampledQueryMeta(query_meta, self)
+
+    def build_from_clause(self, table_name):
+        # the sampling parameters are part of the SQL, not bound, so that result caches can tell samples apart
+        if self.method == HASH:
+            seed = literal_column(str(int(self.seed or 0)))
+            hashed = func.hashtextextended(cast(column(self.column), Text), seed)
+            threshold = round(self.fraction * (1 << HASH_BITS))
+            return sqlalchemy.select([literal_column('*')]).select_from(table(table_name)).where(
+                hashed.op('&')(literal_column(str((1 << HASH_BITS) - 1))) < literal_column(str(threshold))
+            ).alias(table_name)
+        seed = literal_column(repr(float(self.seed))) if self.seed is not None else None
+        return sqlalchemy.tablesample(
+            table(table_name), getattr(func, self.method)(literal_column(repr(float(self.percent)))),
+            name=table_name, seed=seed
+        )
+
+    def __repr__(self):
+        return "Sample(%s%%, method=%s, seed=%s)" % (self.percent, self.method, self.seed)
+
+
+class Estimate(float):
+    """A value estimated from a sample with the standard ``error`` of the estimate"""
+    def __new__(cls, value, error):
+        estimate = super(Estimate, cls).__new__(cls, value)
+        estimate.error = error
+        return estimate
+
+    def interval(self, confidence=0.95):
+        """The ``(low, high)`` bounds of the confidence interval of the estimate"""
+        margin = NormalDist().inv_cdf((1 + confidence) / 2) * self.error
+        return float(self) - margin, float(self) + margin
+
+    def __reduce__(self):
+        return Estimate, (float(self), self.error)
+
+    def __repr__(self):
+        return "Estimate(%r, error=%r)" % (float(self), self.error)
+
+
+class SampledQueryMeta(SimpleQueryMeta):
+    """
+    Runs a ``SimpleQueryMeta`` on a ``Sample`` of the rows.
+
+    Sums and counts are scaled up by the sampled fraction into ``Estimate`` values. Their standard
+    errors are computed from the sums of the squares of the sampled values, as each row is in the
+    sample with the same probability. Other aggregates are returned as they are computed on the sample.
+    """
+    def __init__(self, query_meta, sample):
+        super(SampledQueryMeta, self).__init__(
+            query_meta.table_name, query_meta.filters, query_meta.group_by, query_meta.distinct_on,
+            query_meta.order_by, query_meta.start, query_meta.limit, query_meta.grouping_sets
+        )
+        query_meta._check()
+        self.query_meta = query_meta
+        self.sample = sample
+        self.estimated = []
+        for sql_column in query_meta.columns:
+            self.columns.append(sql_column)
+            if sql_column.label in (query_meta.group_by or []):
+                continue
+            try:
+                aggregate = freeze(getattr(sql_column, 'aggregate_fn', None))
+            except Unkeyable:
+                continue
+            if aggregate == ('func', 'count'):
+                self.estimated.append((sql_column.label, None))
+            elif aggregate == ('func', 'sum'):
+                squares = _squares_column(sql_column)
+                if squares is not None:
+                    self.columns.append(squares)
+                    self.estimated.append((sql_column.label, squares.label))
+
+    @property
+    def cache_key(self):
+        cache_key = super(SampledQueryMeta, self).cache_key
+        return cache_key + (self.sample.cache_key,) if cache_key is not None else None
+
+    def _from_clause(self):
+        return self.sample.build_from_clause(self.table_name)
+
+    def _process_rows(self, rows):
+        fraction = self.sample.fraction
+        processed = []
+        for sql_row in rows:
+            row = dict(sql_row.items())
+            for label, squares_label in self.estimated:
+                value = row[label]
+                squares = row.pop(squares_label) if squares_label else value
+                if value is not None:
+                    # variance of the Horvitz-Thompson estimator of a total for rows sampled with equal probability
+                    variance = (1 - fraction) / fraction ** 2 * float(squares or 0)
+                    row[label] = Estimate(float(value) / fraction, math.sqrt(variance))
+            processed.append(row)
+        return processed
+
+    def __repr__(self):
+        return "SampledQueryMeta(%r, %r)" % (self.query_meta, self.sample)
+
+
+def _sum_of_squares(value):
+    return func.sum(value * value)
+
+
+def _squares_column(sql_column):
+    label = sql_column.label + SQUARES_SUFFIX
+    if type(sql_column) is SimpleSqlColumn:
+        return SimpleSqlColumn(sql_column.column_name, _sum_of_squares, label)
+    if type(sql_column) is ConditionalColumn:
+        return ConditionalColumn(
+            sql_column.column_name, sql_column.whens, sql_column.else_, _sum_of_squares, label
+        )
+    return None
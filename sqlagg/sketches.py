@@ -0,0 +1,234 @@
+import math
+
+import sqlalchemy
+from sqlalchemy import Text, cast, column, func, literal_column
+
+from sqlagg.base import QueryContext, SimpleQueryMeta, SqlColumn, _sort_rows
+from sqlagg.cache import Unkeyable, freeze
+from sqlagg.exceptions import SqlAggException
+
+REGISTER_LABEL = '_sqlagg_register'
+RANK_LABEL = '_sqlagg_rank'
+
+# the bits of the hash after the register index that the rank is computed from
+RANK_BITS = 32
+MIN_PRECISION = 4
+MAX_PRECISION = 16
+
+
+class HyperLogLog(object):
+    """
+    HyperLogLog sketch estimating the number of distinct values it was built from, with ``2 ** precision``
+    registers and a relative standard error of ``1.04 / sqrt(2 ** precision)``.
+
+    Sketches of different rows (e.g. of other groups, partitions or shards) can be merged with ``merge``
+    (or ``|``) into the sketch of all their rows.
+    """
+    def __init__(self, precision, registers=None):
+        self.precision = precision
+        self.registers = registers if registers is not None else bytearray(1 << precision)
+
+    @staticmethod
+    def precision_for(error):
+        """The smallest precision with a relative standard error of at most ``error``"""
+        precision = math.ceil(math.log2((1.04 / error) ** 2))
+        return min(max(precision, MIN_PRECISION), MAX_PRECISION)
+
+    def add(self, register, rank):
+        self.registers[register] = max(self.registers[register], rank)
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise SqlAggException("Can't merge sketches with different precisions")
+        return HyperLogLog(self.precision, bytearray(map(max, self.registers, other.registers)))
+
+    __or__ = merge
+
+    @property
+    def estimate(self):
+        size = len(self.registers)
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(size, 0.7213 / (1 + 1.079 / size))
+        estimate = alpha * size * size / sum(2.0 ** -rank for rank in self.registers)
+        empty = self.registers.count(0)
+        if estimate <= 2.5 * size and empty:
+            # linear counting is more accurate for small cardinalities
+            estimate = size * math.log(size / empty)
+        return estimate
+
+    @property
+    def count(self):
+        return round(self.estimate)
+
+    @property
+    def error(self):
+        """The relative standard error of the estimate"""
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def bounds(self, deviations=2):
+        """The ``(lower, upper)`` bounds of the count ``deviations`` standard errors away from the estimate"""
+        estimate = self.estimate
+        margin = estimate * self.error * deviations
+        return max(math.floor(estimate - margin), 0), math.ceil(estimate + margin)
+
+    def __eq__(self, other):
+        return isinstance(other, HyperLogLog) and (self.precision, self.registers) == (
+            other.precision, other.registers
+        )
+
+    def __hash__(self):
+        return hash((self.precision, bytes(self.registers)))
+
+    def __repr__(self):
+        return "HyperLogLog(count=%d, error=%.4f)" % (self.count, self.error)
+
+
+def hash_text(value):
+    return func.hashtextextended(cast(value, Text), 0)
+
+
+class HyperLogLogSqlColumn(SqlColumn):
+    """
+    The ``HyperLogLog`` sketch of the values of a column. Only used by ``HyperLogLogQueryMeta``.
+
+    :param hash_fn: Function returning a uniformly distributed 64 bit integer hash of the column expression.
+        The default hashes the text of the values (``hashtextextended``, PostgreSQL 11+); a hash for the
+        column's type (e.g. ``lambda c: func.hashint8extended(c, 0)``) is faster.
+    """
+    def __init__(self, column_name, precision, alias=None, hash_fn=None):
+        self.column_name = column_name
+        self.precision = precision
+        self.alias = alias
+        self.hash_fn = hash_fn or hash_text
+
+    @property
+    def label(self):
+        return self.alias or self.column_name
+
+    def build_column(self):
+        return self.hash_fn(column(self.column_name)).label(self.label)
+
+    @property
+    def cache_key(self):
+        try:
+            return (type(self), self.column_name, self.precision, self.alias, freeze(self.hash_fn))
+        except Unkeyable:
+            return None
+
+    def __repr__(self):
+        return "HyperLogLogSqlColumn(%s, precision=%s)" % (self.label, self.precision)
+
+
+class HyperLogLogQueryMeta(SimpleQueryMeta):
+    """
+    Computes the ``HyperLogLog`` sketch of a column for each group.
+
+    The registers of the sketches are aggregated by the database, using a hash aggregate instead of the
+    sort of ``count(DISTINCT ...)``, and turned into a sketch per group by ``_process_rows``. The sketches
+    of different rows can be merged so the query can be split up (see ``partial_query_meta``).
+    """
+    @property
+    def sketch_column(self):
+        sketch_columns = [c for c in self.columns if isinstance(c, HyperLogLogSqlColumn)]
+        if len(sketch_columns) != 1:
+            raise SqlAggException("A sketch query must have a single sketch column")
+        return sketch_columns[0]
+
+    def _build_query(self):
+        if self.start is not None or self.limit is not None or self.distinct_on:
+            # the registers of a group are spread over several rows
+            raise SqlAggException("Sketch queries don't support start, limit or distinct on")
+        self._check()
+        sketch_column = self.sketch_column
+        group_by = self.group_by or []
+        group_columns = {c.label: c for c in self.columns if c is not sketch_column}
+
+        hashed = sqlalchemy.select(
+            [group_columns[group].build_column() for group in group_by] + [sketch_column.build_column()]
+        ).select_from(self._from_clause()).where(column(sketch_column.column_name).isnot(None))
+        for filter in self.filters or []:
+            hashed = hashed.where(filter.build_expression())
+        hashed = hashed.alias('_sqlagg_hashed')
+
+        hash_value = hashed.c[sketch_column.label]
+        register = hash_value.op('&')(literal_column(str((1 << sketch_column.precision) - 1)))
+        bits = hash_value.op('>>')(literal_column(str(sketch_column.precision))).op('&')(
+            literal_column(str((1 << RANK_BITS) - 1))
+        )
+        groups = [hashed.c[group] for group in group_by]
+        # the lowest set bit of each hash, the largest of which gives the rank of the register
+        return sqlalchemy.select(
+            groups + [register.label(REGISTER_LABEL), func.max(bits.op('&')(-bits)).label(RANK_LABEL)]
+        ).group_by(*(groups + [register]))
+
+    def _process_rows(self, rows):
+        group_by = self.group_by or []
+        label = self.sketch_column.label
+        sketches = {}
+        for sql_row in rows:
+            key = tuple(sql_row[group] for group in group_by)
+            sketch = sketches.get(key)
+            if sketch is None:
+                sketch = sketches[key] = HyperLogLog(self.sketch_column.precision)
+            sketch.add(sql_row[REGISTER_LABEL], sql_row[RANK_LABEL].bit_length())
+        if not group_by and not sketches:
+            sketches[()] = HyperLogLog(self.sketch_column.precision)
+
+        processed = []
+        for key, sketch in sketches.items():
+            row = dict(zip(group_by, key))
+            row[label] = sketch
+            processed.append(row)
+        _sort_rows(processed, self.order_by)
+        return processed
+
+    def iter_batches(self, connection, filter_values, batch_size=1000, order_by_groups=False):
+        """The registers of a group can be spread over the whole result so all the rows are read first"""
+        rows = self.execute(connection, filter_values)
+        if order_by_groups:
+            rows.sort(key=lambda row: tuple((row[group] is None, row[group]) for group in self.group_by))
+        for start in range(0, len(rows), batch_size):
+            yield rows[start:start + batch_size]
+
+    def partial_query_meta(self, filters=None):
+        if self.start is not None or self.limit is not None:
+            return None
+        query_meta = HyperLogLogQueryMeta(
+            self.table_name, self.filters if filters is None else filters, self.group_by, None, self.order_by
+        )
+        query_meta.columns = list(self.columns)
+        return query_meta
+
+    def merge(self, states, rows):
+        """Same as ``PartialQueryMeta.merge`` with the sketches as the partial states"""
+        label = self.sketch_column.label
+        changed = []
+        for sql_row in rows:
+            row_key = QueryContext._get_row_key(self.group_by, sql_row, 0)
+            sketch = sql_row[label]
+            if row_key in states:
+                groups, (previous,) = states[row_key]
+                sketch = previous.merge(sketch)
+            else:
+                groups = {group: sql_row[group] for group in self.group_by or []}
+            states[row_key] = (groups, [sketch])
+            changed.append(row_key)
+        return changed
+
+    def finalize(self, states, sort=False):
+        rows = []
+        for groups, (sketch,) in states.values():
+            row = dict(groups)
+            row[self.sketch_column.label] = sketch
+            rows.append(row)
+        if sort:
+            _sort_rows(rows, self.order_by)
+        return rows
+
+    def execute_keyset(self, connection, filter_values, after=None):
+        raise SqlAggException("Sketch queries don't support keyset pagination")
+
+    def execute_page(self, connection, filter_values, total_columns=()):
+        raise SqlAggException("Sketch queries don't support pagination")
+
+    def __repr__(self):
+        return "HyperLogLogQueryMeta(%s, %r)" % (self.table_name, self.columns)
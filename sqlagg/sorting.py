@@ -17,6 +17,10 @@ class OrderBy(object):
             return asc(self.column)
         return desc(self.column)
 
+    @property
+    def cache_key(self):
+        return (type(self), self.column_name, self.is_ascending)
+
     def __str__(self):
         return (
             'OrderBy(column_name=%s, is_ascending=%s)'
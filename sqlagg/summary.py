@@ -0,0 +1,156 @@
+import sqlalchemy
+from sqlalchemy import column, literal_column, table
+
+from sqlagg.base import SimpleQueryMeta, SimpleSqlColumn
+from sqlagg.exceptions import SqlAggException
+
+WATERMARK_LABEL = '_sqlagg_watermark'
+
+
+class SummaryTable(object):
+    """
+    A table storing the result of a ``QueryContext`` so that it doesn't have to be aggregated from the
+    base table every time.
+
+    With a ``watermark_column`` (a column of the base table that increases as rows are added or updated,
+    e.g. a modified timestamp or a sequence) ``refresh`` only recomputes the groups that have rows past the
+    highest watermark already summarized. The watermark of each group is stored in the summary table.
+
+    Set ``query_context.summary`` to the summary to have ``resolve`` read from it when it is called with
+    the summary's ``filter_values``.
+
+    :param filter_values: The filter values of the context that the summary is computed with.
+    """
+    def __init__(self, table_name, query_context, watermark_column=None, filter_values=None):
+        self.table_name = table_name
+        self.query_context = query_context
+        self.watermark_column = watermark_column
+        self.filter_values = filter_values or {}
+
+    @property
+    def query_meta(self):
+        """The query that is summarized"""
+        query_metas = self.query_context._get_query_metas()
+        if len(query_metas) != 1 or type(query_metas[0]) is not SimpleQueryMeta:
+            raise SqlAggException("Only contexts with a single query can be summarized")
+        query_meta = query_metas[0]
+        if query_meta.start is not None or query_meta.limit is not None or query_meta.distinct_on \
+                or query_meta.grouping_sets:
+            raise SqlAggException("Summarized queries can't use start, limit, distinct_on or grouping_sets")
+        query_meta._check()
+        return query_meta
+
+    @property
+    def labels(self):
+        labels = [c.label for c in self.query_meta.columns]
+        if self.watermark_column:
+            labels.append(WATERMARK_LABEL)
+        return labels
+
+    def answers(self, filter_values):
+        """Whether the summary holds the result of the context for ``filter_values``"""
+        return (filter_values or {}) == self.filter_values
+
+    def create(self, connection):
+        """Create the summary table and fill it from the base table"""
+        query = self._build_query(self.query_meta)
+        compiled = query.compile(dialect=connection.dialect)
+        preparer = connection.dialect.identifier_preparer
+        connection.execute(
+            "CREATE TABLE %s AS %s" % (preparer.quote(self.table_name), compiled),
+            compiled.construct_params(self.filter_values)
+        )
+        group_by = self.query_meta.group_by
+        if group_by:
+            connection.execute("CREATE INDEX %s ON %s (%s)" % (
+                preparer.quote(self.table_name + '_groups'), preparer.quote(self.table_name),
+                ', '.join(preparer.quote(group) for group in group_by)
+            ))
+
+    def drop(self, connection):
+        preparer = connection.dialect.identifier_preparer
+        connection.execute("DROP TABLE IF EXISTS %s" % preparer.quote(self.table_name))
+
+    def refresh(self, connection):
+        """
+        Recompute the groups that have rows past the summary's watermark (all groups if there is
+        no ``watermark_column`` or the query isn't grouped) in a single transaction.
+
+        Returns the number of summary rows written.
+        """
+        query_meta = self.query_meta
+        summary = table(self.table_name, *[column(label) for label in self.labels])
+        query = self._build_query(query_meta)
+        params = dict(self.filter_values)
+
+        with connection.begin():
+            if not self.watermark_column or not query_meta.group_by:
+                connection.execute(summary.delete())
+            else:
+                base_watermark = column(self.watermark_column)
+                since = connection.execute(
+                    sqlalchemy.select([sqlalchemy.func.max(summary.c[WATERMARK_LABEL])])
+                ).scalar()
+                base_table = table(query_meta.table_name)
+                until = connection.execute(
+                    sqlalchemy.select([sqlalchemy.func.max(base_watermark)]).select_from(base_table)
+                ).scalar()
+                if until is None or (since is not None and until <= since):
+                    return 0
+
+                group_expressions = [
+                    c.build_column().element for group in query_meta.group_by
+                    for c in query_meta.columns if c.label == group
+                ]
+                touched = sqlalchemy.select([
+                    expression.label('_sqlagg_group_%s' % index)
+                    for index, expression in enumerate(group_expressions)
+                ]).select_from(base_table).where(base_watermark <= sqlalchemy.bindparam('_until'))
+                if since is not None:
+                    touched = touched.where(base_watermark > sqlalchemy.bindparam('_since'))
+                for filter in query_meta.filters or []:
+                    touched = touched.where(filter.build_expression())
+                touched = touched.distinct().alias('_sqlagg_touched')
+                params.update(_since=since, _until=until)
+
+                def in_touched(expressions):
+                    matches = [
+                        touched.c['_sqlagg_group_%s' % index].isnot_distinct_from(expression)
+                        for index, expression in enumerate(expressions)
+                    ]
+                    return sqlalchemy.exists([literal_column('1')]).select_from(touched).where(
+                        sqlalchemy.and_(*matches)
+                    )
+
+                connection.execute(
+                    summary.delete().where(in_touched([summary.c[group] for group in query_meta.group_by])),
+                    **params
+                )
+                # rows past ``until`` (e.g. committed since it was read) are left to the next refresh: they
+                # would raise the stored watermarks past rows of other groups that haven't been summarized
+                query = query.where(in_touched(group_expressions)).where(
+                    base_watermark <= sqlalchemy.bindparam('_until')
+                )
+
+            result = connection.execute(summary.insert().from_select(self.labels, query), **params)
+            return result.rowcount
+
+    def execute(self, connection):
+        """Return the rows of the summary, as ``SimpleQueryMeta.execute`` would return them for the context"""
+        query_meta = self.query_meta
+        summary_query_meta = SimpleQueryMeta(self.table_name, None, None, None, query_meta.order_by)
+        for label in self.labels:
+            if label != WATERMARK_LABEL:
+                summary_query_meta.columns.append(SimpleSqlColumn(label))
+        return summary_query_meta.execute(connection, {})
+
+    def _build_query(self, query_meta):
+        query = query_meta._build_query_generic(
+            query_meta.columns, query_meta.group_by, query_meta.filters
+        )
+        if self.watermark_column:
+            query.append_column(sqlalchemy.func.max(column(self.watermark_column)).label(WATERMARK_LABEL))
+        return query
+
+    def __repr__(self):
+        return "SummaryTable(%s, watermark_column=%s)" % (self.table_name, self.watermark_column)
@@ -0,0 +1,101 @@
+from collections import OrderedDict
+from datetime import date
+
+from sqlalchemy import event
+
+from sqlagg import ROLLUP, QueryContext
+from sqlagg.batch import QueryBatch
+from sqlagg.columns import ArrayAggColumn, MeanColumn, SimpleColumn, SumColumn, SumWhen
+from sqlagg.filters import EQ, GT, LT
+from sqlagg.sorting import OrderBy
+
+from . import DataTestCase
+
+
+class TestQueryBatch(DataTestCase):
+
+    def _statements(self, connection):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(connection, 'before_cursor_execute', before_cursor_execute)
+        self.addCleanup(event.remove, connection, 'before_cursor_execute', before_cursor_execute)
+        return statements
+
+    def test_resolve(self):
+        connection = self.session.connection()
+        users = QueryContext(
+            "user_table", filters=[LT('date', 'enddate')], group_by=['user'], order_by=[OrderBy('user')]
+        )
+        users.append_column(SimpleColumn('user'))
+        users.append_column(SumColumn('indicator_a'))
+        users.append_column(MeanColumn('indicator_b'))
+        users.append_column(SumWhen(whens=[['indicator_b > ?', 1, 1]], else_=0, alias='large_b'))
+        users.append_column(SumColumn('indicator_c', filters=[EQ('user', 'username')]))
+
+        dates = QueryContext("user_table", filters=[LT('date', 'enddate')], group_by=['user'])
+        dates.append_column(SimpleColumn('user'))
+        dates.append_column(ArrayAggColumn('date', order_by=[OrderBy('date')]))
+
+        regions = QueryContext("region_table", group_by=['region', 'sub_region'], grouping_sets=ROLLUP)
+        regions.append_column(SumColumn('indicator_a'))
+        regions.append_column(SumColumn('indicator_b', filters=[GT('date', 'enddate')]))
+
+        entries = [
+            (users, {'enddate': date(2013, 2, 1), 'username': 'user1'}),
+            (dates, {'enddate': date(2013, 3, 1)}),
+            (users, {'enddate': date(2013, 3, 1), 'username': 'user2'}),
+            (regions, {'enddate': date(2013, 1, 1)}),
+            (users, {'enddate': date(2013, 2, 1), 'username': 'user1', 'unused': 1}),
+        ]
+        expected = [query_context.resolve(connection, filter_values) for query_context, filter_values in entries]
+
+        batch = QueryBatch()
+        self.assertEqual([batch.add(*entry) for entry in entries], [0, 1, 2, 3, 4])
+        statements = self._statements(connection)
+        results = batch.resolve(connection)
+        self.assertEqual(len(statements), 1)
+        # the queries of the last context are the same as those of the first one
+        self.assertEqual(statements[0].count('UNION ALL') + 1, 7)
+
+        self.assertEqual(results, expected)
+        for data, expected_data in zip(results, expected):
+            self.assertEqual(_types(data), _types(expected_data))
+
+    def test_order(self):
+        connection = self.session.connection()
+        users = QueryContext(
+            "user_table", group_by=['user'], order_by=[OrderBy('indicator_a', is_ascending=False)]
+        )
+        users.append_column(SumColumn('indicator_a'))
+        dates = QueryContext("user_table", order_by=[OrderBy('indicator_b'), OrderBy('date', is_ascending=False)])
+        dates.append_column(SimpleColumn('date'))
+        dates.append_column(SimpleColumn('user'))
+        entries = [(users, {}), (dates, {})]
+        expected = [query_context.resolve(connection, filter_values) for query_context, filter_values in entries]
+
+        batch = QueryBatch()
+        for entry in entries:
+            batch.add(*entry)
+        statements = self._statements(connection)
+        results = batch.resolve(connection)
+        self.assertEqual([list(data.values()) for data in results], [list(data.values()) for data in expected])
+        # ``dates`` isn't batched as it is ordered by a column it doesn't select
+        self.assertEqual(len(statements), 2)
+        self.assertIn('row_number() OVER (ORDER BY _sqlagg_batch_0.indicator_a DESC)', statements[1])
+
+    def test_empty(self):
+        self.assertEqual(QueryBatch().resolve(self.session.connection()), [])
+
+
+def _types(data):
+    """The keys and the types of the values of the rows of a ``resolve`` result, in order"""
+    types = []
+    for key, row in data.items():
+        if isinstance(row, OrderedDict):
+            types.append((key, _types(row)))
+        else:
+            types.append((key, [(label, type(value)) for label, value in row.items()]))
+    return types
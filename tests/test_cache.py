@@ -0,0 +1,216 @@
+import tempfile
+import threading
+from decimal import Decimal
+from unittest import TestCase
+
+from sqlagg.cache import (
+    FileBackend,
+    MemoryBackend,
+    ResultCache,
+    StatementCache,
+    Unkeyable,
+    freeze,
+)
+from sqlagg.columns import SumColumn, SumWhen, YearColumn
+from sqlagg.filters import EQ
+from sqlagg.sorting import OrderBy
+
+
+class TestStatementCache(TestCase):
+
+    def test_hits_and_misses(self):
+        cache = StatementCache()
+        self.assertEqual(cache.get('a', lambda: 1), 1)
+        self.assertEqual(cache.get('a', lambda: 2), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_lru_eviction(self):
+        cache = StatementCache(maxsize=2)
+        cache.get('a', lambda: 1)
+        cache.get('b', lambda: 2)
+        cache.get('a', lambda: 1)
+        cache.get('c', lambda: 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('a', lambda: 'rebuilt'), 1)
+        self.assertEqual(cache.get('b', lambda: 'rebuilt'), 'rebuilt')
+
+    def test_none_key_not_cached(self):
+        cache = StatementCache()
+        cache.get(None, lambda: 1)
+        self.assertEqual(cache.get(None, lambda: 2), 2)
+        self.assertEqual(len(cache), 0)
+
+
+class TestFreeze(TestCase):
+
+    def test_equal_structures(self):
+        self.assertEqual(
+            freeze([EQ('a', 'b'), OrderBy('c'), {'x': [1, 2]}]),
+            freeze([EQ('a', 'b'), OrderBy('c'), {'x': [1, 2]}]),
+        )
+
+    def test_column_keys(self):
+        self.assertEqual(SumColumn('a').sql_column.cache_key, SumColumn('a').sql_column.cache_key)
+        self.assertNotEqual(SumColumn('a').sql_column.cache_key, SumColumn('b').sql_column.cache_key)
+        self.assertEqual(
+            YearColumn('date', alias='year').sql_column.cache_key,
+            YearColumn('date', alias='year').sql_column.cache_key,
+        )
+
+    def test_scalar_types(self):
+        keys = [freeze(value) for value in [True, 1, 1.0, Decimal(1)]]
+        self.assertEqual(len(set(keys)), 4)
+        self.assertNotEqual(
+            SumWhen(whens=[['indicator_a > ?', 0, 1]], alias='positive').sql_column.cache_key,
+            SumWhen(whens=[['indicator_a > ?', 0, 1.0]], alias='positive').sql_column.cache_key,
+        )
+
+    def test_unkeyable(self):
+        with self.assertRaises(Unkeyable):
+            freeze(object())
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class BackendTests(object):
+
+    def test_get_and_expire(self):
+        self.backend.set('a', b'1', 10)
+        self.assertEqual(self.backend.get('a'), b'1')
+        self.clock.now += 10
+        self.assertIsNone(self.backend.get('a'))
+
+    def test_no_ttl_and_delete(self):
+        self.backend.set('a', b'1', None)
+        self.clock.now += 10 ** 6
+        self.assertEqual(self.backend.get('a'), b'1')
+        self.backend.delete('a')
+        self.assertIsNone(self.backend.get('a'))
+
+    def test_clear(self):
+        self.backend.set('a', b'1', 10)
+        self.backend.clear()
+        self.assertIsNone(self.backend.get('a'))
+
+
+class TestMemoryBackend(BackendTests, TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.backend = MemoryBackend()
+        self.backend.clock = self.clock
+
+    def test_lru_byte_budget(self):
+        backend = MemoryBackend(max_bytes=10)
+        backend.set('a', b'1234', 10)
+        backend.set('b', b'1234', 10)
+        backend.get('a')
+        backend.set('c', b'1234', 10)
+        self.assertEqual((backend.get('a'), backend.get('b'), backend.get('c')), (b'1234', None, b'1234'))
+        self.assertEqual(backend.size, 8)
+
+        backend.set('d', b'12345678901', 10)
+        self.assertIsNone(backend.get('d'))
+
+
+class TestFileBackend(BackendTests, TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.clock = Clock()
+        self.backend = FileBackend(directory.name)
+        self.backend.clock = self.clock
+
+
+class TestResultCache(TestCase):
+
+    def test_fetch(self):
+        cache = ResultCache()
+        self.assertEqual(cache.fetch('t', 'SELECT', {'x': [1, 2]}, lambda: [{'a': 1}]), [{'a': 1}])
+        self.assertEqual(cache.fetch('t', 'SELECT', {'x': [1, 2]}, list), [{'a': 1}])
+        self.assertEqual(cache.fetch('t', 'SELECT', {'x': [1, 3]}, list), [])
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_invalidate(self):
+        cache = ResultCache()
+        cache.fetch('t', 'SELECT', {}, lambda: [{'a': 1}])
+        cache.fetch('u', 'SELECT', {}, lambda: [{'a': 1}])
+        cache.invalidate('t')
+        self.assertEqual(cache.fetch('t', 'SELECT', {}, lambda: [{'a': 2}]), [{'a': 2}])
+        self.assertEqual(cache.fetch('u', 'SELECT', {}, lambda: [{'a': 2}]), [{'a': 1}])
+
+    def test_table_ttls(self):
+        cache = ResultCache(table_ttls={'live': 0})
+        cache.fetch('live', 'SELECT', {}, lambda: [{'a': 1}])
+        self.assertEqual(cache.fetch('live', 'SELECT', {}, lambda: [{'a': 2}]), [{'a': 2}])
+
+    def test_unkeyable_filter_values(self):
+        cache = ResultCache()
+        cache.fetch('t', 'SELECT', {'x': object()}, lambda: [{'a': 1}])
+        self.assertEqual(cache.fetch('t', 'SELECT', {'x': object()}, lambda: [{'a': 2}]), [{'a': 2}])
+
+
+class TestStaleWhileRevalidate(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        backend = MemoryBackend()
+        backend.clock = self.clock
+        self.cache = ResultCache(backend, ttl=10, stale_ttl=60, engine=object())
+        self.cache.clock = self.clock
+        self.cache.fetch('t', 'SELECT', {}, lambda: [{'a': 1}])
+
+    def test_serve_stale_and_refresh(self):
+        self.clock.now += 11
+        self.assertEqual(self.cache.fetch('t', 'SELECT', {}, list, lambda: [{'a': 2}]), [{'a': 1}])
+        self.cache.wait()
+        self.assertEqual(self.cache.fetch('t', 'SELECT', {}, list, lambda: [{'a': 3}]), [{'a': 2}])
+        self.assertEqual((self.cache.stale_hits, self.cache.refreshes, self.cache.hits), (1, 1, 1))
+        self.assertIsNotNone(self.cache.mean_refresh_seconds)
+
+    def test_expired_after_stale_ttl(self):
+        self.clock.now += 71
+        self.assertEqual(self.cache.fetch('t', 'SELECT', {}, lambda: [{'a': 2}], list), [{'a': 2}])
+        self.assertEqual(self.cache.stale_hits, 0)
+
+    def test_refreshes_coalesced(self):
+        release = threading.Event()
+        calls = []
+
+        def refresh():
+            calls.append(1)
+            release.wait(5)
+            return [{'a': 2}]
+
+        self.clock.now += 11
+        self.cache.fetch('t', 'SELECT', {}, list, refresh)
+        self.cache.fetch('t', 'SELECT', {}, list, refresh)
+        release.set()
+        self.cache.wait()
+        self.assertEqual((len(calls), self.cache.stale_hits), (1, 2))
+
+    def test_refresh_failure_keeps_stale_result(self):
+        def refresh():
+            raise RuntimeError("database unavailable")
+
+        self.clock.now += 11
+        self.cache.fetch('t', 'SELECT', {}, list, refresh)
+        self.cache.wait()
+        self.assertEqual(self.cache.refresh_failures, 1)
+        self.assertEqual(self.cache.fetch('t', 'SELECT', {}, list, list), [{'a': 1}])
+
+    def test_jitter(self):
+        cache = ResultCache(ttl=10, jitter=0.5)
+        cache.clock = self.clock
+        cache.fetch('t', 'SELECT', {}, lambda: [{'a': 1}])
+        self.clock.now += 4.9
+        self.assertEqual(cache.fetch('t', 'SELECT', {}, list), [{'a': 1}])
+        self.clock.now += 5.1
+        self.assertEqual(cache.fetch('t', 'SELECT', {}, list), [])
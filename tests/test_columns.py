@@ -1,4 +1,7 @@
 import datetime
+from collections import OrderedDict
+
+import numpy
 
 from sqlagg import (
     AggregateColumn,
@@ -11,6 +14,8 @@ from sqlagg import (
     SumColumn,
     SumWhen,
 )
+from sqlagg.base import PartialQueryMeta, SimpleQueryMeta
+from sqlagg.cache import ResultCache
 from sqlagg.columns import (
     ArrayAggColumn,
     ConditionalAggregation,
@@ -25,7 +30,7 @@ from sqlagg.columns import (
     YearColumn,
     YearQuarterColumn,
 )
-from sqlagg.filters import EQ
+from sqlagg.filters import EQ, GTE, LT
 from sqlagg.sorting import OrderBy
 
 from . import DataTestCase
@@ -110,6 +115,19 @@ class TestSqlAggViews(DataTestCase):
         self.assertEqual(i_a.get_value(data[0]), 6)
         self.assertEqual(i_a2.get_value(data[0]), 6)
 
+    def test_vectorized_values(self):
+        vc = QueryContext("user_table", group_by=['user'], order_by=[OrderBy('user')])
+        mean = MeanColumn("indicator_a", alias="mean_a")
+        ratio = AggregateColumn(lambda x, y: x / y, SumColumn("indicator_a"), CountColumn("indicator_b"))
+        vc.append_column(mean)
+        vc.append_column(ratio)
+        rows = vc.resolve(self.session.connection())
+        columns = vc.resolve_columnar(self.session.connection())
+
+        self.assertEqual(mean.get_values(columns).dtype, numpy.float64)
+        self.assertEqual(mean.get_values(columns).tolist(), [mean.get_value(row) for row in rows.values()])
+        self.assertEqual(ratio.get_values(columns).tolist(), [ratio.get_value(row) for row in rows.values()])
+
     def test_aggregate_column(self):
         col = AggregateColumn(lambda x, y: x + y,
                               SumColumn("indicator_a"),
@@ -134,6 +152,57 @@ class TestSqlAggViews(DataTestCase):
         col = SumWhen(whens=[['user_table.indicator_a between ? and ?', 1, 2, 0]], else_=1, alias='a')
         self._test_view(col, 2)
 
+    def test_conditional_column_stable_binds(self):
+        def context():
+            vc = QueryContext("user_table", group_by=['bucket'])
+            vc.append_column(ConditionalAggregation(whens=[
+                ["indicator_a between ? and ?", 0, 1, "'0-1'"],
+                ["indicator_a = ?", 2, "'2'"],
+            ], else_='3+', alias='bucket'))
+            vc.append_column(SumWhen(whens=[['indicator_b > ?', 0, 1]], else_=0, alias='positive b'))
+            return vc
+
+        # the same SQL is generated without the statement cache, e.g. in another process
+        SimpleQueryMeta.statement_cache.clear()
+        sql = context().get_query_strings(self.session.connection())
+        SimpleQueryMeta.statement_cache.clear()
+        self.assertEqual(context().get_query_strings(self.session.connection()), sql)
+        self.assertIn('%(_sqlagg_positive_20_b_0_0)s', sql[0])
+
+        cache = ResultCache()
+        for _ in range(2):
+            SimpleQueryMeta.statement_cache.clear()
+            vc = context()
+            vc.result_cache = cache
+            result = vc.resolve(self.session.connection())
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(result['0-1']['positive b'], 2)
+
+        # the values bound into the statement are part of the key
+        vc = QueryContext("user_table", group_by=['user'], result_cache=cache)
+        vc.append_column(SumWhen(whens=[['indicator_a < ?', 2, 1]], else_=0, alias='small'))
+        self.assertEqual(vc.resolve(self.session.connection())['user1']['small'], 1)
+        vc = QueryContext("user_table", group_by=['user'], result_cache=cache)
+        vc.append_column(SumWhen(whens=[['indicator_a < ?', 100, 1]], else_=0, alias='small'))
+        self.assertEqual(vc.resolve(self.session.connection())['user1']['small'], 2)
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+
+    def test_conditional_column_similar_labels(self):
+        vc = QueryContext("user_table")
+        vc.append_column(SumWhen(whens=[['indicator_a > ?', 0, 1]], else_=0, alias='a b'))
+        vc.append_column(SumWhen(whens=[['indicator_a > ?', 100, 1]], else_=0, alias='a_b'))
+        result = vc.resolve(self.session.connection())
+        self.assertEqual((result[0]['a b'], result[0]['a_b']), (3, 0))
+
+    def test_conditional_column_then_types(self):
+        results = []
+        for then in [1, 1.0]:
+            vc = QueryContext("user_table")
+            vc.append_column(SumWhen(whens=[['indicator_a > ?', 0, then]], else_=0, alias='positive'))
+            results.append(vc.resolve(self.session.connection())[0]['positive'])
+        self.assertEqual(results, [3, 3])
+        self.assertEqual([type(result) for result in results], [int, float])
+
     def test_conditional_column_multi(self):
         # sum(case user when 'user1' then indicator_a else 0)
         col = SumWhen(whens=[["user_table.user = 'user1'", 'indicator_a']], else_=0, alias='a')
@@ -247,3 +316,41 @@ class TestSqlAggViews(DataTestCase):
             ('user2', datetime.date(2013, 3, 1)): {'user': 'user2', 'year': 2013.0, 'indicator_a': 2,
                                                    'date': datetime.date(2013, 3, 1)}
         })
+
+    def test_combined_conditional_and_array_agg(self):
+        vc = QueryContext("region_table", group_by=['region'], combine_queries=True)
+        vc.append_column(ArrayAggColumn('indicator_a', 'date', filters=[EQ('sub_region', 'sub_region')]))
+        vc.append_column(SumWhen(whens=[['indicator_b > ?', 0, 1]], else_=0, alias='positive_b'))
+        self.assertEqual(len(vc.get_query_strings(self.session.connection())), 1)
+        result = vc.resolve(self.session.connection(), {'sub_region': 'region1_b'})
+        self.assertEqual(result, {
+            'region1': {'region': 'region1', 'indicator_a': [3, 1], 'positive_b': 3},
+            'region2': {'region': 'region2', 'positive_b': 1},
+        })
+
+    def test_partial_aggregates(self):
+        """Merging the partial aggregates of subsets of the rows gives the aggregates of all the rows"""
+        columns = [
+            SumColumn('indicator_a'),
+            CountColumn('indicator_c', alias='count_c'),
+            MaxColumn('indicator_a', alias='max_a'),
+            MinColumn('indicator_c', alias='min_c'),
+            MeanColumn('indicator_b', alias='mean_b'),
+            CountUniqueColumn('indicator_b', alias='unique_b'),
+            NonzeroSumColumn('indicator_d', alias='nonzero_d'),
+            ArrayAggColumn('indicator_a', order_by_col='date', alias='a_by_date'),
+            SumWhen('indicator_b', whens=[[1, 1]], else_=0, alias='ones_b'),
+        ]
+        vc = QueryContext("user_table", group_by=['user'])
+        for column in columns:
+            vc.append_column(column)
+        expected = vc.resolve(self.session.connection())
+        query_meta, = vc._get_query_metas()
+
+        states = OrderedDict()
+        for filter in [LT('date', 'split'), GTE('date', 'split')]:
+            partial_query_meta = PartialQueryMeta(query_meta, [filter])
+            rows = partial_query_meta.execute(self.session.connection(), {'split': datetime.date(2013, 2, 1)})
+            partial_query_meta.merge(states, rows)
+        for row in partial_query_meta.finalize(states):
+            self.assertEqual(row, dict(expected[row['user']]))
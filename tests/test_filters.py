@@ -103,6 +103,15 @@ class TestSqlAggViews(TestCase):
         )
         self.assertEqual(a, INFilter(self.column_name, ('option_2', 'option_1')))
 
+    def test_column_names(self):
+        self.assertEqual(EQFilter('a', 'a').column_names(), {'a'})
+        self.assertEqual(
+            AND([EQFilter('a', 'a'), NOT(OR([ISNULL('b'), BETWEEN('c', 'c1', 'c2')]))]).column_names(),
+            {'a', 'b', 'c'}
+        )
+        self.assertIsNone(RAW('a = 1').column_names())
+        self.assertIsNone(AND([EQFilter('a', 'a'), RAW('b = 1')]).column_names())
+
     def _test_equality(self, filterA, filterB, filterC):
         self.assertEqual(hash(filterA), hash(filterB))
         self.assertEqual(filterA, filterB)
@@ -0,0 +1,83 @@
+import os
+import subprocess
+import sys
+from datetime import date
+from unittest import TestCase
+
+from sqlalchemy import func
+
+from sqlagg import (
+    AggregateColumn,
+    AliasColumn,
+    QueryContext,
+    SimpleSqlColumn,
+    SumColumn,
+)
+from sqlagg.columns import CountUniqueColumn
+from sqlagg.filters import AND, EQ, GT, IN, LT, OR
+from sqlagg.fingerprints import Unfingerprintable, canonical
+
+SCRIPT = """
+from datetime import date
+from sqlalchemy import func
+from sqlagg import QueryContext, SumColumn
+from sqlagg.cache import ResultCache
+from sqlagg.columns import SumWhen
+from sqlagg.filters import AND, EQ, GT, IN, LT
+
+filters = [EQ('user', 'username'), IN('region', ['r1', 'r2']), LT('date', 'enddate'), GT('date', 'startdate')]
+column = SumWhen('indicator_a', whens=[['x', 1]], else_=0, filters=filters, alias='a')
+vc = QueryContext('user_table', filters=[AND(filters[:2])], group_by=['user'])
+vc.append_column(column)
+query_meta, = vc._get_query_metas()
+print([f.column_name for f in sorted(filters)])
+print(column.column_key[1] == tuple(sorted(filters)), column.fingerprint, query_meta.fingerprint)
+print(ResultCache().key('user_table', 'SELECT 1', {'enddate': date(2013, 1, 1), 'users': ['a', 'b']}))
+"""
+
+
+class TestFingerprints(TestCase):
+
+    def test_filters(self):
+        self.assertEqual(EQ('user', 'username').fingerprint, EQ('user', 'username').fingerprint)
+        self.assertNotEqual(EQ('user', 'username').fingerprint, EQ('user', 'other').fingerprint)
+        self.assertNotEqual(EQ('user', 'username').fingerprint, LT('user', 'username').fingerprint)
+        self.assertEqual(
+            AND([EQ('a', 'b'), OR([GT('c', 'd'), LT('c', 'e')])]).fingerprint,
+            AND([OR([LT('c', 'e'), GT('c', 'd')]), EQ('a', 'b')]).fingerprint,
+        )
+        self.assertEqual(IN('a', ['x', 'y']).fingerprint, IN('a', ['y', 'x']).fingerprint)
+
+    def test_columns(self):
+        self.assertEqual(
+            SumColumn('a', filters=[EQ('b', 'c')]).fingerprint, SumColumn('a', filters=[EQ('b', 'c')]).fingerprint
+        )
+        self.assertNotEqual(SumColumn('a').fingerprint, SumColumn('a', alias='b').fingerprint)
+        self.assertNotEqual(SumColumn('a').fingerprint, CountUniqueColumn('a').fingerprint)
+        self.assertIsNotNone(AggregateColumn(max, AliasColumn('a'), SumColumn('b')).fingerprint)
+        self.assertIsNone(AggregateColumn(lambda a, b: a / b, AliasColumn('a'), SumColumn('b')).fingerprint)
+        self.assertIsNone(SimpleSqlColumn('a', lambda c: func.sum(c)).fingerprint)
+
+    def test_query_metas(self):
+        def query_meta(**kwargs):
+            vc = QueryContext('user_table', group_by=['user'], **kwargs)
+            vc.append_column(SumColumn('indicator_a'))
+            return vc._get_query_metas()[0]
+
+        self.assertEqual(query_meta().fingerprint, query_meta().fingerprint)
+        self.assertNotEqual(query_meta().fingerprint, query_meta(filters=[EQ('user', 'username')]).fingerprint)
+
+    def test_canonical(self):
+        self.assertEqual(canonical({'b': 1, 'a': date(2013, 1, 1)}), [
+            'dict', ['a', ['date', '2013-01-01']], ['b', ['int', '1']]
+        ])
+        self.assertNotEqual(canonical(1), canonical(1.0))
+        with self.assertRaises(Unfingerprintable):
+            canonical(object())
+
+    def test_same_in_every_process(self):
+        outputs = set()
+        for seed in ('1', '2', '3'):
+            env = dict(os.environ, PYTHONHASHSEED=seed)
+            outputs.add(subprocess.check_output([sys.executable, '-c', SCRIPT], env=env))
+        self.assertEqual(len(outputs), 1)
@@ -0,0 +1,115 @@
+from datetime import date
+
+from sqlalchemy import event
+
+from sqlagg import ROLLUP, QueryContext
+from sqlagg.columns import CountColumn, SimpleColumn, SumColumn
+from sqlagg.filters import LT
+from sqlagg.memo import QueryMemo, current_memo
+from sqlagg.sorting import OrderBy
+
+from . import DataTestCase
+
+
+class TestQueryMemo(DataTestCase):
+
+    def _statements(self, connection):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(connection, 'before_cursor_execute', before_cursor_execute)
+        self.addCleanup(event.remove, connection, 'before_cursor_execute', before_cursor_execute)
+        return statements
+
+    def _context(self, *columns, **kwargs):
+        vc = QueryContext(
+            "user_table", filters=[LT('date', 'enddate')], group_by=['user'], order_by=[OrderBy('user')], **kwargs
+        )
+        vc.append_column(SimpleColumn('user'))
+        for column in columns:
+            vc.append_column(column)
+        return vc
+
+    def test_identical_queries(self):
+        connection = self.session.connection()
+        filter_values = {'enddate': date(2013, 3, 1)}
+        first = self._context(SumColumn('indicator_a'))
+        second = self._context(SumColumn('indicator_a'))
+        expected = first.resolve(connection, filter_values)
+
+        statements = self._statements(connection)
+        with QueryMemo() as memo:
+            self.assertIs(current_memo(), memo)
+            self.assertEqual(first.resolve(connection, filter_values), expected)
+            self.assertEqual(second.resolve(connection, filter_values), expected)
+            self.assertEqual(second.count(connection, filter_values), 2)
+            self.assertEqual(first.count(connection, filter_values), 2)
+            self.assertEqual(first.totals(connection, ['indicator_a'], filter_values), {'indicator_a': 4})
+            self.assertEqual(second.totals(connection, ['indicator_a'], filter_values), {'indicator_a': 4})
+            # other filter values are run again
+            self.assertEqual(second.resolve(connection, {'enddate': date(2013, 1, 1)}), {})
+        self.assertIsNone(current_memo())
+        self.assertEqual(len(statements), 4)
+        self.assertEqual((memo.executes, memo.hits), (4, 3))
+
+        first.resolve(connection, filter_values)
+        self.assertEqual(len(statements), 5)
+
+    def test_superset(self):
+        connection = self.session.connection()
+        filter_values = {'enddate': date(2013, 3, 1)}
+        narrow = self._context(SumColumn('indicator_a'))
+        wide = self._context(SumColumn('indicator_a'), CountColumn('indicator_b', alias='count_b'))
+        other = self._context(SumColumn('indicator_b'), SumColumn('indicator_c', alias='indicator_a'))
+        expected = [vc.resolve(connection, filter_values) for vc in (narrow, wide, other)]
+
+        statements = self._statements(connection)
+        with QueryMemo() as memo:
+            memo.add(narrow, wide, other)
+            # the narrow query selects the columns of the others, except for the one whose label is taken
+            self.assertEqual(narrow.resolve(connection, filter_values), expected[0])
+            self.assertEqual(wide.resolve(connection, filter_values), expected[1])
+            self.assertEqual(other.resolve(connection, filter_values), expected[2])
+        self.assertEqual(len(statements), 2)
+        self.assertIn('count_b', statements[0])
+        self.assertEqual([list(row) for row in narrow.resolve(connection, filter_values).values()], [
+            list(row) for row in expected[0].values()
+        ])
+
+        # without ``add`` only queries with fewer columns are answered from earlier queries
+        statements[:] = []
+        with QueryMemo():
+            self.assertEqual(wide.resolve(connection, filter_values), expected[1])
+            self.assertEqual(narrow.resolve(connection, filter_values), expected[0])
+        self.assertEqual(len(statements), 1)
+
+    def test_not_merged(self):
+        connection = self.session.connection()
+        filter_values = {'enddate': date(2013, 3, 1)}
+        unfiltered = QueryContext("user_table", group_by=['user'], order_by=[OrderBy('user')])
+        unfiltered.append_column(SumColumn('indicator_a'))
+        rollup = self._context(SumColumn('indicator_a'), grouping_sets=ROLLUP)
+        contexts = [self._context(SumColumn('indicator_b')), unfiltered, rollup]
+        expected = [vc.resolve(connection, filter_values) for vc in contexts]
+
+        statements = self._statements(connection)
+        with QueryMemo() as memo:
+            memo.add(*contexts)
+            self.assertEqual([vc.resolve(connection, filter_values) for vc in contexts], expected)
+        self.assertEqual(len(statements), 3)
+
+    def test_ungrouped_not_merged(self):
+        connection = self.session.connection()
+        total = QueryContext("user_table")
+        total.append_column(SumColumn('indicator_a'))
+        users = QueryContext("user_table")
+        users.append_column(SimpleColumn('user'))
+        expected = [vc.resolve(connection) for vc in (total, users)]
+
+        with QueryMemo() as memo:
+            memo.add(total, users)
+            self.assertEqual([vc.resolve(connection) for vc in (total, users)], expected)
+            self.assertEqual(total.resolve(connection), expected[0])
+        self.assertEqual((memo.executes, memo.hits), (2, 1))
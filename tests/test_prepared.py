@@ -0,0 +1,81 @@
+from datetime import date
+
+from sqlalchemy import func
+
+from sqlagg import QueryContext, SimpleQueryMeta, SumColumn, SumWhen
+from sqlagg.columns import SimpleColumn
+from sqlagg.filters import EQ, LT
+from sqlagg.prepared import PreparedStatements, _parameter_type
+
+from . import DataTestCase
+
+
+class TestPreparedStatements(DataTestCase):
+
+    def setUp(self):
+        super(TestPreparedStatements, self).setUp()
+        self.prepared_statements = PreparedStatements(maxsize=2)
+        SimpleQueryMeta.prepared_statements = self.prepared_statements
+        self.addCleanup(setattr, SimpleQueryMeta, 'prepared_statements', None)
+        self.addCleanup(self.prepared_statements.clear, self.session.connection())
+
+    def _context(self, *filters):
+        vc = QueryContext("user_table", filters=list(filters), group_by=['user'])
+        vc.append_column(SimpleColumn('user'))
+        vc.append_column(SumColumn('indicator_a'))
+        vc.append_column(SumWhen(whens=[['indicator_b > ?', 0, 1]], else_=0, alias='positive_b'))
+        return vc
+
+    def test_reuse(self):
+        connection = self.session.connection()
+        vc = self._context(LT('date', 'enddate'))
+        self.assertEqual(vc.resolve(connection, {'enddate': date(2013, 2, 1)}), {
+            'user1': {'user': 'user1', 'indicator_a': 1, 'positive_b': 1},
+            'user2': {'user': 'user2', 'indicator_a': 0, 'positive_b': 1},
+        })
+        self.assertEqual(vc.resolve(connection, {'enddate': date(2013, 3, 1)}), {
+            'user1': {'user': 'user1', 'indicator_a': 4, 'positive_b': 1},
+            'user2': {'user': 'user2', 'indicator_a': 0, 'positive_b': 1},
+        })
+        vc = self._context(LT('date', 'enddate'))
+        self.assertEqual(vc.resolve(connection, {'enddate': date(2013, 1, 1)}), {})
+        self.assertEqual((self.prepared_statements.prepares, self.prepared_statements.executes), (1, 3))
+        self.assertEqual(len(self.prepared_statements.prepared(connection)), 1)
+
+        # the result types are the same as when the statement isn't prepared
+        SimpleQueryMeta.prepared_statements = None
+        unprepared = vc.resolve(connection, {'enddate': date(2013, 3, 1)})
+        SimpleQueryMeta.prepared_statements = self.prepared_statements
+        prepared = vc.resolve(connection, {'enddate': date(2013, 3, 1)})
+        self.assertEqual(
+            [type(value) for value in unprepared['user1'].values()],
+            [type(value) for value in prepared['user1'].values()],
+        )
+
+    def test_eviction(self):
+        connection = self.session.connection()
+        for filters in ([LT('date', 'enddate')], [EQ('user', 'username')], []):
+            self._context(*filters).resolve(connection, {'enddate': date(2013, 2, 1), 'username': 'user1'})
+        self.assertEqual(self.prepared_statements.deallocations, 1)
+        prepared = connection.execute('SELECT name FROM pg_prepared_statements').fetchall()
+        self.assertEqual(
+            sorted(name for name, in prepared if name.startswith('sqlagg_')),
+            sorted(self.prepared_statements.prepared(connection)),
+        )
+
+    def test_not_prepared(self):
+        connection = self.session.connection()
+        # columns without a fingerprint
+        vc = QueryContext("user_table", filters=[LT('date', 'enddate')])
+        max_column = SimpleColumn('indicator_a')
+        max_column.aggregate_fn = lambda c: func.max(c)
+        vc.append_column(max_column)
+        self.assertEqual(vc.resolve(connection, {'enddate': date(2013, 2, 1)})[0]['indicator_a'], 1)
+        # values without a parameter type
+        self.assertIsNone(_parameter_type(['user1']))
+        self.assertEqual((self.prepared_statements.prepares, self.prepared_statements.executes), (0, 0))
+
+        # strings are typed where they are used
+        vc = self._context(EQ('user', 'username'))
+        self.assertEqual(vc.resolve(connection, {'username': 'user1'})['user1']['indicator_a'], 4)
+        self.assertEqual((self.prepared_statements.prepares, self.prepared_statements.executes), (1, 1))
@@ -0,0 +1,82 @@
+from unittest import mock
+
+from sqlagg import QueryContext, SimpleQueryMeta
+from sqlagg.columns import CountColumn, MaxColumn, MeanColumn, SimpleColumn, SumColumn, SumWhen
+from sqlagg.filters import EQ, GT, RAW
+from sqlagg.rollups import COUNT, MAX, SUM, RollupRegistry, RollupTable
+from . import DataTestCase
+
+AGGREGATES = {
+    (SUM, 'indicator_a'): 'indicator_a_sum',
+    (COUNT, 'indicator_a'): 'indicator_a_count',
+    (MAX, 'indicator_b'): 'indicator_b_max',
+}
+
+
+class TestRollups(DataTestCase):
+
+    def setUp(self):
+        super(TestRollups, self).setUp()
+        connection = self.session.connection()
+        for name, group_by in [('region_rollup', 'region'), ('sub_region_rollup', 'region, sub_region')]:
+            connection.execute(
+                "CREATE TABLE {name} AS SELECT {group_by}, sum(indicator_a) AS indicator_a_sum, "
+                "count(indicator_a) AS indicator_a_count, max(indicator_b) AS indicator_b_max "
+                "FROM region_table GROUP BY {group_by}".format(name=name, group_by=group_by)
+            )
+        registry = RollupRegistry([
+            RollupTable('sub_region_rollup', 'region_table', ['region', 'sub_region'], AGGREGATES),
+            RollupTable('region_rollup', 'region_table', ['region'], AGGREGATES),
+        ])
+        patch = mock.patch.object(SimpleQueryMeta, 'rollups', registry)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def _resolve(self, group_by, columns, filters=None, filter_values=None):
+        vc = QueryContext("region_table", filters=filters, group_by=group_by)
+        for column in columns:
+            vc.append_column(column)
+        connection = self.session.connection()
+        return vc.get_query_strings(connection), vc.resolve(connection, filter_values)
+
+    def _columns(self):
+        return [
+            SumColumn('indicator_a'),
+            CountColumn('indicator_a', alias='a_count'),
+            MeanColumn('indicator_a', alias='a_mean'),
+            MaxColumn('indicator_b'),
+        ]
+
+    def test_routes_to_smallest_rollup(self):
+        queries, data = self._resolve(['region'], self._columns())
+        self.assertIn('FROM region_rollup', queries[0])
+        self.assertEqual(dict(data['region1']), {
+            'region': 'region1', 'indicator_a': 5, 'a_count': 4, 'a_mean': 1.25, 'indicator_b': 1,
+        })
+        self.assertEqual(data['region2']['a_mean'], 2)
+
+        queries, data = self._resolve(['region', 'sub_region'], self._columns(), [EQ('region', 'region')],
+                                      {'region': 'region1'})
+        self.assertIn('FROM sub_region_rollup', queries[0])
+        self.assertEqual(data[('region1', 'region1_b')]['indicator_a'], 4)
+        self.assertEqual(data[('region1', 'region1_b')]['a_count'], 2)
+        self.assertEqual(list(data), [('region1', 'region1_a'), ('region1', 'region1_b')])
+
+    def test_ungrouped(self):
+        queries, data = self._resolve(None, [SumColumn('indicator_a'), CountColumn('indicator_a', alias='a_count')])
+        self.assertIn('FROM region_rollup', queries[0])
+        self.assertEqual(dict(data[0]), {'indicator_a': 7, 'a_count': 5})
+
+    def test_falls_back_to_base_table(self):
+        for group_by, columns, filters in [
+            (['region'], [SumColumn('indicator_a')], [GT('date', 'date')]),
+            (['region'], [SumColumn('indicator_a')], [RAW("region = 'region1'")]),
+            (['region'], [SumColumn('indicator_b')], None),
+            (['region'], [SumWhen('sub_region', whens=[['region1_a', 1]], else_=0, alias='a')], None),
+            (['region'], [SimpleColumn('indicator_a')], None),
+            (['date'], [SumColumn('indicator_a')], None),
+        ]:
+            vc = QueryContext("region_table", filters=filters, group_by=group_by)
+            for column in columns:
+                vc.append_column(column)
+            self.assertIn('FROM region_table', vc.get_query_strings(self.session.connection())[0])
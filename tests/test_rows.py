@@ -0,0 +1,38 @@
+from unittest import TestCase
+
+from sqlagg.rows import Row, RowSchema
+
+
+class TestRow(TestCase):
+
+    def setUp(self):
+        self.schema = RowSchema()
+        positions = [self.schema.position(label) for label in ['user', 'indicator_a']]
+        self.row = Row(self.schema)
+        self.row.set_values(positions, ('user1', 4))
+
+    def test_mapping(self):
+        self.assertEqual(self.row['user'], 'user1')
+        self.assertEqual(self.row.get('indicator_a'), 4)
+        self.assertIsNone(self.row.get('indicator_b'))
+        self.assertEqual(self.row, {'user': 'user1', 'indicator_a': 4})
+        self.assertEqual(list(self.row.items()), [('user', 'user1'), ('indicator_a', 4)])
+
+    def test_missing_labels(self):
+        other = Row(self.schema)
+        other.set_values([self.schema.position('indicator_b')], (3,))
+        self.assertNotIn('indicator_b', self.row)
+        self.assertNotIn('user', other)
+        self.assertEqual(len(other), 1)
+        with self.assertRaises(KeyError):
+            self.row['indicator_b']
+
+    def test_mutation(self):
+        self.row['indicator_b'] = 1
+        del self.row['user']
+        self.assertEqual(self.row, {'indicator_a': 4, 'indicator_b': 1})
+        self.assertEqual(self.schema.labels, ['user', 'indicator_a', 'indicator_b'])
+
+    def test_no_instance_dict(self):
+        with self.assertRaises(AttributeError):
+            self.row.__dict__
@@ -0,0 +1,85 @@
+import pickle
+
+from sqlalchemy import text
+
+from sqlagg import (
+    CountColumn,
+    MeanColumn,
+    QueryContext,
+    SqlAggException,
+    SumColumn,
+    SumWhen,
+)
+from sqlagg.cache import ResultCache
+from sqlagg.sampling import BERNOULLI, HASH, SYSTEM, Estimate, Sample
+
+from . import DataTestCase
+
+
+class TestSampling(DataTestCase):
+
+    def setUp(self):
+        super(TestSampling, self).setUp()
+        self.session.connection().execute(text(
+            "CREATE TEMP TABLE sample_table AS "
+            "SELECT i AS id, i % 2 AS grp, i % 10 AS value FROM generate_series(1, 20000) AS i"
+        ))
+
+    def _context(self, sample, **kwargs):
+        vc = QueryContext("sample_table", group_by=['grp'], sample=sample, **kwargs)
+        vc.append_column(SumColumn('value'))
+        vc.append_column(CountColumn('id'))
+        vc.append_column(MeanColumn('value', alias='mean'))
+        vc.append_column(SumWhen('value', whens=[[9, 1]], else_=0, alias='nines'))
+        return vc
+
+    def test_estimates(self):
+        for method, column in [(BERNOULLI, None), (SYSTEM, None), (HASH, 'id')]:
+            data = self._context(Sample(20, method, seed=1, column=column)).resolve(self.session.connection())
+            self.assertEqual(sorted(data), [0, 1])
+            exact = {
+                0: {'value': 40000, 'id': 10000, 'nines': 0},
+                1: {'value': 50000, 'id': 10000, 'nines': 2000},
+            }
+            for key, row in data.items():
+                for label, total in exact[key].items():
+                    estimate = row[label]
+                    self.assertIsInstance(estimate, Estimate)
+                    low, high = estimate.interval(0.999)
+                    if method != SYSTEM:
+                        self.assertTrue(low <= total <= high, (method, label, low, total, high))
+                self.assertNotIsInstance(row['mean'], Estimate)
+
+    def test_seed_reproduces_sample(self):
+        for method, column in [(BERNOULLI, None), (HASH, 'id')]:
+            first = self._context(Sample(10, method, seed=3, column=column)).resolve(self.session.connection())
+            second = self._context(Sample(10, method, seed=3, column=column)).resolve(self.session.connection())
+            self.assertEqual(first, second)
+            other = self._context(Sample(10, method, seed=4, column=column)).resolve(self.session.connection())
+            self.assertNotEqual(first, other)
+
+    def test_full_sample(self):
+        data = self._context(Sample(100, HASH, column='id')).resolve(self.session.connection())
+        self.assertEqual(data[0]['value'], 40000)
+        self.assertEqual(data[0]['value'].error, 0)
+
+    def test_result_cache(self):
+        cache = ResultCache()
+        ten = self._context(Sample(10, HASH, column='id'), result_cache=cache).resolve(self.session.connection())
+        twenty = self._context(Sample(20, HASH, column='id'), result_cache=cache).resolve(
+            self.session.connection()
+        )
+        self.assertEqual(cache.misses, 2)
+        self.assertNotEqual(ten, twenty)
+
+    def test_estimate_pickles(self):
+        estimate = pickle.loads(pickle.dumps(Estimate(10.0, 2.0)))
+        self.assertEqual((estimate, estimate.error), (10.0, 2.0))
+
+    def test_invalid(self):
+        with self.assertRaises(SqlAggException):
+            Sample(0)
+        with self.assertRaises(SqlAggException):
+            Sample(10, HASH)
+        with self.assertRaises(SqlAggException):
+            Sample(10, 'random')
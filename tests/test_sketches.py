@@ -0,0 +1,101 @@
+import pickle
+from datetime import date
+
+from sqlalchemy import func, text
+
+from sqlagg import (
+    ApproxCountUniqueColumn,
+    CountUniqueColumn,
+    QueryContext,
+    SqlAggException,
+    SumColumn,
+)
+from sqlagg.columns import MonthColumn
+from sqlagg.filters import LT
+from sqlagg.sketches import HyperLogLog
+from sqlagg.sorting import OrderBy
+
+from . import DataTestCase
+
+
+class TestHyperLogLog(DataTestCase):
+
+    def setUp(self):
+        super(TestHyperLogLog, self).setUp()
+        self.session.connection().execute(text(
+            "CREATE TEMP TABLE sketch_table AS "
+            "SELECT i % 3 AS grp, i % 20000 AS value FROM generate_series(1, 60000) AS i"
+        ))
+
+    def test_precision_for(self):
+        self.assertEqual(HyperLogLog.precision_for(0.02), 12)
+        self.assertEqual(HyperLogLog.precision_for(0.5), 4)
+        self.assertEqual(HyperLogLog.precision_for(0.0001), 16)
+
+    def test_estimate(self):
+        vc = QueryContext("sketch_table", group_by=['grp'])
+        vc.append_column(ApproxCountUniqueColumn('value', error=0.02))
+        vc.append_column(CountUniqueColumn('value', alias='exact'))
+        vc.append_column(SumColumn('value', alias='total'))
+        data = vc.resolve(self.session.connection())
+
+        self.assertEqual(sorted(data), [0, 1, 2])
+        for row in data.values():
+            sketch = row['value']
+            self.assertAlmostEqual(sketch.error, 0.01625)
+            lower, upper = sketch.bounds(deviations=3)
+            self.assertLessEqual(lower, row['exact'])
+            self.assertGreaterEqual(upper, row['exact'])
+
+        merged = data[0]['value'] | data[1]['value'] | data[2]['value']
+        lower, upper = merged.bounds(deviations=3)
+        self.assertTrue(lower <= 20000 <= upper)
+        self.assertEqual(pickle.loads(pickle.dumps(merged)), merged)
+
+    def test_small_counts(self):
+        vc = QueryContext("user_table", filters=[LT('date', 'enddate')], group_by=['user'])
+        column = ApproxCountUniqueColumn('indicator_a', alias='unique_a')
+        vc.append_column(column)
+        data = vc.resolve(self.session.connection(), {'enddate': date(2013, 2, 1)})
+        self.assertEqual({key: column.get_value(row) for key, row in data.items()}, {'user1': 1, 'user2': 1})
+        self.assertEqual(dict(vc.iter_resolve(self.session.connection(), {'enddate': date(2013, 2, 1)})), {
+            key: dict(row) for key, row in data.items()
+        })
+
+        vc = QueryContext("user_table", filters=[LT('date', 'enddate')])
+        vc.append_column(column)
+        data = vc.resolve(self.session.connection(), {'enddate': date(2000, 1, 1)})
+        self.assertEqual(column.get_value(data[0]), 0)
+
+    def test_aliased_group_column(self):
+        columns = [ApproxCountUniqueColumn('user', alias='users'), MonthColumn('date', alias='month')]
+        for ordered_columns in [columns, columns[::-1]]:
+            vc = QueryContext("user_table", group_by=['month'])
+            for column in ordered_columns:
+                vc.append_column(column)
+            data = vc.resolve(self.session.connection())
+            self.assertEqual({key: row['users'].count for key, row in data.items()}, {1: 2, 2: 1, 3: 1})
+
+    def test_paging(self):
+        vc = QueryContext("user_table", group_by=['user'], order_by=[OrderBy('user')], limit=1)
+        vc.append_column(ApproxCountUniqueColumn('indicator_a'))
+        with self.assertRaises(SqlAggException):
+            vc.resolve(self.session.connection())
+
+        vc = QueryContext("user_table", group_by=['user'], distinct_on=['user'])
+        vc.append_column(ApproxCountUniqueColumn('indicator_a'))
+        with self.assertRaises(SqlAggException):
+            vc.resolve(self.session.connection())
+
+    def test_merge_partitions(self):
+        vc = QueryContext("sketch_table", group_by=['grp'])
+        vc.append_column(ApproxCountUniqueColumn('value', hash_fn=lambda value: func.hashint8extended(value, 0)))
+        expected = vc.resolve(self.session.connection())
+
+        data = vc.resolve_partitioned(self.session.connection(), 'value', [5000, 10000], max_workers=1)
+        self.assertEqual(dict(data[1]), dict(expected[1]))
+        self.assertEqual(data[1]['value'].registers, expected[1]['value'].registers)
+
+    def test_merge_different_precisions(self):
+        with self.assertRaises(SqlAggException):
+            HyperLogLog(4).merge(HyperLogLog(5))
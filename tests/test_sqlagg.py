@@ -1,14 +1,95 @@
+import asyncio
+import json
+import time
+import uuid
 from datetime import date
+from decimal import Decimal
 
-from sqlalchemy.exc import ProgrammingError
+import numpy
+from sqlalchemy import func
+from sqlalchemy.exc import DBAPIError, ProgrammingError
 
-from sqlagg import QueryContext, BaseColumn, DuplicateColumnsException, AggregateColumn
-from sqlagg.columns import SimpleColumn, SumColumn, CountColumn, MeanColumn
+from sqlagg import QueryContext, BaseColumn, DuplicateColumnsException, AggregateColumn, SimpleQueryMeta, \
+    SqlAggException, ROLLUP, CUBE
+from sqlagg.cache import ResultCache
+from sqlagg.columns import SimpleColumn, SumColumn, CountColumn, MeanColumn, MinColumn, CountUniqueColumn, \
+    ArrayAggColumn, NonzeroSumColumn, SumWhen
 from sqlagg.filters import LT, GTE, GT, AND, EQ
+from sqlagg.rows import Row
 from sqlagg.sorting import OrderBy
 from . import DataTestCase
 
 
+class AsyncRow(tuple):
+    """Row of values that can also be looked up by label, like the records of async drivers"""
+
+    def __new__(cls, labels, values):
+        row = super(AsyncRow, cls).__new__(cls, values)
+        row.labels = labels
+        return row
+
+    def keys(self):
+        return self.labels
+
+    def items(self):
+        return zip(self.labels, self)
+
+    def __getitem__(self, key):
+        return super(AsyncRow, self).__getitem__(self.labels.index(key) if isinstance(key, str) else key)
+
+
+class AsyncResult(object):
+    def __init__(self, rows):
+        self.rows = rows
+
+    def fetchall(self):
+        return self.rows
+
+    def scalar(self):
+        return self.rows[0][0] if self.rows else None
+
+
+class AsyncConnection(object):
+    """
+    Stand-in for an async driver: like a real driver it only gets the SQL of the statement and the
+    parameters, which it runs on a DBAPI cursor of a regular connection
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.dialect = connection.dialect
+
+    async def execute(self, statement, parameters):
+        await asyncio.sleep(0)
+        cursor = self.connection.connection.cursor()
+        try:
+            cursor.execute(str(statement), parameters)
+            labels = [description[0] for description in cursor.description]
+            return AsyncResult([AsyncRow(labels, row) for row in cursor.fetchall()])
+        finally:
+            cursor.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+class AsyncEngine(object):
+    def __init__(self, connection):
+        self.connection = connection
+        self.connections = 0
+
+    def connect(self):
+        self.connections += 1
+        return AsyncConnection(self.connection)
+
+
+class StdDevColumn(BaseColumn):
+    aggregate_fn = func.stddev
+
+
 class TestSqlAgg(DataTestCase):
 
     def test_single_group(self):
@@ -19,6 +100,23 @@ class TestSqlAgg(DataTestCase):
         self.assertEqual(data['user2']['indicator_a'], 2)
         self.assertEqual(data['user2']['indicator_b'], 2)
 
+    def test_rows_are_dicts(self):
+        data = self._get_user_data(None, None)
+        self.assertIsInstance(data['user1'], dict)
+        self.assertEqual(json.loads(json.dumps(data)), {
+            'user1': {'user': 'user1', 'indicator_a': 4, 'indicator_b': 2},
+            'user2': {'user': 'user2', 'indicator_a': 2, 'indicator_b': 2},
+        })
+
+    def test_compact_rows(self):
+        vc = QueryContext("user_table", group_by=["user"], compact_rows=True)
+        vc.append_column(SumColumn("indicator_a"))
+        vc.append_column(SumColumn("indicator_b", filters=[GT('date', 'enddate')]))
+        data = vc.resolve(self.session.connection(), {'enddate': date(2013, 2, 1)})
+        self.assertIsInstance(data['user1'], Row)
+        self.assertEqual(data['user1'], {'user': 'user1', 'indicator_a': 4})
+        self.assertEqual(data['user2'], {'user': 'user2', 'indicator_a': 2, 'indicator_b': 1})
+
     def test_filters(self):
         filters = [LT('date', 'enddate')]
         filter_values = {"enddate": date(2013, 2, 1)}
@@ -346,3 +444,525 @@ class TestSqlAgg(DataTestCase):
         vc.append_column(i_a)
         vc.append_column(i_b)
         return vc.resolve(self.session.connection(), filter_values)
+
+    def test_statement_cache(self):
+        SimpleQueryMeta.statement_cache.clear()
+        filters = [LT('date', 'enddate')]
+        self.assertEqual(self._get_user_data({"enddate": date(2013, 2, 1)}, filters)['user1']['indicator_a'], 1)
+        self.assertEqual(SimpleQueryMeta.statement_cache.misses, 1)
+
+        data = self._get_user_data({"enddate": date(2013, 3, 1)}, filters)
+        self.assertEqual(data['user1']['indicator_a'], 4)
+        self.assertEqual(SimpleQueryMeta.statement_cache.hits, 1)
+        self.assertEqual(SimpleQueryMeta.statement_cache.misses, 1)
+
+    def test_combine_queries(self):
+        filters = [LT('date', 'enddate')]
+        filter_values = {"enddate": date(2013, 2, 1)}
+        vc = QueryContext("user_table", filters=filters, group_by=["user"], combine_queries=True)
+        vc.append_column(SimpleColumn("user"))
+        vc.append_column(SumColumn("indicator_a"))
+        vc.append_column(SumColumn("indicator_b", filters=[GT('date', 'enddate')]))
+        vc.append_column(CountColumn("indicator_c", filters=[EQ('user', 'username')]))
+        filter_values = {"enddate": date(2013, 2, 1), "username": "user1"}
+
+        self.assertEqual(1, len(vc.get_query_strings(self.session.connection())))
+        data = vc.resolve(self.session.connection(), filter_values)
+        self.assertEqual(data, {
+            'user1': {'user': 'user1', 'indicator_a': 1, 'indicator_c': 1},
+            'user2': {'user': 'user2', 'indicator_a': 0, 'indicator_b': 1},
+        })
+
+    def test_combine_queries_duplicate_labels(self):
+        vc = QueryContext("user_table", group_by=["user"], combine_queries=True)
+        vc.append_column(SumColumn("indicator_a", filters=[LT('date', 'enddate')]))
+        vc.append_column(SumColumn("indicator_a", filters=[GT('date', 'enddate')]))
+        vc.append_column(SumColumn("indicator_b", filters=[GT('date', 'enddate')]))
+        self.assertEqual(2, len(vc.get_query_strings(self.session.connection())))
+
+    def test_resolve_concurrent(self):
+        vc = QueryContext("user_table", filters=[LT('date', 'enddate')], group_by=["user"])
+        vc.append_column(SimpleColumn("user"))
+        vc.append_column(SumColumn("indicator_a"))
+        vc.append_column(SumColumn("indicator_b", filters=[GT('date', 'enddate')]))
+        vc.append_column(CountColumn("indicator_c", filters=[EQ('user', 'username')]))
+        filter_values = {"enddate": date(2013, 2, 1), "username": "user1"}
+
+        # a connection hands out branches of itself so it can stand in for an engine
+        data = vc.resolve_concurrent(self.session.connection(), filter_values, max_workers=2)
+        self.assertEqual(data, vc.resolve(self.session.connection(), filter_values))
+
+    def test_resolve_concurrent_error(self):
+        vc = QueryContext("user_table", group_by=["user"])
+        vc.append_column(SumColumn("indicator_a", table_name="missing_table"))
+        vc.append_column(SumColumn("indicator_b"))
+
+        with self.assertRaises(ProgrammingError):
+            vc.resolve_concurrent(self.session.connection(), max_workers=1)
+
+    def test_aresolve(self):
+        vc = QueryContext("user_table", filters=[LT('date', 'enddate')], group_by=["user"])
+        vc.append_column(SimpleColumn("user"))
+        vc.append_column(SumColumn("indicator_a"))
+        vc.append_column(SumColumn("indicator_b", filters=[GT('date', 'enddate')]))
+        filter_values = {"enddate": date(2013, 2, 1)}
+        expected = vc.resolve(self.session.connection(), filter_values)
+
+        connection = AsyncConnection(self.session.connection())
+        self.assertEqual(asyncio.run(vc.aresolve(connection, filter_values)), expected)
+
+        engine = AsyncEngine(self.session.connection())
+        self.assertEqual(asyncio.run(vc.aresolve(engine, filter_values)), expected)
+        self.assertEqual(engine.connections, 2)
+
+    def test_aresolve_bound_values(self):
+        # the values bound when the statement is built are passed to the driver along with the filter values
+        vc = QueryContext("user_table", group_by=["user"], order_by=[OrderBy('user')], limit=1, start=1)
+        vc.append_column(SumWhen(whens=[['indicator_a > ?', 1, 1]], else_=0, alias='large_a'))
+        connection = AsyncConnection(self.session.connection())
+        data = asyncio.run(vc.aresolve(connection))
+        self.assertEqual(data, vc.resolve(self.session.connection()))
+        self.assertEqual(dict(data['user2']), {'user': 'user2', 'large_a': 1})
+
+        vc = QueryContext("user_table", group_by=["user"])
+        vc.append_column(SumWhen(whens=[['indicator_a > ?', 1, 1]], else_=0, alias='large_a'))
+        self.assertEqual(asyncio.run(vc.atotals(connection, ['large_a'])), {'large_a': 2})
+
+    def test_acount_and_atotals(self):
+        vc = QueryContext("user_table", filters=[EQ('user', 'username')], group_by=["user"])
+        vc.append_column(SumColumn('indicator_a'))
+        connection = AsyncConnection(self.session.connection())
+        filter_values = {'username': 'user1'}
+
+        self.assertEqual(asyncio.run(vc.acount(connection, filter_values)), 1)
+        self.assertEqual(
+            asyncio.run(vc.atotals(connection, ['indicator_a'], filter_values)),
+            {'indicator_a': 4},
+        )
+
+    def test_iter_resolve(self):
+        vc = QueryContext("region_table", group_by=["region", "sub_region"])
+        vc.append_column(SumColumn("indicator_a"))
+        rows = list(vc.iter_resolve(self.session.connection(), batch_size=2))
+        self.assertEqual(dict(rows), self._get_region_data_sum_a())
+
+    def test_iter_resolve_merges_queries(self):
+        vc = QueryContext("user_table", filters=[LT('date', 'enddate')], group_by=["user"])
+        vc.append_column(SumColumn("indicator_a"))
+        vc.append_column(SumColumn("indicator_b", filters=[GT('date', 'enddate')]))
+        filter_values = {"enddate": date(2013, 2, 1)}
+
+        rows = list(vc.iter_resolve(self.session.connection(), filter_values, batch_size=1))
+        self.assertEqual(rows, [
+            ('user1', {'user': 'user1', 'indicator_a': 1}),
+            ('user2', {'user': 'user2', 'indicator_a': 0, 'indicator_b': 1}),
+        ])
+
+    def test_iter_resolve_collation(self):
+        connection = self.session.connection()
+        savepoint = connection.begin_nested()
+        try:
+            # 'a' < 'B' with the ICU collation but not in Python
+            connection.execute('SELECT \'a\' < \'B\' COLLATE "unicode"')
+        except DBAPIError:
+            savepoint.rollback()
+            self.skipTest('the "unicode" collation requires a UTF8 database with ICU')
+        savepoint.commit()
+        connection.execute(
+            'CREATE TEMPORARY TABLE collated_table (name text COLLATE "unicode", value integer) ON COMMIT DROP'
+        )
+        connection.execute("INSERT INTO collated_table VALUES ('b', 1), ('B', 2), ('a', 3), (NULL, 4)")
+        vc = QueryContext("collated_table", group_by=["name"])
+        vc.append_column(SumColumn("value"))
+        vc.append_column(SumColumn("value", alias="large", filters=[GT('value', 'min')]))
+        filter_values = {'min': 1}
+
+        rows = list(vc.iter_resolve(connection, filter_values, batch_size=1))
+        self.assertEqual([key for key, _ in rows], ['B', 'a', 'b', None])
+        self.assertEqual(dict(rows), vc.resolve(connection, filter_values))
+
+    def test_iter_resolve_paged(self):
+        vc = QueryContext("user_table", group_by=["user"], order_by=[OrderBy('indicator_a')], limit=1)
+        vc.append_column(SumColumn("indicator_a"))
+        vc.append_column(SumColumn("indicator_b", filters=[GT('date', 'enddate')]))
+        with self.assertRaises(SqlAggException):
+            list(vc.iter_resolve(self.session.connection(), {'enddate': date(2013, 2, 1)}))
+
+    def test_iter_resolve_different_groups(self):
+        vc = QueryContext("user_table", group_by=["user"])
+        vc.append_column(SumColumn("indicator_a"))
+        vc.append_column(SumColumn("indicator_a", table_name="region_table", group_by=["region"]))
+        with self.assertRaises(SqlAggException):
+            list(vc.iter_resolve(self.session.connection()))
+
+    def _get_region_data_sum_a(self):
+        vc = QueryContext("region_table", group_by=["region", "sub_region"])
+        vc.append_column(SumColumn("indicator_a"))
+        return vc.resolve(self.session.connection())
+
+    def test_resolve_columnar(self):
+        vc = QueryContext("user_table", filters=[LT('date', 'enddate')], group_by=["user"],
+                          order_by=[OrderBy('user')])
+        vc.append_column(SimpleColumn("user"))
+        vc.append_column(SumColumn("indicator_a"))
+        vc.append_column(SumColumn("indicator_b", filters=[GT('date', 'enddate')]))
+        filter_values = {"enddate": date(2013, 2, 1)}
+
+        columns = vc.resolve_columnar(self.session.connection(), filter_values, batch_size=1)
+        data = vc.resolve(self.session.connection(), filter_values)
+        self.assertEqual(list(columns['user']), list(data))
+        self.assertEqual(columns['indicator_a'].dtype, numpy.int64)
+        self.assertEqual(list(columns['indicator_a']), [row['indicator_a'] for row in data.values()])
+        # user1 has no rows for indicator_b
+        self.assertEqual(
+            numpy.isnan(columns['indicator_b']).tolist(),
+            ['indicator_b' not in row for row in data.values()],
+        )
+
+    def test_resolve_keyset(self):
+        def get_page(page_token):
+            vc = QueryContext(
+                "user_table", order_by=[OrderBy('user'), OrderBy('date', is_ascending=False)], limit=3
+            )
+            vc.append_column(SimpleColumn('user'))
+            vc.append_column(SimpleColumn('date'))
+            vc.append_column(SimpleColumn('indicator_a'))
+            return vc.resolve_keyset(self.session.connection(), page_token=page_token)
+
+        data, token = get_page(None)
+        self.assertEqual([(row['user'], row['indicator_a']) for row in data.values()], [
+            ('user1', 3), ('user1', 1), ('user2', 2),
+        ])
+        data, token = get_page(token)
+        self.assertEqual([(row['user'], row['indicator_a']) for row in data.values()], [('user2', 0)])
+        self.assertIsNone(token)
+
+    def test_resolve_keyset_grouped_by_aggregate(self):
+        def get_page(page_token):
+            vc = QueryContext(
+                "region_table", group_by=['region', 'sub_region'],
+                order_by=[OrderBy('indicator_a', is_ascending=False)], limit=2
+            )
+            vc.append_column(SumColumn('indicator_a'))
+            return vc.resolve_keyset(self.session.connection(), page_token=page_token)
+
+        data, token = get_page(None)
+        self.assertEqual(list(data), [('region1', 'region1_b'), ('region2', 'region2_a')])
+        data, token = get_page(token)
+        self.assertEqual(list(data), [('region1', 'region1_a')])
+        self.assertIsNone(token)
+
+    def test_resolve_keyset_nulls(self):
+        connection = self.session.connection()
+        connection.execute(
+            "CREATE TEMPORARY TABLE nullable_table (name text, value integer) ON COMMIT DROP"
+        )
+        connection.execute(
+            "INSERT INTO nullable_table VALUES ('a', 1), (NULL, 2), ('b', NULL), ('c', 3), (NULL, NULL), ('d', 4)"
+        )
+        for order_by in [
+            [OrderBy('name'), OrderBy('value')],
+            [OrderBy('name', is_ascending=False), OrderBy('value', is_ascending=False)],
+            [OrderBy('value', is_ascending=False), OrderBy('name')],
+        ]:
+            vc = QueryContext("nullable_table", order_by=order_by, limit=2)
+            vc.append_column(SimpleColumn('name'))
+            vc.append_column(SimpleColumn('value'))
+            rows, token = [], None
+            while True:
+                data, token = vc.resolve_keyset(connection, page_token=token)
+                rows.extend((row['name'], row['value']) for row in data.values())
+                if token is None:
+                    break
+
+            vc = QueryContext("nullable_table", order_by=order_by)
+            vc.append_column(SimpleColumn('name'))
+            vc.append_column(SimpleColumn('value'))
+            self.assertEqual(rows, [(row['name'], row['value']) for row in vc.resolve(connection).values()])
+
+    def test_resolve_keyset_invalid_token(self):
+        vc = QueryContext("user_table", order_by=[OrderBy('user')], limit=3)
+        vc.append_column(SimpleColumn('user'))
+        with self.assertRaises(SqlAggException):
+            vc.resolve_keyset(self.session.connection(), page_token='not a token')
+
+    def test_resolve_page(self):
+        def get_page(start):
+            vc = QueryContext(
+                "region_table", group_by=['region', 'sub_region'],
+                order_by=[OrderBy('region'), OrderBy('sub_region')], start=start, limit=2
+            )
+            vc.append_column(SumColumn('indicator_a'))
+            vc.append_column(SumColumn('indicator_b'))
+            return vc.resolve_page(self.session.connection(), ['indicator_a', 'indicator_b'])
+
+        page = get_page(0)
+        self.assertEqual(list(page.data), [('region1', 'region1_a'), ('region1', 'region1_b')])
+        self.assertEqual(page.data[('region1', 'region1_b')]['indicator_a'], 4)
+        self.assertEqual(page.count, 3)
+        self.assertEqual(page.totals, {'indicator_a': 7, 'indicator_b': 4})
+
+        page = get_page(2)
+        self.assertEqual(list(page.data), [('region2', 'region2_a')])
+        self.assertEqual((page.count, page.totals), (3, {'indicator_a': 7, 'indicator_b': 4}))
+
+    def test_resolve_page_past_end(self):
+        vc = QueryContext("user_table", filters=[EQ('user', 'username')], group_by=['user'], start=5, limit=2)
+        vc.append_column(SumColumn('indicator_a'))
+        page = vc.resolve_page(self.session.connection(), ['indicator_a'], {'username': 'user1'})
+        self.assertEqual(page, ({}, 1, {'indicator_a': 4}))
+
+    def test_grouping_sets_rollup(self):
+        vc = QueryContext("region_table", group_by=['region', 'sub_region'], grouping_sets=ROLLUP)
+        vc.append_column(SumColumn('indicator_a'))
+        vc.append_column(SumColumn('indicator_b', filters=[GT('date', 'date')]))
+        data = vc.resolve(self.session.connection(), {'date': date(2013, 1, 1)})
+
+        self.assertEqual(list(data), [('region', 'sub_region'), ('region',), ()])
+        self.assertEqual(data[('region', 'sub_region')][('region1', 'region1_b')]['indicator_a'], 4)
+        self.assertEqual(data[('region',)]['region1']['indicator_a'], 5)
+        self.assertEqual(data[('region',)]['region1']['indicator_b'], 2)
+        self.assertIsNone(data[('region',)]['region1']['sub_region'])
+        self.assertEqual(dict(data[()][0]), {
+            'region': None, 'sub_region': None, 'indicator_a': 7, 'indicator_b': 2
+        })
+
+    def test_grouping_sets_real_nulls(self):
+        vc = QueryContext("user_table", group_by=['user', 'indicator_c'], grouping_sets=ROLLUP)
+        vc.append_column(SumColumn('indicator_a'))
+        data = vc.resolve(self.session.connection())
+
+        self.assertEqual(data[('user', 'indicator_c')][('user1', None)]['indicator_a'], 3)
+        self.assertEqual(data[('user', 'indicator_c')][('user1', 1)]['indicator_a'], 1)
+        self.assertEqual(data[('user',)]['user1']['indicator_a'], 4)
+        self.assertEqual(data[()][0]['indicator_a'], 6)
+
+    def test_grouping_sets_explicit_and_cube(self):
+        vc = QueryContext(
+            "region_table", group_by=['region', 'sub_region'], grouping_sets=[['sub_region'], ['region'], []]
+        )
+        vc.append_column(SumColumn('indicator_a'))
+        data = vc.resolve(self.session.connection())
+        self.assertEqual(list(data), [('sub_region',), ('region',), ()])
+        self.assertEqual(data[('sub_region',)]['region1_b']['indicator_a'], 4)
+        self.assertEqual(data[()][0]['indicator_a'], 7)
+
+        vc = QueryContext("region_table", group_by=['region', 'sub_region'], grouping_sets=CUBE)
+        vc.append_column(SumColumn('indicator_a'))
+        data = vc.resolve(self.session.connection())
+        self.assertEqual(list(data), [('region', 'sub_region'), ('region',), ('sub_region',), ()])
+        self.assertEqual(data[('sub_region',)]['region2_a']['indicator_a'], 2)
+
+    def test_grouping_sets_invalid(self):
+        for grouping_sets in ([['sub_region']], [['region'], []]):
+            vc = QueryContext("region_table", group_by=['region', 'sub_region'], grouping_sets=grouping_sets)
+            vc.append_column(SumColumn('indicator_a'))
+            with self.assertRaises(SqlAggException):
+                vc.resolve(self.session.connection())
+
+        vc = QueryContext("region_table", group_by=['region'], grouping_sets=ROLLUP, limit=2)
+        vc.append_column(SumColumn('indicator_a'))
+        with self.assertRaises(SqlAggException):
+            vc.resolve_page(self.session.connection())
+
+    def test_result_cache(self):
+        cache = ResultCache()
+
+        def resolve(enddate):
+            vc = QueryContext("user_table", filters=[LT('date', 'enddate')], group_by=["user"], result_cache=cache)
+            vc.append_column(SumColumn('indicator_a'))
+            return vc.resolve(self.session.connection(), {'enddate': enddate})
+
+        self.assertEqual(resolve(date(2013, 2, 1))['user1']['indicator_a'], 1)
+        self.assertEqual(resolve(date(2013, 2, 1))['user1']['indicator_a'], 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        self.assertEqual(resolve(date(2013, 3, 1))['user1']['indicator_a'], 4)
+        self.assertEqual(cache.misses, 2)
+
+        self.session.connection().execute("UPDATE user_table SET indicator_a = indicator_a + 1")
+        self.assertEqual(resolve(date(2013, 2, 1))['user1']['indicator_a'], 1)
+        cache.invalidate('user_table')
+        self.assertEqual(resolve(date(2013, 2, 1))['user1']['indicator_a'], 2)
+
+    def test_result_cache_bound_values(self):
+        cache = ResultCache()
+        connection = self.session.connection()
+        results = []
+        for user in ('user1', 'user2'):
+            vc = QueryContext("user_table", group_by=["user"], result_cache=cache)
+            vc.append_column(SumWhen('user', whens=[[user, 1]], else_=0, alias='matches'))
+            results.append({key: row['matches'] for key, row in vc.resolve(connection).items()})
+        self.assertEqual(results, [{'user1': 2, 'user2': 0}, {'user1': 0, 'user2': 2}])
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+
+    def test_result_cache_stale_while_revalidate(self):
+        connection = self.session.connection()
+        cache = ResultCache(ttl=10, stale_ttl=60, engine=connection)
+
+        def resolve():
+            vc = QueryContext("user_table", group_by=["user"], result_cache=cache)
+            vc.append_column(SumColumn('indicator_a'))
+            return vc.resolve(connection)
+
+        self.assertEqual(resolve()['user1']['indicator_a'], 4)
+        connection.execute("UPDATE user_table SET indicator_a = indicator_a + 1")
+        cache.clock = lambda: time.time() + 11
+        self.assertEqual(resolve()['user1']['indicator_a'], 4)
+        cache.wait()
+        self.assertEqual(resolve()['user1']['indicator_a'], 6)
+        self.assertEqual((cache.stale_hits, cache.refreshes), (1, 1))
+
+    def test_resolve_incremental(self):
+        connection = self.session.connection()
+        vc = QueryContext("user_table", group_by=['user'], order_by=[OrderBy('user')])
+        vc.append_column(SumColumn('indicator_a'))
+        vc.append_column(CountColumn('indicator_c'))
+        vc.append_column(MeanColumn('indicator_b', alias='mean_b'))
+        vc.append_column(MinColumn('indicator_c', alias='min_c', filters=[LT('date', 'enddate')]))
+
+        filter_values = {'enddate': date(2014, 1, 1)}
+        data, changed = vc.resolve_incremental(connection, 'date', filter_values)
+        self.assertEqual(changed, {'user1', 'user2'})
+        self.assertEqual(dict(data['user1']), {
+            'user': 'user1', 'indicator_a': 4, 'indicator_c': 1, 'mean_b': 0.5, 'min_c': 1
+        })
+
+        data, changed = vc.resolve_incremental(connection, 'date', filter_values)
+        self.assertEqual(changed, set())
+        self.assertEqual(data['user1']['indicator_a'], 4)
+
+        connection.execute(
+            "INSERT INTO user_table VALUES ('user2', '2013-04-01', 10, 4, 1, 0), ('user3', '2013-04-01', 1, 1, 1, 1)"
+        )
+        data, changed = vc.resolve_incremental(connection, 'date', filter_values)
+        self.assertEqual(changed, {'user2', 'user3'})
+        self.assertEqual(list(data), ['user1', 'user2', 'user3'])
+        self.assertEqual(dict(data['user2']), {
+            'user': 'user2', 'indicator_a': 12, 'indicator_c': 2, 'mean_b': Decimal(8) / 3, 'min_c': 1
+        })
+        self.assertEqual(data['user1']['indicator_a'], 4)
+        expected = vc.resolve(connection, filter_values)
+        for key, row in data.items():
+            self.assertEqual(float(row.pop('mean_b')), float(expected[key].pop('mean_b')))
+            self.assertEqual(dict(row), dict(expected[key]))
+
+        data, changed = vc.resolve_incremental(connection, 'date', {'enddate': date(2013, 2, 1)})
+        self.assertEqual(changed, {'user1', 'user2', 'user3'})
+        self.assertEqual(data['user2']['indicator_a'], 12)
+        self.assertNotIn('min_c', data['user3'])
+
+    def test_resolve_incremental_order(self):
+        connection = self.session.connection()
+        vc = QueryContext("user_table", group_by=['user'], order_by=[OrderBy('user')])
+        vc.append_column(SumColumn('indicator_a'))
+        vc.resolve_incremental(connection, 'date')
+
+        connection.execute("INSERT INTO user_table VALUES ('user0', '2013-04-01', 1, 1, 1, 1)")
+        data, changed = vc.resolve_incremental(connection, 'date')
+        self.assertEqual(changed, {'user0'})
+        self.assertEqual(list(data), ['user0', 'user1', 'user2'])
+
+    def test_resolve_incremental_unkeyable_filter_values(self):
+        connection = self.session.connection()
+        vc = QueryContext("user_table", filters=[GT('indicator_a', 'min')], group_by=['user'])
+        vc.append_column(SumColumn('indicator_a'))
+        filter_values = {'min': 0, 'request_id': uuid.uuid4()}
+        data, changed = vc.resolve_incremental(connection, 'date', filter_values)
+        self.assertEqual(changed, {'user1', 'user2'})
+        data, changed = vc.resolve_incremental(connection, 'date', filter_values)
+        self.assertEqual(changed, {'user1', 'user2'})
+        self.assertEqual(data['user1']['indicator_a'], 4)
+
+    def test_resolve_incremental_not_mergeable(self):
+        connection = self.session.connection()
+        vc = QueryContext("user_table", group_by=['user'])
+        vc.append_column(SumColumn('indicator_a'))
+        vc.append_column(StdDevColumn('indicator_b'))
+        data, changed = vc.resolve_incremental(connection, 'date')
+        self.assertEqual(changed, {'user1', 'user2'})
+
+        data, changed = vc.resolve_incremental(connection, 'date')
+        self.assertEqual(changed, {'user1', 'user2'})
+        self.assertAlmostEqual(float(data['user1']['indicator_b']), 0.7071, 4)
+
+    def test_resolve_shards(self):
+        connection = self.session.connection()
+        vc = QueryContext("user_table", group_by=['user'], order_by=[OrderBy('indicator_a', is_ascending=False)])
+        vc.append_column(SumColumn('indicator_a'))
+        vc.append_column(CountColumn('indicator_c'))
+        vc.append_column(MeanColumn('indicator_b', alias='mean_b'))
+        vc.append_column(CountUniqueColumn('date', alias='dates'))
+        vc.append_column(NonzeroSumColumn('indicator_c', alias='nonzero_c'))
+        vc.append_column(ArrayAggColumn('indicator_a', order_by_col='date', alias='a_by_date'))
+        vc.append_column(SumWhen('indicator_d', whens=[[0, 1]], else_=0, alias='zero_d'))
+        vc.append_column(MinColumn('indicator_a', alias='min_a', filters=[LT('date', 'enddate')]))
+
+        filter_values = {'enddate': date(2013, 2, 1)}
+        data = vc.resolve_shards([connection, connection], filter_values)
+        self.assertEqual(list(data), ['user1', 'user2'])
+        self.assertEqual(dict(data['user1']), {
+            'user': 'user1', 'indicator_a': 8, 'indicator_c': 2, 'mean_b': Decimal('0.5'), 'dates': 2,
+            'nonzero_c': 1, 'a_by_date': [1, 1, 3, 3], 'zero_d': 2, 'min_a': 1,
+        })
+        self.assertEqual(data['user2']['a_by_date'], [0, 0, 2, 2])
+
+        with self.assertRaises(SqlAggException):
+            vc.append_column(StdDevColumn('indicator_b', alias='stddev_b'))
+            vc.resolve_shards([connection], filter_values)
+
+    def test_resolve_partitioned(self):
+        connection = self.session.connection()
+        vc = QueryContext(
+            "user_table", filters=[LT('date', 'enddate')], group_by=['user'], order_by=[OrderBy('user')]
+        )
+        vc.append_column(SumColumn('indicator_a'))
+        vc.append_column(MeanColumn('indicator_b', alias='mean_b'))
+        vc.append_column(CountColumn('indicator_c', filters=[EQ('user', 'username')]))
+        filter_values = {'enddate': date(2013, 3, 1), 'username': 'user1'}
+        expected = vc.resolve(connection, filter_values)
+
+        bounds = vc.partition_bounds(connection, 'date', 2, filter_values)
+        self.assertEqual(bounds, [date(2013, 1, 1)])
+        for bounds in ([], [date(2013, 1, 1)], [date(2013, 1, 15), date(2013, 2, 1), date(2014, 1, 1)]):
+            # a connection hands out branches of itself so it can stand in for an engine
+            data = vc.resolve_partitioned(connection, 'date', bounds, filter_values, max_workers=2)
+            self.assertEqual(list(data), list(expected))
+            for key, row in expected.items():
+                row, partitioned_row = dict(row), dict(data[key])
+                self.assertEqual(float(partitioned_row.pop('mean_b')), float(row.pop('mean_b')))
+                self.assertEqual(partitioned_row, row)
+
+        with self.assertRaises(SqlAggException):
+            vc.resolve_partitioned(connection, 'date', [date(2013, 2, 1), date(2013, 1, 1)], filter_values)
+
+    def test_resolve_many(self):
+        connection = self.session.connection()
+        vc = QueryContext(
+            "user_table", filters=[LT('date', 'enddate')], group_by=['user'],
+            order_by=[OrderBy('user', is_ascending=False)]
+        )
+        vc.append_column(SimpleColumn('user'))
+        vc.append_column(SumColumn('indicator_a'))
+        vc.append_column(SumWhen(whens=[['indicator_b > ?', 1, 1]], else_=0, alias='large_b'))
+        vc.append_column(CountColumn('indicator_c', filters=[EQ('user', 'username')]))
+        filter_values_list = [
+            {'enddate': date(2013, 1, 1), 'username': 'user1'},
+            {'enddate': date(2013, 2, 1), 'username': 'user2'},
+            {'enddate': date(2013, 3, 1), 'username': 'user1'},
+        ]
+        results = vc.resolve_many(connection, filter_values_list)
+        self.assertEqual(len(results), 3)
+        for filter_values, data in zip(filter_values_list, results):
+            expected = vc.resolve(connection, filter_values)
+            self.assertEqual(list(data), list(expected))
+            self.assertEqual({key: dict(row) for key, row in data.items()}, expected)
+        self.assertEqual(vc.resolve_many(connection, []), [])
+
+        vc = QueryContext("user_table", filters=[LT('date', 'enddate')], limit=1, order_by=[OrderBy('date')])
+        vc.append_column(SimpleColumn('user'))
+        vc.append_column(SimpleColumn('date'))
+        results = vc.resolve_many(connection, filter_values_list)
+        self.assertEqual([[row['date'] for row in data.values()] for data in results], [
+            [], [date(2013, 1, 1)], [date(2013, 1, 1)]
+        ])
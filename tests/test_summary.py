@@ -0,0 +1,95 @@
+from datetime import date
+
+from sqlalchemy import event
+
+from sqlagg import QueryContext
+from sqlagg.columns import CountColumn, MaxColumn, SumColumn
+from sqlagg.filters import GTE
+from sqlagg.sorting import OrderBy
+from sqlagg.summary import SummaryTable
+from . import DataTestCase
+from .models import region_table
+
+
+class TestSummaryTable(DataTestCase):
+
+    def setUp(self):
+        super(TestSummaryTable, self).setUp()
+        self.connection = self.session.connection()
+        self.filter_values = {'start': date(2013, 1, 1)}
+        self.vc = QueryContext(
+            "region_table", filters=[GTE('date', 'start')], group_by=['region'], order_by=[OrderBy('region')]
+        )
+        self.vc.append_column(SumColumn('indicator_a'))
+        self.vc.append_column(CountColumn('indicator_a', alias='a_count'))
+        self.vc.append_column(MaxColumn('date', alias='last_date'))
+        self.summary = SummaryTable('region_summary', self.vc, 'date', self.filter_values)
+        self.summary.create(self.connection)
+        self.vc.summary = self.summary
+
+    def _insert(self, **values):
+        values = dict({'indicator_a': 1, 'indicator_b': 1}, **values)
+        self.connection.execute(region_table.insert().values(values))
+
+    def test_resolve_reads_summary(self):
+        data = self.vc.resolve(self.connection, self.filter_values)
+        self.assertEqual(dict(data['region1']), {
+            'region': 'region1', 'indicator_a': 5, 'a_count': 4, 'last_date': date(2013, 3, 1)
+        })
+        self.assertEqual(list(data), ['region1', 'region2'])
+
+        self._insert(region='region1', sub_region='region1_a', date=date(2013, 4, 1))
+        self.assertEqual(self.vc.resolve(self.connection, self.filter_values)['region1']['indicator_a'], 5)
+        # other filter values are read from the base table
+        self.assertEqual(self.vc.resolve(self.connection, {'start': date(2013, 2, 1)})['region1']['indicator_a'], 3)
+
+    def test_incremental_refresh(self):
+        self.assertEqual(self.summary.refresh(self.connection), 0)
+
+        self._insert(region='region1', sub_region='region1_a', date=date(2013, 4, 1))
+        self._insert(region='region3', sub_region='region3_a', date=date(2013, 4, 1))
+        self.connection.execute("UPDATE region_summary SET indicator_a = -1 WHERE region = 'region2'")
+        self.assertEqual(self.summary.refresh(self.connection), 2)
+
+        data = self.vc.resolve(self.connection, self.filter_values)
+        self.assertEqual(data['region1']['indicator_a'], 6)
+        self.assertEqual(data['region1']['a_count'], 5)
+        self.assertEqual(data['region1']['last_date'], date(2013, 4, 1))
+        self.assertEqual(data['region3']['indicator_a'], 1)
+        # groups without new rows aren't recomputed
+        self.assertEqual(data['region2']['indicator_a'], -1)
+
+    def test_refresh_rows_added_during_refresh(self):
+        added = []
+
+        def add_row(conn, cursor, statement, parameters, context, executemany):
+            # a row committed after the highest watermark of the base table was read
+            if not added and statement.startswith('SELECT max(date)') and 'region_table' in statement:
+                added.append(statement)
+                conn.connection.cursor().execute(
+                    "INSERT INTO region_table (region, sub_region, date, indicator_a, indicator_b) "
+                    "VALUES ('region1', 'region1_a', '2013-05-01', 1, 1)"
+                )
+
+        self._insert(region='region1', sub_region='region1_a', date=date(2013, 4, 1))
+        event.listen(self.connection, 'after_cursor_execute', add_row)
+        self.addCleanup(event.remove, self.connection, 'after_cursor_execute', add_row)
+        self.summary.refresh(self.connection)
+        self.assertTrue(added)
+
+        self._insert(region='region2', sub_region='region2_a', date=date(2013, 4, 15))
+        self.summary.refresh(self.connection)
+        self.vc.summary = None
+        expected = self.vc.resolve(self.connection, self.filter_values)
+        self.assertEqual(
+            [dict(row) for row in self.summary.execute(self.connection)],
+            [dict(row) for row in expected.values()],
+        )
+
+    def test_full_refresh_without_watermark(self):
+        summary = SummaryTable('region_full_summary', self.vc, filter_values=self.filter_values)
+        summary.create(self.connection)
+        self._insert(region='region3', sub_region='region3_a', date=date(2013, 4, 1))
+        self.assertEqual(summary.refresh(self.connection), 3)
+        rows = summary.execute(self.connection)
+        self.assertEqual([row['region'] for row in rows], ['region1', 'region2', 'region3'])